@@ -28,14 +28,28 @@ config.EVENT_MAX_ROUND = int(os.getenv('EVENT_MAX_ROUND', 3))
 
 # Expert Service Worker Intervals (seconds)
 config.EXPERT_EXECUTION_SUMMARY_INTERVAL = int(os.getenv('EXPERT_EXECUTION_SUMMARY_INTERVAL', 10))
+# 执行结果批量摘要：每批最多条数（1为关闭批量）、每批执行结果的token预算、可参与批量的单条结果token上限
+config.EXPERT_SUMMARY_BATCH_MAX_ITEMS = int(os.getenv('EXPERT_SUMMARY_BATCH_MAX_ITEMS', 10))
+config.EXPERT_SUMMARY_BATCH_TOKEN_BUDGET = int(os.getenv('EXPERT_SUMMARY_BATCH_TOKEN_BUDGET', 8000))
+config.EXPERT_SUMMARY_BATCH_ITEM_MAX_TOKENS = int(os.getenv('EXPERT_SUMMARY_BATCH_ITEM_MAX_TOKENS', 2000))
+# 执行结果摘要线程数；认领后超过该秒数仍未完成摘要的执行结果重新放回待处理（应大于单次LLM调用的最长耗时）
+config.EXPERT_SUMMARY_WORKERS = int(os.getenv('EXPERT_SUMMARY_WORKERS', 4))
+config.EXPERT_SUMMARY_CLAIM_TIMEOUT = int(os.getenv('EXPERT_SUMMARY_CLAIM_TIMEOUT', 1800))
 config.EXPERT_COMMAND_STATUS_INTERVAL = int(os.getenv('EXPERT_COMMAND_STATUS_INTERVAL', 10))
 config.EXPERT_TASK_STATUS_INTERVAL = int(os.getenv('EXPERT_TASK_STATUS_INTERVAL', 15))
 config.EXPERT_EVENT_ROUND_STATUS_INTERVAL = int(os.getenv('EXPERT_EVENT_ROUND_STATUS_INTERVAL', 20))
 config.EXPERT_EVENT_SUMMARY_INTERVAL = int(os.getenv('EXPERT_EVENT_SUMMARY_INTERVAL', 30))
+# 事件总结默认增量生成（上一条总结的滚动摘要 + 新增执行结果）；设为true时每次按事件全部数据重建。滚动摘要的字数上限
+config.EXPERT_EVENT_SUMMARY_FULL_REBUILD = os.getenv('EXPERT_EVENT_SUMMARY_FULL_REBUILD', 'False').lower() == 'true'
+config.EXPERT_EVENT_DIGEST_MAX_CHARS = int(os.getenv('EXPERT_EVENT_DIGEST_MAX_CHARS', 1500))
 config.EXPERT_EVENT_NEXT_ROUND_INTERVAL = int(os.getenv('EXPERT_EVENT_NEXT_ROUND_INTERVAL', 25))
 
 
-config.EXPERT_LIFECYCLE_INTERVAL  = int(os.getenv('EXPERT_LIFECYCLE_INTERVAL', 10)) 
+# 事件生命周期：每批认领的状态变更记录数、全量扫描间隔、状态停留时长统计的日志间隔、已处理变更记录的保留天数
+config.EXPERT_LIFECYCLE_BATCH = int(os.getenv('EXPERT_LIFECYCLE_BATCH', 100))
+config.EXPERT_LIFECYCLE_SWEEP_INTERVAL = int(os.getenv('EXPERT_LIFECYCLE_SWEEP_INTERVAL', 300))
+config.EXPERT_LIFECYCLE_METRICS_LOG_INTERVAL = int(os.getenv('EXPERT_LIFECYCLE_METRICS_LOG_INTERVAL', 300))
+config.EXPERT_TRANSITION_RETENTION_DAYS = int(os.getenv('EXPERT_TRANSITION_RETENTION_DAYS', 7))
 config.EXPERT_LIFECYCLE_INTERVAL_ERROR = int(os.getenv('EXPERT_LIFECYCLE_INTERVAL_ERROR', 15))
 
 # 其他配置
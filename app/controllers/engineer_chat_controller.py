@@ -1,6 +1,6 @@
-from flask import request, jsonify
+from flask import request, jsonify, current_app
 from app.models import Message, db, Event, Summary, User
-from app.services.llm_service import call_llm
+from app.services.llm_service import call_llm_stream
 from app.utils.mq_utils import RabbitMQPublisher
 import json
 import traceback
@@ -8,15 +8,19 @@ from datetime import datetime
 import uuid
 import logging
 import hashlib
+import time
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
+ENGINEER_CHAT_SYSTEM_PROMPT = "你是DeepSOC安全运营中心的AI助手，专门协助安全工程师处理安全事件。请基于提供的事件信息和对话历史，为工程师提供专业的安全建议和协助。"
+
 class EngineerChatController:
     """工程师对话控制器 - 与Agent系统完全隔离"""
     
     def __init__(self):
         self.max_chat_rounds = 10  # 最大对话轮次
+        self.stream_emit_interval = 0.1  # 流式输出时合并增量内容的推送间隔（秒）
     
     def send_message(self, event_id, user_id, message):
         """
@@ -84,9 +88,12 @@ class EngineerChatController:
                     'created_at': event.created_at.isoformat() if event.created_at else None
                 }
             
+            # 在请求上下文中获取正在运行的SocketIO实例，供异步线程推送流式输出
+            socketio_ext = current_app.extensions.get('socketio')
+            
             ai_thread = threading.Thread(
                 target=self._process_ai_response_async,
-                args=(event_id, session_id, message, summary_data, event_data, summary_updated),
+                args=(event_id, session_id, message, summary_data, event_data, summary_updated, socketio_ext),
                 daemon=True
             )
             ai_thread.start()
@@ -108,7 +115,7 @@ class EngineerChatController:
                 'message': f"处理消息时出错: {str(e)}"
             }
     
-    def _process_ai_response_async(self, event_id, session_id, user_message, summary_data, event_data, summary_updated):
+    def _process_ai_response_async(self, event_id, session_id, user_message, summary_data, event_data, summary_updated, socketio_ext=None):
         """
         异步处理AI回复 - 在独立线程中运行，需要创建应用上下文
         """
@@ -126,10 +133,11 @@ class EngineerChatController:
                 # 2. 构建对话上下文
                 context = self._build_context_from_data(chat_history, user_message, summary_data, event_data, summary_updated)
                 
-                # 3. 调用AI服务
-                ai_response = self._call_ai_service(context)
+                # 3. 流式调用AI服务，增量内容实时推送到前端
+                stream_id = uuid.uuid4().hex
+                ai_response = self._call_ai_service_stream(context, event_id, session_id, stream_id, socketio_ext)
                 
-                # 4. 保存AI回复到Message表
+                # 4. 保存AI回复到Message表（携带stream_id，前端据此替换流式输出的临时消息）
                 summary_hash = self._get_summary_hash_from_data(summary_data) if summary_data else None
                 ai_message = self._save_message_to_unified_table(
                     event_id=event_id,
@@ -138,7 +146,8 @@ class EngineerChatController:
                     content=ai_response,
                     message_category='engineer_chat',
                     session_id=session_id,
-                    summary_version=summary_hash
+                    summary_version=summary_hash,
+                    extra_content={'stream_id': stream_id}
                 )
                 
                 # 5. 通过WebSocket广播AI回复
@@ -371,23 +380,54 @@ class EngineerChatController:
         content_to_hash = f"{summary_content}_{round_id}"
         return hashlib.md5(content_to_hash.encode()).hexdigest()[:16]
     
-    def _call_ai_service(self, context):
-        """独立的AI调用"""
+    def _call_ai_service_stream(self, context, event_id, session_id, stream_id, socketio_ext=None):
+        """流式AI调用，增量内容通过SocketIO实时推送到作战室
+        
+        Returns:
+            完整的AI回复文本
+        """
+        parts = []
+        pending = []
+        last_emit = time.monotonic()
         try:
-            # 使用现有的call_llm函数
-            system_prompt = "你是DeepSOC安全运营中心的AI助手，专门协助安全工程师处理安全事件。请基于提供的事件信息和对话历史，为工程师提供专业的安全建议和协助。"
-            user_prompt = context
-            
-            # 调用LLM服务
-            response = call_llm(system_prompt, user_prompt)
-            return response
+            for delta in call_llm_stream(ENGINEER_CHAT_SYSTEM_PROMPT, context, role='engineer_chat'):
+                parts.append(delta)
+                pending.append(delta)
+                # 合并短时间内到达的增量，避免逐token推送造成WebSocket风暴
+                if time.monotonic() - last_emit >= self.stream_emit_interval:
+                    self._emit_stream_chunk(socketio_ext, event_id, session_id, stream_id, ''.join(pending))
+                    pending = []
+                    last_emit = time.monotonic()
+            if pending:
+                self._emit_stream_chunk(socketio_ext, event_id, session_id, stream_id, ''.join(pending))
+            self._emit_stream_chunk(socketio_ext, event_id, session_id, stream_id, '', done=True)
+            return ''.join(parts)
             
         except Exception as e:
-            logger.error(f"AI调用失败: {str(e)}")
+            logger.error(f"AI流式调用失败: {str(e)}")
+            self._emit_stream_chunk(socketio_ext, event_id, session_id, stream_id, '', done=True)
+            if parts:
+                return ''.join(parts) + f"\n\n（回复生成中断，错误信息: {str(e)}）"
             return f"抱歉，AI助手暂时不可用。错误信息: {str(e)}"
     
+    def _emit_stream_chunk(self, socketio_ext, event_id, session_id, stream_id, delta, done=False):
+        """推送流式输出的增量内容（工程师对话在Web进程内处理，直接使用SocketIO）"""
+        if not socketio_ext:
+            return
+        try:
+            socketio_ext.emit('chat_stream', {
+                'event_id': event_id,
+                'session_id': session_id,
+                'stream_id': stream_id,
+                'delta': delta,
+                'done': done
+            }, room=event_id)
+        except Exception as e:
+            logger.error(f"推送流式内容失败: {str(e)}")
+    
     def _save_message_to_unified_table(self, event_id, sender_id, sender_type, 
-                                      content, message_category, session_id, summary_version):
+                                      content, message_category, session_id, summary_version,
+                                      extra_content=None):
         """保存消息到统一的Message表"""
         try:
             # 构建消息内容
@@ -395,6 +435,8 @@ class EngineerChatController:
                 'content': content,
                 'timestamp': datetime.utcnow().isoformat()
             }
+            if extra_content:
+                message_content.update(extra_content)
             
             message = Message(
                 message_id=str(uuid.uuid4()),
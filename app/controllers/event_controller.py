@@ -4,6 +4,7 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models import db, Event
 from app.utils.message_utils import create_standard_message
+from app.utils.work_queue import notify_work
 
 event_bp = Blueprint('event', __name__)
 
@@ -36,6 +37,7 @@ def create_event():
     
     db.session.add(event)
     db.session.commit()
+    notify_work('_captain', event_id=event_id)
     
     # 创建系统消息，通知事件已创建
     system_message_content = {
@@ -0,0 +1,81 @@
+import math
+from datetime import datetime, timedelta
+
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+from sqlalchemy import func, case
+from app.models import db
+from app.models.models import LLMRecord
+import logging
+
+llm_stats_bp = Blueprint('llm_stats', __name__)
+logger = logging.getLogger(__name__)
+
+MAX_STATS_HOURS = 24 * 365
+
+
+def _ratio(part, total):
+    return round(part / total, 4) if total else 0.0
+
+
+@llm_stats_bp.route('/cache-stats', methods=['GET'])
+@jwt_required()
+def cache_stats():
+    """按角色统计LLM缓存命中情况
+
+    查询参数:
+        hours: 统计最近多少小时的记录，默认24，取值 (0, 24*365]
+
+    统计项:
+        - provider_cached_ratio: 服务商前缀缓存命中的token占提示词token的比例（cached_tokens / prompt_tokens）
+        - response_cache_hits / response_cache_hit_ratio: 本地响应缓存命中次数及比例
+        - shared_calls: 与并发相同请求合并、共享结果的调用次数
+    """
+    try:
+        hours = float(request.args.get('hours', 24))
+    except ValueError:
+        hours = None
+    # 拒绝 nan/inf 和超出范围的值，否则 timedelta 会抛出 ValueError / OverflowError
+    if hours is None or not math.isfinite(hours) or not 0 < hours <= MAX_STATS_HOURS:
+        return jsonify({'status': 'error', 'message': 'Invalid hours'}), 400
+    since = datetime.utcnow() - timedelta(hours=hours)
+
+    rows = db.session.query(
+        LLMRecord.role,
+        func.count(LLMRecord.id),
+        func.coalesce(func.sum(LLMRecord.prompt_tokens), 0),
+        func.coalesce(func.sum(LLMRecord.completion_tokens), 0),
+        func.coalesce(func.sum(LLMRecord.cached_tokens), 0),
+        func.sum(case((LLMRecord.cached_tokens > 0, 1), else_=0)),
+        func.sum(case((LLMRecord.cache_status == 'hit', 1), else_=0)),
+        func.sum(case((LLMRecord.cache_status == 'shared', 1), else_=0)),
+    ).filter(
+        LLMRecord.created_at >= since
+    ).group_by(LLMRecord.role).all()
+
+    roles = []
+    totals = {'calls': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'response_cache_hits': 0}
+    for role, calls, prompt_tokens, completion_tokens, cached_tokens, prefix_hit_calls, hits, shared in rows:
+        prompt_tokens = int(prompt_tokens or 0)
+        cached_tokens = int(cached_tokens or 0)
+        hits = int(hits or 0)
+        roles.append({
+            'role': role or 'unknown',
+            'calls': calls,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': int(completion_tokens or 0),
+            'cached_tokens': cached_tokens,
+            'provider_cached_ratio': _ratio(cached_tokens, prompt_tokens),
+            'provider_cache_hit_calls': int(prefix_hit_calls or 0),
+            'response_cache_hits': hits,
+            'response_cache_hit_ratio': _ratio(hits, calls),
+            'shared_calls': int(shared or 0),
+        })
+        totals['calls'] += calls
+        totals['prompt_tokens'] += prompt_tokens
+        totals['cached_tokens'] += cached_tokens
+        totals['response_cache_hits'] += hits
+
+    totals['provider_cached_ratio'] = _ratio(totals['cached_tokens'], totals['prompt_tokens'])
+    totals['response_cache_hit_ratio'] = _ratio(totals['response_cache_hits'], totals['calls'])
+    return jsonify({'status': 'success', 'data': {'hours': hours, 'roles': roles, 'total': totals}})
@@ -2,6 +2,7 @@ import logging
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from app.models.models import Prompt, db
+from app.prompts.generate_prompt import bump_prompt_version
 
 prompt_bp = Blueprint('prompt', __name__)
 logger = logging.getLogger(__name__)
@@ -33,6 +34,8 @@ def _save_prompt(role: str, content: str) -> None:
         prompt = Prompt(name=name)
         db.session.add(prompt)
     prompt.content = content
+    # 通知所有进程（各Agent）重新组装缓存的系统提示词
+    bump_prompt_version()
     db.session.commit()
 
 
@@ -49,6 +52,8 @@ def _save_background(name: str, content: str) -> None:
         prompt = Prompt(name=key)
         db.session.add(prompt)
     prompt.content = content
+    # 通知所有进程（各Agent）重新组装缓存的系统提示词
+    bump_prompt_version()
     db.session.commit()
 
 
@@ -5,6 +5,8 @@ from app.models.models import (
     Action,
     Command,
     Execution,
+    PlaybookActivity,
+    EventTransition,
     Message,
     Summary,
     Prompt,
@@ -19,6 +21,8 @@ __all__ = [
     'Action',
     'Command',
     'Execution',
+    'PlaybookActivity',
+    'EventTransition',
     'Message',
     'Summary',
     'Prompt',
@@ -57,6 +57,9 @@ class Event(db.Model):
     severity = db.Column(db.String(32))
     event_status = db.Column(db.String(32), default='pending')
     current_round = db.Column(db.Integer, default=1)  # 当前处理轮次，默认为1
+    claimed_by = db.Column(db.String(128))  # 认领该记录的Agent进程，处理完成后清空
+    lease_expires_at = db.Column(db.DateTime)  # 认领租约到期时间，过期后可被其他副本重新认领
+    status_changed_at = db.Column(db.DateTime, default=datetime.utcnow)  # 进入当前状态的时间，用于统计各状态停留时长
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -72,6 +75,9 @@ class Event(db.Model):
             'event_status': self.event_status,
             'status': self.event_status,  # backward compatibility
             'current_round': self.current_round,
+            'claimed_by': self.claimed_by,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
+            'status_changed_at': self.status_changed_at.isoformat() if self.status_changed_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -82,13 +88,15 @@ class Task(db.Model):
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     task_id = db.Column(db.String(64), nullable=False, unique=True)
-    event_id = db.Column(db.String(64))  # 关联的事件ID
+    event_id = db.Column(db.String(64), index=True)  # 关联的事件ID
     task_name = db.Column(db.String(256))
     task_type = db.Column(db.String(64))  # query, write, notify
     task_assignee = db.Column(db.String(64))
     task_status = db.Column(db.String(32), default='pending')
     round_id = db.Column(db.Integer)
     result = db.Column(db.JSON)
+    claimed_by = db.Column(db.String(128))  # 认领该记录的Agent进程，处理完成后清空
+    lease_expires_at = db.Column(db.DateTime)  # 认领租约到期时间，过期后可被其他副本重新认领
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -103,6 +111,8 @@ class Task(db.Model):
             'task_status': self.task_status,
             'round_id': self.round_id,
             'result': self.result,
+            'claimed_by': self.claimed_by,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -115,12 +125,14 @@ class Action(db.Model):
     action_id = db.Column(db.String(64), nullable=False, unique=True)
     task_id = db.Column(db.String(64))  # 关联的任务ID
     round_id = db.Column(db.Integer)
-    event_id = db.Column(db.String(64))  # 关联的事件ID
+    event_id = db.Column(db.String(64), index=True)  # 关联的事件ID
     action_name = db.Column(db.String(256))
     action_type = db.Column(db.String(64))
     action_assignee = db.Column(db.String(64))
     action_status = db.Column(db.String(32), default='pending')
     action_result = db.Column(db.JSON)
+    claimed_by = db.Column(db.String(128))  # 认领该记录的Agent进程，处理完成后清空
+    lease_expires_at = db.Column(db.DateTime)  # 认领租约到期时间，过期后可被其他副本重新认领
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -136,6 +148,8 @@ class Action(db.Model):
             'action_assignee': self.action_assignee,
             'action_status': self.action_status,
             'action_result': self.action_result,
+            'claimed_by': self.claimed_by,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -148,7 +162,7 @@ class Command(db.Model):
     command_id = db.Column(db.String(64), nullable=False, unique=True)
     action_id = db.Column(db.String(64))  # 关联的动作ID
     task_id = db.Column(db.String(64))  # 关联的任务ID
-    event_id = db.Column(db.String(64))  # 关联的事件ID
+    event_id = db.Column(db.String(64), index=True)  # 关联的事件ID
     round_id = db.Column(db.Integer)
     command_name = db.Column(db.String(256))
     command_type = db.Column(db.String(64))
@@ -157,6 +171,8 @@ class Command(db.Model):
     command_params = db.Column(db.JSON)
     command_status = db.Column(db.String(32), default='pending')
     command_result = db.Column(db.JSON)
+    claimed_by = db.Column(db.String(128))  # 认领该记录的Agent进程，处理完成后清空
+    lease_expires_at = db.Column(db.DateTime)  # 认领租约到期时间，过期后可被其他副本重新认领
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -174,6 +190,8 @@ class Command(db.Model):
             'command_params': self.command_params,
             'command_status': self.command_status,
             'command_result': self.command_result,
+            'claimed_by': self.claimed_by,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -187,7 +205,7 @@ class Execution(db.Model):
     command_id = db.Column(db.String(48))
     action_id = db.Column(db.String(48))
     task_id = db.Column(db.String(48))
-    event_id = db.Column(db.String(48))
+    event_id = db.Column(db.String(48), index=True)
     round_id = db.Column(db.Integer)
     execution_result = db.Column(db.Text)
     execution_summary = db.Column(db.Text)
@@ -213,6 +231,62 @@ class Execution(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class PlaybookActivity(db.Model):
+    """SOAR剧本活动表，记录已提交、等待结果的剧本执行，由Executor的调度线程轮询"""
+    __tablename__ = 'playbook_activities'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    activity_id = db.Column(db.String(64), nullable=False, index=True)  # SOAR返回的活动ID
+    command_id = db.Column(db.String(64), nullable=False, index=True)  # 关联的命令ID
+    playbook_id = db.Column(db.String(64))
+    status = db.Column(db.String(16), nullable=False, default='running')  # running, finishing（已结束、命令尚未完成）, completed, failed, timeout
+    soar_status = db.Column(db.String(32))  # 最近一次查询到的SOAR执行状态（executeStatus）
+    poll_count = db.Column(db.Integer, default=0)
+    next_poll_at = db.Column(db.DateTime, index=True)  # 下次查询时间，认领轮询时顺延作为租约
+    deadline_at = db.Column(db.DateTime)  # 超过该时间仍未完成则判定超时
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'activity_id': self.activity_id,
+            'command_id': self.command_id,
+            'playbook_id': self.playbook_id,
+            'status': self.status,
+            'soar_status': self.soar_status,
+            'poll_count': self.poll_count,
+            'next_poll_at': self.next_poll_at.isoformat() if self.next_poll_at else None,
+            'deadline_at': self.deadline_at.isoformat() if self.deadline_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class EventTransition(db.Model):
+    """事件状态变更记录（outbox），与状态变更在同一事务中写入，由Expert的事件生命周期线程消费"""
+    __tablename__ = 'event_transitions'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    event_id = db.Column(db.String(64), nullable=False, index=True)
+    round_id = db.Column(db.Integer)
+    from_status = db.Column(db.String(32))
+    to_status = db.Column(db.String(32), nullable=False)
+    dwell_seconds = db.Column(db.Float)  # 变更前在 from_status 停留的秒数
+    processed_at = db.Column(db.DateTime, index=True)  # 生命周期线程处理的时间，为空表示待处理
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'event_id': self.event_id,
+            'round_id': self.round_id,
+            'from_status': self.from_status,
+            'to_status': self.to_status,
+            'dwell_seconds': self.dwell_seconds,
+            'processed_at': self.processed_at.isoformat() if self.processed_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 class Message(db.Model):
     """消息表"""
     __tablename__ = 'messages'
@@ -261,6 +335,9 @@ class Summary(db.Model):
     round_id = db.Column(db.Integer, default=0)
     event_summary = db.Column(db.Text)
     event_suggestion = db.Column(db.Text)
+    digest = db.Column(db.Text)  # 精简的滚动摘要，作为下一次增量总结的此前战况
+    execution_watermark = db.Column(db.Integer)  # 已纳入总结的执行记录主键上限（executions.id）
+    summary_mode = db.Column(db.String(16))  # incremental / full
     # root_cause = db.Column(db.Text)
     # prevention = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -274,6 +351,9 @@ class Summary(db.Model):
             'round_id': self.round_id,
             'event_summary': self.event_summary,
             'event_suggestion': self.event_suggestion,
+            'digest': self.digest,
+            'execution_watermark': self.execution_watermark,
+            'summary_mode': self.summary_mode,
             # 'root_cause': self.root_cause,
             # 'prevention': self.prevention,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -295,6 +375,14 @@ class LLMRecord(db.Model):
     completion_tokens = db.Column(db.Integer, nullable=True)  # 完成词token数
     total_tokens = db.Column(db.Integer, nullable=True)  # 总token数
     cached_tokens = db.Column(db.Integer, nullable=True)  # 缓存token数
+    role = db.Column(db.String(32), nullable=True)  # 调用方角色
+    cache_status = db.Column(db.String(16), nullable=True)  # 响应缓存状态: hit, miss, shared(合并的并发请求), 未启用时为空
+    request_hash = db.Column(db.String(64), nullable=True, index=True)  # 请求内容哈希（缓存键）
+    retry_count = db.Column(db.Integer, nullable=True)  # 失败重试次数
+    retry_wait_seconds = db.Column(db.Float, nullable=True)  # 重试退避的总等待时间（秒）
+    endpoint = db.Column(db.String(64), nullable=True)  # 实际处理请求的LLM接口名称
+    estimated_prompt_tokens = db.Column(db.Integer, nullable=True)  # 发送前估算的提示词token数
+    model_selection = db.Column(db.String(32), nullable=True)  # 模型选择结果，如 auto:default、auto:long_text、forced:long_text
     
     def to_dict(self):
         return {
@@ -308,10 +396,31 @@ class LLMRecord(db.Model):
             'prompt_tokens': self.prompt_tokens,
             'completion_tokens': self.completion_tokens,
             'total_tokens': self.total_tokens,
-            'cached_tokens': self.cached_tokens
+            'cached_tokens': self.cached_tokens,
+            'role': self.role,
+            'cache_status': self.cache_status,
+            'request_hash': self.request_hash,
+            'retry_count': self.retry_count,
+            'retry_wait_seconds': self.retry_wait_seconds,
+            'endpoint': self.endpoint,
+            'estimated_prompt_tokens': self.estimated_prompt_tokens,
+            'model_selection': self.model_selection
         }
 
 
+class LLMInflightLock(db.Model):
+    """跨进程的在途LLM请求锁，用于合并多个进程中的相同请求"""
+    __tablename__ = 'llm_inflight_locks'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    request_hash = db.Column(db.String(64), unique=True, nullable=False)  # 请求内容哈希
+    owner = db.Column(db.String(128), nullable=False)  # 持有锁的进程标识
+    status = db.Column(db.String(16), nullable=False, default='running')  # running, done, failed
+    response_content = db.Column(db.Text, nullable=True)  # leader完成后写入的响应内容
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)  # 锁（或结果）过期时间
+
+
 class Prompt(db.Model):
     """存储提示词和背景信息"""
     __tablename__ = 'prompts'
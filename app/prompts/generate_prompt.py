@@ -1,6 +1,18 @@
 #!/usr/bin/env python3
-"""Utility to build prompts for different roles."""
-from app.models.models import Prompt
+"""Utility to build prompts for different roles.
+
+Compiled prompts are cached in-process per role. Edits made through the prompt
+API bump a version token stored in ``GlobalSetting`` (see
+``bump_prompt_version``); every process compares its cached version against the
+stored one at most once per ``PROMPT_CACHE_CHECK_INTERVAL`` seconds, so agents no
+longer query and re-assemble the static prompt text on every LLM call.
+"""
+import os
+import threading
+import time
+import uuid
+
+from app.models.models import Prompt, GlobalSetting, db
 
 ROLE_NAMES = {
     '_captain': 'role_soc_captain',
@@ -12,13 +24,58 @@ ROLE_NAMES = {
 BACKGROUND_SECURITY = 'background_security'
 BACKGROUND_PLAYBOOKS = 'background_soar_playbooks'
 
+PROMPT_VERSION_KEY = 'prompt_version'
+PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', 'True').lower() == 'true'
+PROMPT_CACHE_CHECK_INTERVAL = float(os.getenv('PROMPT_CACHE_CHECK_INTERVAL', '5'))
+
+_cache = {}
+_cache_lock = threading.Lock()
+_version_state = {'version': None, 'checked_at': 0.0}
+
+
+def _read_version():
+    return db.session.query(GlobalSetting.value).filter_by(key=PROMPT_VERSION_KEY).scalar() or ''
+
+
+def _current_version():
+    """Return the stored prompt version, re-reading it at most once per check interval."""
+    now = time.monotonic()
+    with _cache_lock:
+        if (_version_state['version'] is not None
+                and now - _version_state['checked_at'] < PROMPT_CACHE_CHECK_INTERVAL):
+            return _version_state['version']
+    version = _read_version()
+    with _cache_lock:
+        if version != _version_state['version']:
+            _cache.clear()
+        _version_state['version'] = version
+        _version_state['checked_at'] = now
+    return version
+
+
+def invalidate_prompt_cache():
+    """Drop this process's compiled prompts and force a version re-check."""
+    with _cache_lock:
+        _cache.clear()
+        _version_state['version'] = None
 
-def generate_prompt(role: str) -> str:
-    """Generate prompt text for the given role."""
-    name = ROLE_NAMES.get(role, '')
-    if not name:
-        return ''
 
+def bump_prompt_version():
+    """Record a prompt edit so that every process rebuilds its cached prompts.
+
+    Must be called inside the transaction that saves the prompt; the caller commits.
+    A fresh random token is written instead of incrementing a counter so that
+    concurrent edits can never end up writing the same version.
+    """
+    setting = GlobalSetting.query.filter_by(key=PROMPT_VERSION_KEY).first()
+    if not setting:
+        setting = GlobalSetting(key=PROMPT_VERSION_KEY)
+        db.session.add(setting)
+    setting.value = uuid.uuid4().hex
+    invalidate_prompt_cache()
+
+
+def _compile_prompt(name: str) -> str:
     role_prompt = Prompt.query.filter_by(name=name).first()
     if not role_prompt:
         return ''
@@ -32,6 +89,29 @@ def generate_prompt(role: str) -> str:
     return prompt
 
 
+def generate_prompt(role: str) -> str:
+    """Generate prompt text for the given role."""
+    name = ROLE_NAMES.get(role, '')
+    if not name:
+        return ''
+    if not PROMPT_CACHE_ENABLED:
+        return _compile_prompt(name)
+
+    version = _current_version()
+    with _cache_lock:
+        cached = _cache.get(role)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    prompt = _compile_prompt(name)
+    # 角色提示词尚未初始化时不缓存，初始化后无需修改版本号即可生效
+    if prompt:
+        with _cache_lock:
+            if _version_state['version'] == version:
+                _cache[role] = (version, prompt)
+    return prompt
+
+
 def main():
     for role in ROLE_NAMES:
         text = generate_prompt(role)
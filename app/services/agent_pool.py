@@ -0,0 +1,69 @@
+"""Agent进程内的并发工作池
+
+Captain、Manager、Operator 的主线程只负责认领工作，认领到的事件/任务组/动作组交给工作池并发处理：
+
+- 并发数即该进程同时在途的LLM调用上限（CAPTAIN_CONCURRENCY / MANAGER_CONCURRENCY / OPERATOR_CONCURRENCY），设为1即恢复串行处理
+- 每个工作线程推入独立的应用上下文，拥有独立的数据库会话，退出上下文时会话随之释放
+- 同一事件的工作按认领顺序串行：主线程认领时排除已有工作在途的事件，保证同一事件的结果按顺序提交，
+  而不同事件之间互不阻塞
+"""
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+
+class AgentWorkerPool:
+    """有界工作池，按事件ID跟踪在途工作"""
+
+    def __init__(self, app, role, concurrency):
+        self.app = app
+        self.role = role
+        self.concurrency = max(1, int(concurrency))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix=f"{role.strip('_').capitalize()}Worker"
+        )
+        self._inflight = {}
+
+    def _prune(self):
+        self._inflight = {future: key for future, key in self._inflight.items() if not future.done()}
+
+    @property
+    def busy_keys(self):
+        """有工作在途的事件ID集合，认领时应排除"""
+        self._prune()
+        return set(self._inflight.values())
+
+    def full(self):
+        self._prune()
+        return len(self._inflight) >= self.concurrency
+
+    def wait_for_slot(self):
+        """阻塞直到任意一个在途工作完成"""
+        if self._inflight:
+            wait(list(self._inflight), return_when=FIRST_COMPLETED)
+        self._prune()
+
+    def submit(self, key, fn, *args):
+        """在工作线程的独立应用上下文中执行 fn(*args)
+
+        Args:
+            key: 该工作所属的事件ID
+        """
+        future = self._executor.submit(self._run, key, fn, *args)
+        self._inflight[future] = key
+        return future
+
+    def _run(self, key, fn, *args):
+        with self.app.app_context():
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"{self.role} 处理事件 {key} 的工作时发生错误: {e}")
+                logger.error(traceback.format_exc())
+
+    def shutdown(self):
+        """等待在途工作完成后关闭"""
+        self._executor.shutdown(wait=True)
@@ -1,3 +1,4 @@
+import os
 import time
 import uuid
 import json
@@ -5,25 +6,37 @@ import traceback
 from datetime import datetime
 from flask import current_app
 from app.models import db, Event, Task, Message, Summary
-from app.services.llm_service import call_llm, parse_yaml_response
+from app.services.llm_structured import call_llm_structured
+from app.services.llm_limiter import priority_for
 from app.controllers.socket_controller import broadcast_message
-from app.services.prompt_service import PromptService
+from app.services.prompt_service import PromptService, build_user_prompt
 from app.utils.message_utils import create_standard_message
-from app.utils.mq_utils import RabbitMQPublisher
-import yaml
+from app.utils.mq_utils import RabbitMQPublisher, ThreadSafePublisher
+from app.utils.work_queue import WorkQueueWaiter, notify_work, WORK_POLL_FALLBACK_INTERVAL
+from app.services.work_lease import claim_rows, LeaseKeeper, reap_expired_leases
+from app.services.agent_pool import AgentWorkerPool
+from app.services.event_transitions import set_event_status
 import pika
 
 import logging
 logger = logging.getLogger(__name__)
 
 
-def get_events_to_process():
-    """获取待处理的安全事件
+def get_events_to_process(exclude_event_ids=None):
+    """认领一个待处理的安全事件
     
     在新的状态流转设计中，Captain只处理pending状态的事件
     round_finished状态的事件由event_next_round_worker处理并转换为pending
+    事件以 SKIP LOCKED 原子认领，多个Captain副本不会重复处理同一事件
+
+    Args:
+        exclude_event_ids: 本进程中仍在处理的事件ID，不重复认领
+
+    Returns:
+        已认领的Event，没有待处理事件时为None
     """
-    return Event.query.filter_by(event_status='pending').order_by(Event.created_at.asc()).first()  
+    events = claim_rows('_captain', limit=1, exclude_event_ids=exclude_event_ids)
+    return events[0] if events else None
 
 def process_event(event, publisher: RabbitMQPublisher):
     """处理单个安全事件
@@ -58,17 +71,15 @@ def process_event(event, publisher: RabbitMQPublisher):
             logger.error(traceback.format_exc())
     
     # 更新事件状态为处理中
-    event.event_status = 'processing'
+    set_event_status(event, 'processing')
     db.session.commit()
     # 通知事件状态变更 (可选，如果需要非常实时的状态更新)
     # TBD: Decide if every status change needs MQ message, or if LLM response message is enough.
 
-    request_data = {
+    # 事件主体在同一事件的各轮次中保持不变，放在前面以利于服务商的前缀缓存
+    stable_data = {
         'type': 'generate_tasks_by_event',
-        'req_id': str(uuid.uuid4()),
-        'res_id': str(uuid.uuid4()),
         'event_id': event.event_id,
-        'round_id': round_id,
         'event_name': event.event_name if event.event_name else '{ 请大模型根据message和context生成 }',
         'message': event.message,
         'context': event.context if event.context else '无',
@@ -76,6 +87,7 @@ def process_event(event, publisher: RabbitMQPublisher):
         'severity': event.severity if event.severity else '无',
         'created_at': event.created_at.strftime('%Y-%m-%d %H:%M:%S')
     }
+    volatile_data = {'round_id': round_id}
     
     tasks_history_list = []
     history_tasks_query = Task.query.filter_by(event_id=event.event_id).order_by(Task.created_at.desc()).all()
@@ -90,10 +102,9 @@ def process_event(event, publisher: RabbitMQPublisher):
         })
 
     if tasks_history_list:
-        request_data['history_tasks'] = tasks_history_list
-    
-    yaml_data = yaml.dump(request_data, allow_unicode=True, default_flow_style=False, indent=2)
-    # logger.info(yaml_data) # Logged later in user_prompt
+        volatile_data['history_tasks'] = tasks_history_list
+    volatile_data['req_id'] = str(uuid.uuid4())
+    volatile_data['res_id'] = str(uuid.uuid4())
 
     last_round_summary_content = ""
     if not is_first_round:
@@ -105,23 +116,24 @@ def process_event(event, publisher: RabbitMQPublisher):
 {last_round_summary.event_summary}
 </event_progress>
 """
-    user_prompt = f"""```yaml
-{yaml_data}
-```
-{last_round_summary_content}
-针对当前网络安全事件进行分析决策，并分配适当的任务给安全管理员_manager（_analyst, _operator, _coordinator），如果有必要。
-"""
+    user_prompt = build_user_prompt(
+        stable_data,
+        volatile_data,
+        sections=[last_round_summary_content],
+        instruction="针对当前网络安全事件进行分析决策，并分配适当的任务给安全管理员_manager（_analyst, _operator, _coordinator），如果有必要。"
+    )
     logger.info(f"User prompt for event {event.event_id}, round {round_id}:\n{user_prompt}")
     logger.info("--------------------------------")
     
     prompt_service = PromptService('_captain')
     system_prompt = prompt_service.get_system_prompt()
-    response = call_llm(system_prompt, user_prompt)
+    # 请求并解析为校验通过的结构化结果，解析失败时会自动发起一次修复调用；严重/高危事件的决策优先获得LLM调用名额
+    parsed_response, response = call_llm_structured(system_prompt, user_prompt, role='_captain',
+                                                     priority=priority_for('_captain', event.severity))
     
     logger.info(f"LLM Response for event {event.event_id}, round {round_id}:\n{response}")
     logger.info("--------------------------------")
     
-    parsed_response = parse_yaml_response(response)
     if not parsed_response:
         logger.error(f"解析LLM响应失败 for event {event.event_id}: {response}")
         # Create an error message for frontend
@@ -140,7 +152,7 @@ def process_event(event, publisher: RabbitMQPublisher):
                 logger.info(f"消息 [LLM Parse Err] {db_message_parse_err.message_id} 已发布到 RabbitMQ. RK: {routing_key}")
             except Exception as e_pub:
                 logger.error(f"发布消息 [LLM Parse Err] {db_message_parse_err.message_id} 到 RabbitMQ 失败: {e_pub}")
-        event.event_status = 'error_processing' # Set a specific error state
+        set_event_status(event, 'error_processing') # Set a specific error state
         db.session.commit()
         return
     
@@ -194,11 +206,13 @@ def process_event(event, publisher: RabbitMQPublisher):
         # For now, we assume no status change here, tasks are just created.
         db.session.commit() # Commit tasks and potential event_name change
         logger.info(f"为事件 {event.event_id} 创建了 {len(created_task_ids)} 个任务: {created_task_ids}")
+        if created_task_ids:
+            notify_work('_manager', publisher, event_id=event.event_id, task_ids=created_task_ids)
         
         # Optional: Send a specific message about task creation if llm_response message is not sufficient
 
     elif response_type == 'MISSION_COMPLETE':
-        event.event_status = 'completed' # Captain decides event is completed based on LLM
+        set_event_status(event, 'completed') # Captain decides event is completed based on LLM
         db.session.commit()
         logger.info(f"事件 {event.event_id} 已被Captain标记为 'completed' 基于 LLM 响应.")
         # Send a message about event completion
@@ -219,7 +233,7 @@ def process_event(event, publisher: RabbitMQPublisher):
                 logger.error(f"发布消息 [Event Completed] {db_message_completed.message_id} 到 RabbitMQ 失败: {e_pub}")
 
     elif response_type == 'ROGER': # This seems like an error or simple ack from LLM
-        event.event_status = 'error_from_llm' # Or a more specific status
+        set_event_status(event, 'error_from_llm') # Or a more specific status
         db.session.commit()
         error_text = parsed_response.get('response_text', 'AI指挥官返回确认信息，但未分配任务或完成事件。')
         logger.error(f"事件 {event.event_id} 处理中，LLM 返回 'ROGER': {error_text}")
@@ -243,34 +257,66 @@ def process_event(event, publisher: RabbitMQPublisher):
         logger.warning(f"未知的LLM response_type '{response_type}' for event {event.event_id}")
         # Potentially send a generic notification for unknown response types
 
+def process_claimed_event(event_pk, publisher):
+    """在工作线程中处理一个已认领的事件（由 AgentWorkerPool 在独立的应用上下文中调用）
+
+    Args:
+        event_pk: 已认领事件的主键
+        publisher: 线程安全的发布器（ThreadSafePublisher）
+    """
+    event = db.session.get(Event, event_pk)
+    if not event:
+        logger.warning(f"已认领的事件 {event_pk} 不存在，跳过")
+        return
+    # 处理期间持续续约，结束后释放认领
+    with LeaseKeeper('_captain', [event]):
+        process_event(event, publisher)
+        # 每处理完一个事件后提交/回滚一次，确保事务结束，释放行锁
+        try:
+            db.session.commit()
+        except Exception as commit_err:
+            logger.error(f"Captain 提交事件 {event_pk} 的事务失败: {commit_err}")
+            db.session.rollback()
+
+
 def run_captain():
-    """运行Captain服务"""
+    """运行Captain服务
+
+    主线程负责认领事件并分发给最多 CAPTAIN_CONCURRENCY 个工作线程并发处理，
+    告警风暴时各事件的LLM调用不再相互排队；工作线程共享一个线程安全的发布器。
+    """
     logger.info("启动Captain服务...")
     
     from main import app # For app_context
     
     publisher = None
+    waiter = None
+    pool = None
     try:
-        publisher = RabbitMQPublisher() # Initialize publisher
-        logger.info("RabbitMQ Publisher for Captain initialized.")
+        publisher = ThreadSafePublisher() # Initialize publisher
+        pool = AgentWorkerPool(app, '_captain', os.getenv('CAPTAIN_CONCURRENCY', '4'))
+        logger.info(f"RabbitMQ Publisher for Captain initialized. 并发处理事件数: {pool.concurrency}")
+        waiter = WorkQueueWaiter('_captain')
         
         with app.app_context(): # Ensure DB operations are within app context
             while True:
                 try:
-                    event = get_events_to_process()
+                    if pool.full():
+                        # 工作线程已满，等待任意一个事件处理完成再认领新事件
+                        pool.wait_for_slot()
+                        continue
+
+                    reap_expired_leases('_captain', publisher)
+                    event = get_events_to_process(exclude_event_ids=pool.busy_keys)
                     if event:
-                        process_event(event, publisher) # Pass publisher to process_event
-                        # 每处理完一个事件后提交/回滚一次，确保事务结束，释放行锁，下一轮查询能看到最新数据
-                        try:
-                            db.session.commit()
-                        except Exception as loop_commit_err:
-                            logger.error(f"Captain 主循环提交事务失败: {loop_commit_err}")
-                            db.session.rollback()
+                        pool.submit(event.event_id, process_claimed_event, event.id, publisher)
                     else:
                         # logger.debug("Captain: 没有待处理事件，等待中...") # reduce noise
                         # 如果本轮没有事件，也显式地回滚事务，避免长事务导致快照不可见
                         db.session.rollback()
-                        time.sleep(5)
+                        # 等待新事件通知，超时后重新查询一次作为兜底对账；
+                        # 有工作在途时缩短等待，以便及时认领因同一事件在途而被跳过的工作
+                        waiter.wait(timeout=WORK_POLL_FALLBACK_INTERVAL if pool.busy_keys else None)
                 except pika.exceptions.AMQPConnectionError as amqp_err:
                     logger.error(f"Captain服务 RabbitMQ连接错误: {amqp_err}. Publisher 会尝试重连。")
                     # Publisher has internal retries for connect and publish, 
@@ -279,6 +325,7 @@ def run_captain():
                 except Exception as e:
                     logger.error(f"Captain服务在事件处理循环中发生错误: {e}")
                     logger.error(traceback.format_exc())
+                    db.session.rollback()
                     time.sleep(5) # Wait a bit before retrying the loop
                     
     except pika.exceptions.AMQPConnectionError as amqp_startup_err:
@@ -290,6 +337,11 @@ def run_captain():
         logger.critical(f"Captain服务启动时发生未知严重错误: {e_startup}")
         logger.critical(traceback.format_exc())
     finally:
+        if pool:
+            logger.info("Captain服务正在等待处理中的事件完成...")
+            pool.shutdown()
+        if waiter:
+            waiter.close()
         if publisher:
             logger.info("Captain服务正在关闭RabbitMQ publisher...")
             publisher.close()
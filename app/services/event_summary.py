@@ -0,0 +1,145 @@
+"""事件战况总结的增量生成
+
+原先每轮总结都把事件的全部任务、动作、命令和执行结果写入提示词，提示词长度和耗时随轮次增长。
+现在每条 Summary 额外保存：
+
+- digest：模型随总结一并输出的精简滚动摘要（不超过 EXPERT_EVENT_DIGEST_MAX_CHARS 字），作为下一次总结的“此前战况”
+- execution_watermark：已纳入总结的执行记录主键上限
+
+增量模式只把上一条总结的 digest、当前轮次的任务状态，以及主键大于水位线的执行结果摘要交给模型，
+提示词大小只取决于两次总结之间新增的工作量。首次总结没有前序 digest，相当于从零开始的增量。
+调用方要求（full_rebuild=True 或 EXPERT_EVENT_SUMMARY_FULL_REBUILD）或上一条总结没有 digest（升级前生成的历史总结）时，
+按原方式全量重建。
+
+水位线只推进到第一条尚未终结的新执行记录之前，未终结的执行会在下次总结时再次纳入。
+"""
+import logging
+import re
+
+from app.config import config
+from app.models import Task, Action, Command, Execution, Summary
+from app.services.prompt_service import build_user_prompt
+from app.services.status_rollup import EXECUTION_FINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+EVENT_SUMMARY_SYSTEM_PROMPT = """你是经验丰富的安全专家，请根据给定 YAML 信息生成仅包含客观事实的事件战况概述。"""
+
+FULL_SUMMARY_INSTRUCTION = "请生成事件战况概述。"
+
+INCREMENTAL_SUMMARY_INSTRUCTION = """“此前战况摘要”概括了之前各次总结的内容，new_executions 是此后新增的执行结果。
+请在此前战况的基础上结合新增的执行结果和当前轮次的任务状态，生成事件截至目前的战况概述。"""
+
+DIGEST_OUTPUT_INSTRUCTION = """请按以下格式输出：
+<summary>事件战况概述</summary>
+<digest>供后续总结使用的精简战况摘要：只保留已确认的关键事实（涉及的主机、账号、IP、已执行的处置及其结果等），不超过{max_chars}字</digest>"""
+
+_SUMMARY_PATTERN = re.compile(r'<summary>(.*?)</summary>', re.S)
+_DIGEST_PATTERN = re.compile(r'<digest>(.*?)</digest>', re.S)
+
+
+def _advance_watermark(watermark, executions):
+    """水位线推进到按主键排序后连续已终结的最后一条执行记录"""
+    for execution in executions:
+        if execution.execution_status not in EXECUTION_FINAL_STATUSES:
+            break
+        watermark = execution.id
+    return watermark
+
+
+def _full_context(event):
+    tasks = Task.query.filter_by(event_id=event.event_id).all()
+    actions = Action.query.filter_by(event_id=event.event_id).all()
+    commands = Command.query.filter_by(event_id=event.event_id).all()
+    executions = Execution.query.filter_by(event_id=event.event_id).order_by(Execution.id.asc()).all()
+    volatile_ctx = {
+        "round_id": event.current_round,
+        "event_status": event.event_status,
+        "tasks": [{"id": t.task_id, "name": t.task_name, "status": t.task_status} for t in tasks],
+        "actions": [{"id": a.action_id, "name": a.action_name, "status": a.action_status} for a in actions],
+        "commands": [{"id": c.command_id, "name": c.command_name, "status": c.command_status} for c in commands],
+        "executions": [{"id": e.execution_id, "status": e.execution_status, "ai_summary": e.ai_summary} for e in executions]
+    }
+    return volatile_ctx, executions
+
+
+def _incremental_context(event, previous):
+    watermark = previous.execution_watermark if previous else 0
+    executions = Execution.query.filter(
+        Execution.event_id == event.event_id,
+        Execution.id > watermark
+    ).order_by(Execution.id.asc()).all()
+    tasks = Task.query.filter_by(event_id=event.event_id, round_id=event.current_round).all()
+    command_ids = list({e.command_id for e in executions if e.command_id})
+    commands = {c.command_id: c for c in Command.query.filter(Command.command_id.in_(command_ids)).all()} \
+        if command_ids else {}
+    volatile_ctx = {
+        "round_id": event.current_round,
+        "event_status": event.event_status,
+        "current_round_tasks": [{"id": t.task_id, "name": t.task_name, "status": t.task_status} for t in tasks],
+        "new_executions": [{
+            "id": e.execution_id,
+            "round_id": e.round_id,
+            "command_name": commands[e.command_id].command_name if e.command_id in commands else None,
+            "status": e.execution_status,
+            "ai_summary": e.ai_summary
+        } for e in executions]
+    }
+    return volatile_ctx, executions
+
+
+def build_event_summary_prompt(event, full_rebuild=False):
+    """构建事件总结的用户提示词
+
+    Args:
+        event: 事件对象
+        full_rebuild: 是否忽略此前的 digest，按事件全部数据重建总结
+
+    Returns:
+        (user_prompt, execution_watermark, summary_mode)，summary_mode 为 'full' 或 'incremental'
+    """
+    previous = None
+    if not full_rebuild:
+        previous = Summary.query.filter_by(event_id=event.event_id).order_by(Summary.id.desc()).first()
+        if previous is not None and (not previous.digest or previous.execution_watermark is None):
+            logger.info(f"事件 {event.event_id} 的上一条总结没有滚动摘要，本次全量重建")
+            previous = None
+            full_rebuild = True
+
+    stable_ctx = {
+        "event_id": event.event_id,
+        "event_name": event.event_name,
+        "event_message": event.message
+    }
+    output_instruction = DIGEST_OUTPUT_INSTRUCTION.format(max_chars=config.EXPERT_EVENT_DIGEST_MAX_CHARS)
+    if full_rebuild:
+        volatile_ctx, executions = _full_context(event)
+        user_prompt = build_user_prompt(stable_ctx, volatile_ctx,
+                                        instruction=FULL_SUMMARY_INSTRUCTION + "\n\n" + output_instruction)
+        return user_prompt, _advance_watermark(0, executions), 'full'
+
+    volatile_ctx, executions = _incremental_context(event, previous)
+    sections = []
+    if previous:
+        sections.append(f"此前战况摘要（截至第 {previous.round_id} 轮）：\n{previous.digest}")
+    user_prompt = build_user_prompt(stable_ctx, volatile_ctx, sections=sections,
+                                    instruction=INCREMENTAL_SUMMARY_INSTRUCTION + "\n\n" + output_instruction)
+    base = previous.execution_watermark if previous else 0
+    logger.info(f"事件 {event.event_id} 增量总结：新增执行结果 {len(executions)} 条（水位线 {base}）")
+    return user_prompt, _advance_watermark(base, executions), 'incremental'
+
+
+def parse_event_summary(response):
+    """从模型输出中解析 (总结, 滚动摘要)；缺少标签时整段作为总结，滚动摘要取总结的前 EXPERT_EVENT_DIGEST_MAX_CHARS 字"""
+    text = (response or '').strip()
+    summary_match = _SUMMARY_PATTERN.search(text)
+    digest_match = _DIGEST_PATTERN.search(text)
+    if summary_match and summary_match.group(1).strip():
+        summary_text = summary_match.group(1).strip()
+    else:
+        summary_text = _DIGEST_PATTERN.sub('', text).strip() or text
+    if digest_match and digest_match.group(1).strip():
+        digest = digest_match.group(1).strip()
+    else:
+        digest = summary_text[:config.EXPERT_EVENT_DIGEST_MAX_CHARS]
+    return summary_text, digest
@@ -0,0 +1,166 @@
+"""事件状态变更记录（outbox）与状态停留时长统计
+
+原先 Expert 的事件生命周期线程每个周期都把 processing、tasks_completed、to_be_summarized、summarized/summary_failed、
+round_finished 状态的事件全部查询一遍并逐个加锁检查，没有变化时只能靠 sleep 退避，开销随未结束的事件数线性增长。
+现在由状态变更驱动：
+
+- 修改 Event.event_status 统一通过 set_event_status，在同一事务中写入一条 EventTransition；
+  提交后对需要生命周期线程推进的状态调用 notify_lifecycle 唤醒它（通知丢失时由定期对账兜底）
+- 生命周期线程以 SKIP LOCKED 认领未处理的变更记录（claim_transitions），只处理这些事件；
+  推进产生的新变更在下一批中继续处理
+- 每 EXPERT_LIFECYCLE_SWEEP_INTERVAL 秒做一次慢速全量扫描（sweep_lifecycle_event_ids），
+  补上认领后进程崩溃、绕过 set_event_status 的修改等遗漏；已处理的变更记录保留 EXPERT_TRANSITION_RETENTION_DAYS 天
+- 变更记录中保存了变更前状态的停留时长（dwell_seconds），认领时计入 state_dwell_metrics，定期输出日志
+"""
+import logging
+import threading
+import time
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta
+
+from app.config import config
+from app.models import db, Event, EventTransition
+from app.utils.work_queue import notify_work
+
+logger = logging.getLogger(__name__)
+
+LIFECYCLE_ROLE = '_lifecycle'
+
+# 生命周期线程负责推进的状态（processing 只在全量扫描时兜底检查，平时由状态汇总推进）
+LIFECYCLE_STATUSES = ('processing', 'tasks_completed', 'to_be_summarized', 'resolved',
+                      'summarized', 'summary_failed', 'round_finished')
+
+
+def set_event_status(event, new_status):
+    """修改事件状态并在当前会话中写入变更记录，由调用方提交
+
+    Returns:
+        新增的 EventTransition；状态未变化时为 None
+    """
+    old_status = event.event_status
+    if old_status == new_status:
+        return None
+    now = datetime.utcnow()
+    entered_at = event.status_changed_at or event.updated_at or event.created_at
+    transition = EventTransition(
+        event_id=event.event_id,
+        round_id=event.current_round,
+        from_status=old_status,
+        to_status=new_status,
+        dwell_seconds=max((now - entered_at).total_seconds(), 0.0) if entered_at else None,
+        created_at=now
+    )
+    event.event_status = new_status
+    event.status_changed_at = now
+    db.session.add(transition)
+    return transition
+
+
+def notify_lifecycle(event_id, publisher=None):
+    """唤醒生命周期线程，必须在状态变更提交之后调用"""
+    notify_work(LIFECYCLE_ROLE, publisher, event_id=event_id)
+
+
+class StateDwellMetrics:
+    """按状态统计事件在各状态的停留时长"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._last_log = time.monotonic()
+
+    def record(self, status, seconds):
+        if status is None or seconds is None:
+            return
+        with self._lock:
+            stats = self._stats.setdefault(status, {'count': 0, 'dwell': deque(maxlen=self.window)})
+            stats['count'] += 1
+            stats['dwell'].append(seconds)
+
+    def snapshot(self):
+        """各状态的离开次数和停留时长，分位数基于最近 window 次（秒）"""
+        with self._lock:
+            result = {}
+            for status, stats in self._stats.items():
+                dwell = sorted(stats['dwell'])
+                result[status] = {
+                    'count': stats['count'],
+                    'dwell_avg': round(sum(dwell) / len(dwell), 1) if dwell else None,
+                    'dwell_p50': round(dwell[len(dwell) // 2], 1) if dwell else None,
+                    'dwell_p95': round(dwell[min(len(dwell) - 1, int(len(dwell) * 0.95))], 1) if dwell else None,
+                    'dwell_max': round(dwell[-1], 1) if dwell else None,
+                }
+            return result
+
+    def maybe_log(self):
+        interval = config.EXPERT_LIFECYCLE_METRICS_LOG_INTERVAL
+        if interval <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_log < interval or not self._stats:
+                return
+            self._last_log = now
+        logger.info(f"事件状态停留时长统计: {self.snapshot()}")
+
+
+state_dwell_metrics = StateDwellMetrics()
+
+
+def claim_transitions(limit):
+    """认领未处理的状态变更记录并标记为已处理
+
+    认领后即提交，推进过程中进程崩溃时由全量扫描兜底。
+
+    Returns:
+        涉及的事件ID列表（去重，按变更先后排序）
+    """
+    try:
+        transitions = EventTransition.query.filter(EventTransition.processed_at.is_(None)) \
+            .order_by(EventTransition.id.asc()).limit(limit).with_for_update(skip_locked=True).all()
+        if not transitions:
+            db.session.rollback()
+            return []
+        now = datetime.utcnow()
+        event_ids = OrderedDict()
+        for transition in transitions:
+            transition.processed_at = now
+            event_ids[transition.event_id] = True
+            state_dwell_metrics.record(transition.from_status, transition.dwell_seconds)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    state_dwell_metrics.maybe_log()
+    return list(event_ids)
+
+
+def sweep_lifecycle_event_ids():
+    """全量扫描处于生命周期状态的事件，按进入当前状态的先后排序"""
+    rows = db.session.query(Event.event_id) \
+        .filter(Event.event_status.in_(LIFECYCLE_STATUSES)) \
+        .order_by(Event.status_changed_at.asc(), Event.id.asc()).all()
+    db.session.rollback()
+    return [row.event_id for row in rows]
+
+
+def purge_processed_transitions():
+    """删除超过保留期的已处理变更记录，返回删除的条数"""
+    retention_days = config.EXPERT_TRANSITION_RETENTION_DAYS
+    if retention_days <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    try:
+        deleted = EventTransition.query.filter(
+            EventTransition.processed_at.isnot(None),
+            EventTransition.processed_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"清理事件状态变更记录失败: {e}")
+        return 0
+    if deleted:
+        logger.info(f"清理了 {deleted} 条超过 {retention_days} 天的事件状态变更记录")
+    return deleted
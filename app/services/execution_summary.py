@@ -0,0 +1,276 @@
+"""执行结果摘要
+
+单条模式（process_execution_summary）为每个执行结果单独调用一次大模型、写一条消息、做一次状态汇总。
+告警风暴时同一事件同一轮次会在短时间内产生大量体量很小的执行结果，批量模式把它们合并处理：
+
+- plan_summary_batches 按事件和轮次分组，在 EXPERT_SUMMARY_BATCH_TOKEN_BUDGET 的token预算内
+  最多打包 EXPERT_SUMMARY_BATCH_MAX_ITEMS 个执行结果；单个超过 EXPERT_SUMMARY_BATCH_ITEM_MAX_TOKENS 的结果仍单独处理
+- 一次请求中每个执行结果用 <execution index="N"> 分隔，要求模型按 <summary index="N"> 逐条输出摘要
+- 解析到的摘要、消息记录和状态汇总在一个事务中提交（失败时用已解析的摘要重试 BATCH_SAVE_ATTEMPTS 次），
+  提交后再发送前端通知；模型遗漏的条目保持 summarizing，交由单条模式处理
+- LLM请求失败或多次保存失败时抛出 BatchSummaryError，由调用方把认领的执行结果放回待处理并暂停认领，
+  不会退化为逐条请求而对已经过载的LLM服务放大请求量
+"""
+import json
+import logging
+import re
+import time
+
+import yaml
+
+from app.config import config
+from app.models import db, Task, Action, Command
+from app.services.llm_service import call_llm
+from app.services.llm_tokens import estimate_text_tokens
+from app.services.prompt_service import build_user_prompt
+from app.services.event_transitions import notify_lifecycle
+from app.services.status_rollup import rollup_event_statuses
+from app.utils.message_utils import create_standard_message
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_SUMMARY_SYSTEM_PROMPT = """
+        你是一个经验丰富的安全专家，擅长从执行结果中提取关键信息，并用精炼的文字生成适合人类阅读的文本。
+        请不要做总结评论，只保留客观结果。
+        """
+
+EXECUTION_SUMMARY_INSTRUCTION = """以上是基于_caption的任务安排，和_manager的动作细化，以及_operator的命令设置，通过SOAR安全之剧本执行的返回结果。
+当然也有可能是，人类工程师在页面手工完成的处置结果。
+请从信息提炼的角度，帮我提取关键信息，作客观结果的保留，不需要做总结评论。
+简单地说，就是告诉我剧本做了什么，得到了什么结果，不窜改，不臆造。"""
+
+BATCH_OUTPUT_INSTRUCTION = """以上共有 {count} 个执行结果，每个都包在 <execution index="序号"> 标签中。
+请分别为每个执行结果单独提炼，不要合并、遗漏或互相引用，按以下格式逐条输出：
+<summary index="1">第1个执行结果的摘要</summary>
+<summary index="2">第2个执行结果的摘要</summary>
+……"""
+
+_SUMMARY_PATTERN = re.compile(r'<summary\s+index="(\d+)"\s*>(.*?)</summary>', re.S)
+
+# 批量摘要保存失败（如状态汇总时死锁）时的重试次数
+BATCH_SAVE_ATTEMPTS = 3
+
+
+class BatchSummaryError(Exception):
+    """批量摘要未能完成（LLM请求失败或多次保存失败），调用方应把认领的执行结果放回待处理"""
+
+
+def parse_execution_result(execution):
+    """执行结果为JSON字符串时解析为对象，否则原样返回"""
+    execution_result = execution.execution_result
+    if isinstance(execution_result, str):
+        try:
+            return json.loads(execution_result)
+        except json.JSONDecodeError:
+            pass
+    return execution_result
+
+
+def build_execution_context(execution, command=None, action=None, task=None):
+    """构建执行结果的上下文：所属事件/任务/动作/命令在前（stable），执行本身的信息在后（volatile）"""
+    stable_context = {
+        "event_id": execution.event_id,
+        "round_id": execution.round_id,
+        "task_id": execution.task_id,
+        "task_name": task.task_name if task else "未知任务",
+        "action_id": execution.action_id,
+        "action_name": action.action_name if action else "未知动作",
+        "command_id": execution.command_id,
+        "command_name": command.command_name if command else "未知命令",
+        "command_type": command.command_type if command else "未知类型"
+    }
+    volatile_context = {
+        "execution_id": execution.execution_id,
+        # 认领后的 summarizing 只是摘要流程的内部状态，对模型而言执行结果是 completed
+        "execution_status": 'completed' if execution.execution_status == 'summarizing' else execution.execution_status,
+        "execution_result": parse_execution_result(execution)
+    }
+    return stable_context, volatile_context
+
+
+def publish_expert_message(db_message, publisher, sender='_expert'):
+    """把已提交的消息发送到前端通知队列"""
+    if not db_message or not publisher:
+        return
+    try:
+        routing_key = f"notifications.frontend.{db_message.event_id}.{sender}.{db_message.message_type}"
+        publisher.publish_message(message_body=db_message.to_dict(), routing_key=routing_key)
+    except Exception as e_pub:
+        logger.error(f"发布消息 {db_message.message_type} 失败: {e_pub}")
+
+
+def create_execution_summary_message(execution, summary_text, publisher, commit=True):
+    """创建执行结果摘要消息
+
+    commit为False时只加入会话，返回消息对象，由调用方提交后再调用 publish_expert_message 发送
+    """
+    content_data = {
+        "execution_id": execution.execution_id,
+        "command_id": execution.command_id,
+        "action_id": execution.action_id,
+        "task_id": execution.task_id,
+        "ai_summary": summary_text
+    }
+    db_message = create_standard_message(
+        event_id=execution.event_id,
+        message_from='_expert',
+        round_id=execution.round_id,
+        message_type='execution_summary_generated', # Keep type specific
+        content_data=content_data,
+        commit=commit
+    )
+    if commit:
+        publish_expert_message(db_message, publisher)
+        logger.info(f"消息 [Exec Summary Gen] {db_message.message_id} 已发布")
+    return db_message
+
+
+def _estimate_execution_tokens(execution):
+    result = execution.execution_result
+    if result is None:
+        return 0
+    return estimate_text_tokens(result if isinstance(result, str) else json.dumps(result, ensure_ascii=False))
+
+
+def plan_summary_batches(executions):
+    """把待摘要的执行结果分批
+
+    同一事件同一轮次的小结果按原有顺序打包，每批不超过 EXPERT_SUMMARY_BATCH_MAX_ITEMS 个、
+    执行结果合计不超过 EXPERT_SUMMARY_BATCH_TOKEN_BUDGET 个token；空结果和大结果单独成批。
+
+    Returns:
+        批次列表，每批是执行对象列表；只有一个元素的批次按单条模式处理
+    """
+    max_items = config.EXPERT_SUMMARY_BATCH_MAX_ITEMS
+    budget = config.EXPERT_SUMMARY_BATCH_TOKEN_BUDGET
+    item_max = min(config.EXPERT_SUMMARY_BATCH_ITEM_MAX_TOKENS, budget)
+    if max_items <= 1:
+        return [[execution] for execution in executions]
+
+    batches = []
+    open_batches = {}
+    for execution in executions:
+        tokens = _estimate_execution_tokens(execution)
+        if not execution.execution_result or tokens > item_max:
+            batches.append([execution])
+            continue
+        key = (execution.event_id, execution.round_id)
+        current = open_batches.get(key)
+        if current is None or len(current['items']) >= max_items or current['tokens'] + tokens > budget:
+            current = {'items': [], 'tokens': 0}
+            open_batches[key] = current
+            batches.append(current['items'])
+        current['items'].append(execution)
+        current['tokens'] += tokens
+    return batches
+
+
+def _build_batch_prompt(executions):
+    command_ids = [e.command_id for e in executions if e.command_id]
+    action_ids = [e.action_id for e in executions if e.action_id]
+    task_ids = [e.task_id for e in executions if e.task_id]
+    commands = {c.command_id: c for c in Command.query.filter(Command.command_id.in_(command_ids)).all()} if command_ids else {}
+    actions = {a.action_id: a for a in Action.query.filter(Action.action_id.in_(action_ids)).all()} if action_ids else {}
+    tasks = {t.task_id: t for t in Task.query.filter(Task.task_id.in_(task_ids)).all()} if task_ids else {}
+
+    sections = []
+    for index, execution in enumerate(executions, 1):
+        stable_context, volatile_context = build_execution_context(
+            execution, commands.get(execution.command_id), actions.get(execution.action_id), tasks.get(execution.task_id)
+        )
+        # 事件和轮次在所有条目中相同，放在公共部分
+        item = {k: v for k, v in stable_context.items() if k not in ('event_id', 'round_id')}
+        item.update(volatile_context)
+        item_yaml = yaml.dump(item, allow_unicode=True, default_flow_style=False, indent=2, sort_keys=False)
+        sections.append(f'<execution index="{index}">\n```yaml\n{item_yaml}```\n</execution>')
+
+    first = executions[0]
+    return build_user_prompt(
+        {"event_id": first.event_id, "round_id": first.round_id},
+        sections=sections,
+        instruction=EXECUTION_SUMMARY_INSTRUCTION + "\n\n" + BATCH_OUTPUT_INSTRUCTION.format(count=len(executions))
+    )
+
+
+def parse_batch_summaries(response, count):
+    """解析模型按 <summary index="N"> 输出的摘要，返回 {序号: 摘要}，忽略越界和空的条目"""
+    summaries = {}
+    for index, text in _SUMMARY_PATTERN.findall(response or ''):
+        index = int(index)
+        if 1 <= index <= count and text.strip() and index not in summaries:
+            summaries[index] = text.strip()
+    return summaries
+
+
+def _save_batch_summaries(executions, summaries, publisher):
+    """在一个事务中写入解析到的摘要、消息记录并汇总状态，返回 (遗漏的执行, 消息列表, 汇总结果)"""
+    missing = []
+    messages = []
+    for index, execution in enumerate(executions, 1):
+        summary = summaries.get(index)
+        if not summary:
+            missing.append(execution)
+            continue
+        execution.ai_summary = summary
+        execution.execution_status = 'summarized'
+        messages.append(create_execution_summary_message(execution, summary, publisher, commit=False))
+    rollup = rollup_event_statuses(executions[0].event_id, commit=False) if messages else None
+    db.session.commit()
+    return missing, messages, rollup
+
+
+def process_execution_summary_batch(executions, publisher):
+    """一次大模型请求为同一事件同一轮次的多个执行结果生成摘要
+
+    Args:
+        executions: 同一事件同一轮次、已认领（summarizing）的执行对象列表
+        publisher: RabbitMQPublisher instance
+
+    Returns:
+        模型遗漏的执行对象列表，调用方应按单条模式处理
+
+    Raises:
+        BatchSummaryError: LLM请求失败或多次保存失败，本批执行结果仍为 summarizing
+    """
+    first = executions[0]
+    logger.info(f"批量生成 {len(executions)} 个执行结果的摘要 (Event: {first.event_id}, Round: {first.round_id})")
+
+    db_msg_llm_req = create_standard_message(
+        event_id=first.event_id,
+        message_from='system',
+        round_id=first.round_id,
+        message_type='expert_llm_request_exec_summary',
+        content_data={
+            "text": f"专家智能正在为 {len(executions)} 个执行结果批量生成摘要...",
+            "execution_ids": [e.execution_id for e in executions]
+        }
+    )
+    publish_expert_message(db_msg_llm_req, publisher, sender='system')
+
+    try:
+        response = call_llm(EXECUTION_SUMMARY_SYSTEM_PROMPT, _build_batch_prompt(executions), temperature=0.3,
+                            role='_expert')
+    except Exception as e:
+        db.session.rollback()
+        raise BatchSummaryError(f"批量生成执行摘要的LLM请求失败: {e}") from e
+
+    summaries = parse_batch_summaries(response, len(executions))
+    for attempt in range(1, BATCH_SAVE_ATTEMPTS + 1):
+        try:
+            missing, messages, rollup = _save_batch_summaries(executions, summaries, publisher)
+            break
+        except Exception as e:
+            db.session.rollback()
+            if attempt == BATCH_SAVE_ATTEMPTS:
+                raise BatchSummaryError(f"保存批量执行摘要失败（已重试 {attempt} 次）: {e}") from e
+            logger.warning(f"保存批量执行摘要失败，第 {attempt} 次重试: {e}")
+            time.sleep(0.5 * attempt)
+
+    for db_message in messages:
+        publish_expert_message(db_message, publisher)
+    if rollup and rollup['event_status']:
+        notify_lifecycle(first.event_id, publisher)
+    if missing:
+        logger.warning(f"批量摘要遗漏了 {len(missing)} 个执行结果，改为逐条处理: {[e.execution_id for e in missing]}")
+    logger.info(f"批量生成执行摘要完成: {len(messages)}/{len(executions)}")
+    return missing
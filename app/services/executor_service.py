@@ -1,3 +1,4 @@
+import os
 import time
 import uuid
 import json
@@ -7,20 +8,27 @@ from sqlalchemy import func
 from app.models import db, Event, Task, Action, Command, Execution, Message
 from app.controllers.socket_controller import broadcast_message
 from app.services.playbook_service import PlaybookService
+from app.services.playbook_engine import PlaybookActivityPoller, track_activity
 from app.utils.message_utils import create_standard_message
+from app.utils.work_queue import WorkQueueWaiter
+from app.services.work_lease import claim_rows, LeaseKeeper, reap_expired_leases
+from app.utils.soar_client import SOARUnavailableError, soar_circuit_breaker
 import logging
 
 logger = logging.getLogger(__name__)
 
-def get_pending_commands():
-    """获取待处理的命令
+def get_pending_commands(limit=1):
+    """认领待处理的命令
     
+    命令以 SKIP LOCKED 原子认领，多个Executor副本不会重复执行同一命令
+
+    Args:
+        limit: 最多认领的命令数
+
     Returns:
-        待处理的命令列表
+        已认领的命令列表
     """
-    # 查询所有pending状态的命令
-    pending_commands = Command.query.filter_by(command_status='pending').order_by(Command.created_at.asc()).all()
-    return pending_commands
+    return claim_rows('_executor', limit=limit)
 
 def process_command(command):
     """处理单个命令
@@ -39,8 +47,13 @@ def process_command(command):
     try:
         # 根据命令类型执行不同的处理逻辑
         if command.command_type == 'playbook':
-            # 执行SOAR剧本
-            result = execute_playbook_command(command)
+            # 提交SOAR剧本，执行结果由剧本活动调度线程跟踪，命令保持 processing 直到活动结束
+            result = submit_playbook_command(command)
+            if result.get('status') == 'submitted':
+                track_activity(command, result)
+                db.session.commit()
+                logger.info(f"命令 {command.command_id} 的剧本已提交，活动ID: {result['activity_id']}")
+                return
         elif command.command_type == 'manual':
             # 人工命令，需要前端用户处理
             result = handle_manual_command(command)
@@ -53,27 +66,14 @@ def process_command(command):
                 "message": error_msg
             }
         
-        # 更新命令状态和结果
-        if result and result.get('status') == 'success':
-            command.command_status = 'completed'
-            command.command_result = result.get('data', {})
-            
-            # 更新关联的动作状态
-            update_action_status(command.action_id, 'completed')
-        else:
-            command.command_status = 'failed'
-            command.command_result = {
-                "error": result.get('message') if result else "未知错误"
-            }
-            
-            # 更新关联的动作状态
-            update_action_status(command.action_id, 'failed')
+        finalize_command(command, result)
         
+    except SOARUnavailableError as e:
+        # SOAR熔断期间命令退回 pending，熔断结束后重新认领，不判定为失败
+        db.session.rollback()
+        command.command_status = 'pending'
         db.session.commit()
-        
-        # 创建消息记录
-        create_command_message(command, result)
-        
+        logger.warning(f"命令 {command.command_id} 暂缓执行: {e}")
     except Exception as e:
         error_msg = f"处理命令时出错: {str(e)}"
         logger.error(error_msg)
@@ -93,24 +93,50 @@ def process_command(command):
             "message": error_msg
         })
 
-def execute_playbook_command(command):
-    """执行SOAR剧本命令
+def finalize_command(command, result):
+    """根据执行结果更新命令及关联动作的状态，并创建消息记录
+    
+    Args:
+        command: 命令对象
+        result: 执行结果
+    """
+    # 更新命令状态和结果
+    if result and result.get('status') == 'success':
+        command.command_status = 'completed'
+        command.command_result = result.get('data', {})
+        
+        # 更新关联的动作状态
+        update_action_status(command.action_id, 'completed')
+    else:
+        command.command_status = 'failed'
+        command.command_result = {
+            "error": result.get('message') if result else "未知错误"
+        }
+        
+        # 更新关联的动作状态
+        update_action_status(command.action_id, 'failed')
+    
+    db.session.commit()
+    
+    # 创建消息记录
+    create_command_message(command, result)
+
+def submit_playbook_command(command):
+    """提交SOAR剧本命令，不等待执行完成
     
     Args:
         command: 命令对象
     
     Returns:
-        执行结果
+        提交结果，成功时 status 为 submitted 并携带 activity_id
     """
-    logger.info(f"执行SOAR剧本命令: {command.command_id}")
+    logger.info(f"提交SOAR剧本命令: {command.command_id}")
     
     # 创建PlaybookService实例
     playbook_service = PlaybookService()
     
-    # 执行剧本
-    result = playbook_service.execute_playbook(command)
-    
-    return result
+    # 提交剧本
+    return playbook_service.submit_playbook(command)
 
 def handle_manual_command(command):
     """处理人工命令
@@ -189,36 +215,56 @@ def create_command_message(command, result):
     )
 
 def run_executor():
-    """运行_executor服务"""
+    """运行_executor服务
+
+    主循环只负责认领命令并提交剧本，剧本执行结果由 PlaybookActivityPoller 调度线程异步跟踪，
+    一个慢剧本不再阻塞其他待执行命令。
+    """
     logger.info("启动_executor服务...")
     
     # 导入Flask应用
     from main import app
+
+    waiter = WorkQueueWaiter('_executor')
+    claim_batch = max(1, int(os.getenv('EXECUTOR_CLAIM_BATCH', '20')))
+    poller = PlaybookActivityPoller(app, on_finished=finalize_command)
+    poller.start()
     
     # 使用应用上下文
     with app.app_context():
-        while True:
-            try:
-                # 获取待处理命令
-                pending_commands = get_pending_commands()
+        try:
+            while True:
+                try:
+                    reap_expired_leases('_executor')
+                    # 认领待处理命令，提交剧本不等待结果，可一次认领一批
+                    pending_commands = get_pending_commands(limit=claim_batch)
                 
-                if pending_commands:
-                    logger.info(f"发现 {len(pending_commands)} 个待处理命令")
+                    if pending_commands:
+                        logger.info(f"认领了 {len(pending_commands)} 个待处理命令")
                     
-                    # 处理每个命令
-                    for command in pending_commands:
-                        process_command(command)
-                    # 命令处理完后提交，释放锁
-                    try:
-                        db.session.commit()
-                    except Exception as loop_commit_err:
-                        logger.error(f"Executor 主循环提交事务失败: {loop_commit_err}")
+                        # 处理每个命令，提交期间持续续约，结束后释放认领
+                        with LeaseKeeper('_executor', pending_commands):
+                            for command in pending_commands:
+                                process_command(command)
+                            # 命令处理完后提交，释放锁
+                            try:
+                                db.session.commit()
+                            except Exception as loop_commit_err:
+                                logger.error(f"Executor 主循环提交事务失败: {loop_commit_err}")
+                                db.session.rollback()
+                        # SOAR熔断期间暂停认领新命令
+                        circuit_wait = soar_circuit_breaker.retry_after()
+                        if circuit_wait:
+                            logger.warning(f"SOAR接口熔断中，{circuit_wait:.0f} 秒后继续执行命令")
+                            time.sleep(circuit_wait)
+                    else:
+                        logger.info("没有待处理命令，等待中...")
+                        # 回滚事务，避免长事务
                         db.session.rollback()
-                else:
-                    logger.info("没有待处理命令，等待中...")
-                    # 回滚事务，避免长事务
-                    db.session.rollback()
-                    time.sleep(5)
-            except Exception as e:
-                logger.error(f"处理命令时出错: {str(e)}")
-                time.sleep(5) 
\ No newline at end of file
+                        # 等待新命令通知，超时后重新查询一次作为兜底对账
+                        waiter.wait()
+                except Exception as e:
+                    logger.error(f"处理命令时出错: {str(e)}")
+                    time.sleep(5) 
+        finally:
+            poller.stop()
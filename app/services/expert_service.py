@@ -3,38 +3,143 @@ import uuid
 import json
 import traceback
 import threading
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask import current_app
 from sqlalchemy import func, and_, or_
 from app.models import db, Event, Task, Action, Command, Execution, Summary, Message
-from app.services.llm_service import call_llm, parse_yaml_response
-from app.services.prompt_service import PromptService
+from app.services.llm_service import call_llm
+from app.services.prompt_service import PromptService, build_user_prompt
+from app.services.status_rollup import rollup_event_statuses
+from app.services.event_summary import EVENT_SUMMARY_SYSTEM_PROMPT, build_event_summary_prompt, parse_event_summary
+from app.services.execution_summary import EXECUTION_SUMMARY_SYSTEM_PROMPT, EXECUTION_SUMMARY_INSTRUCTION, \
+    build_execution_context, create_execution_summary_message, plan_summary_batches, process_execution_summary_batch, \
+    BatchSummaryError
 from app.config import config
 from app.utils.message_utils import create_standard_message
-from app.utils.mq_utils import RabbitMQPublisher
+from app.utils.mq_utils import RabbitMQPublisher, ThreadSafePublisher
+from app.services.agent_pool import AgentWorkerPool
+from app.services.llm_limiter import llm_limiter
+from app.utils.work_queue import WorkQueueWaiter, notify_work, WORK_RECONCILE_INTERVAL
+from app.services.event_transitions import LIFECYCLE_ROLE, set_event_status, notify_lifecycle, claim_transitions, \
+    sweep_lifecycle_event_ids, purge_processed_transitions
 import pika
 import logging
 import yaml
 
 logger = logging.getLogger(__name__)
 
-def get_executions_for_summarization():
-    """获取需要生成摘要的执行结果
+def claim_executions_for_summarization(limit):
+    """认领需要生成摘要的执行结果
     
-    Returns:
-        需要生成摘要的执行结果列表
-    """
-    # 查询所有completed状态的执行
-    # 在新的状态流转逻辑中，completed状态表示执行已完成但尚未生成摘要
-    # 生成摘要后状态会更新为summarized
-    completed_executions = Execution.query.filter(
-        Execution.execution_status.in_(['completed'])
-    ).order_by(Execution.created_at.asc()).all()
+    completed状态表示执行已完成但尚未生成摘要。以 SKIP LOCKED 选出最早的一条，再补充同一事件同一轮次的其他
+    completed 结果（便于批量摘要），一并改为 summarizing 后提交；多个摘要线程或Expert副本不会重复处理。
+    生成摘要后状态会更新为 summarized / summarized_error。
     
-    if completed_executions:
-        logger.info(f"找到 {len(completed_executions)} 个completed状态的执行结果需要生成摘要")
+    Args:
+        limit: 最多认领的条数
     
-    return completed_executions
+    Returns:
+        已认领的执行结果ID列表
+    """
+    query = Execution.query.filter(Execution.execution_status == 'completed') \
+        .order_by(Execution.created_at.asc(), Execution.id.asc())
+    try:
+        first = query.with_for_update(skip_locked=True).first()
+        if not first:
+            db.session.rollback()
+            return []
+        executions = [first]
+        if limit > 1:
+            executions += query.filter(
+                Execution.event_id == first.event_id,
+                Execution.round_id == first.round_id,
+                Execution.id != first.id
+            ).limit(limit - 1).with_for_update(skip_locked=True).all()
+        for execution in executions:
+            execution.execution_status = 'summarizing'
+        execution_ids = [execution.execution_id for execution in executions]
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    logger.info(f"认领了 {len(execution_ids)} 个执行结果生成摘要 (Event: {first.event_id})")
+    return execution_ids
+
+_last_summary_reap = 0.0
+
+def requeue_stale_summarizing():
+    """把停留在 summarizing 超过 EXPERT_SUMMARY_CLAIM_TIMEOUT 秒的执行结果（处理线程或进程异常退出）重置为 completed
+
+    按 EXPERT_SUMMARY_CLAIM_TIMEOUT 的 1/4 节流，可在主循环中每轮调用。
+    """
+    global _last_summary_reap
+    timeout = config.EXPERT_SUMMARY_CLAIM_TIMEOUT
+    now_mono = time.monotonic()
+    if now_mono - _last_summary_reap < timeout / 4:
+        return 0
+    _last_summary_reap = now_mono
+    try:
+        requeued = Execution.query.filter(
+            Execution.execution_status == 'summarizing',
+            Execution.updated_at < datetime.utcnow() - timedelta(seconds=timeout)
+        ).update({'execution_status': 'completed'}, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"重置超时的摘要认领失败: {e}")
+        return 0
+    if requeued:
+        logger.warning(f"{requeued} 个执行结果摘要超时未完成，已重置为 completed")
+    return requeued
+
+# 批量摘要的LLM请求失败后，分发线程在该时刻（time.monotonic()）之前暂停认领
+_summary_claims_paused_until = 0.0
+
+def release_claimed_executions(execution_ids):
+    """把仍为 summarizing 的已认领执行结果放回 completed，等待重新认领，返回放回的条数"""
+    try:
+        released = Execution.query.filter(
+            Execution.execution_id.in_(execution_ids),
+            Execution.execution_status == 'summarizing'
+        ).update({'execution_status': 'completed'}, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"放回已认领的执行结果失败（将等待认领超时后重置）: {e}")
+        return 0
+    return released
+
+def summarize_claimed_executions(execution_ids, publisher):
+    """为已认领（summarizing）的执行结果生成摘要（由 AgentWorkerPool 在独立的应用上下文中调用）
+
+    同一事件同一轮次的小结果合并为一次请求，其余（以及批量模式遗漏的）逐条处理。
+    批量请求失败时不逐条重试，把本次认领的结果全部放回待处理，并让分发线程暂停认领一段时间。
+    """
+    global _summary_claims_paused_until
+    executions = Execution.query.filter(
+        Execution.execution_id.in_(execution_ids),
+        Execution.execution_status == 'summarizing'
+    ).order_by(Execution.created_at.asc(), Execution.id.asc()).all()
+    single_executions = []
+    for batch in plan_summary_batches(executions):
+        if len(batch) > 1:
+            try:
+                single_executions.extend(process_execution_summary_batch(batch, publisher))
+            except BatchSummaryError as e:
+                pause = getattr(config, 'EXPERT_EXECUTION_SUMMARY_INTERVAL_ERROR', 15)
+                _summary_claims_paused_until = time.monotonic() + pause
+                released = release_claimed_executions(execution_ids)
+                logger.error(f"{e}；已将 {released} 个执行结果放回待处理，{pause} 秒内暂停认领")
+                return
+        else:
+            single_executions.extend(batch)
+    for execution in single_executions:
+        # Re-fetch execution to ensure it's still claimed for summarization
+        fresh_execution = Execution.query.filter_by(execution_id=execution.execution_id, execution_status='summarizing').first()
+        if fresh_execution:
+            process_execution_summary(fresh_execution, publisher)
+        else:
+            logger.info(f"ExecutionSummaryWorker: Execution {execution.execution_id} no longer 'summarizing' or not found. Skipping.")
 
 def process_execution_summary(execution: Execution, publisher: RabbitMQPublisher):
     """处理单个执行结果，生成摘要, 并触发后续状态更新检查
@@ -44,66 +149,27 @@ def process_execution_summary(execution: Execution, publisher: RabbitMQPublisher
         publisher: RabbitMQPublisher instance
     """
     logger.info(f"处理执行结果摘要: {execution.execution_id} (Event: {execution.event_id}, Command: {execution.command_id})")
-    original_status = execution.execution_status
-    
     try:
         # 获取执行结果
-        execution_result = execution.execution_result
-        if not execution_result:
+        if not execution.execution_result:
             logger.warning(f"执行结果为空: {execution.execution_id}")
             execution.ai_summary = "执行结果为空，无法生成AI摘要。"
             execution.execution_status = 'summarized_error' # Consistent error status
             return # Return early, but commit will happen in finally
         
-        # 如果执行结果是字符串（JSON字符串），则解析为对象
-        if isinstance(execution_result, str):
-            try:
-                execution_result = json.loads(execution_result)
-            except json.JSONDecodeError:
-                pass
-        
         # 获取关联的命令、动作和任务信息
         command = Command.query.filter_by(command_id=execution.command_id).first()
         action = Action.query.filter_by(action_id=execution.action_id).first() if execution.action_id else None
         task = Task.query.filter_by(task_id=execution.task_id).first() if execution.task_id else None
         
-        # 构建上下文信息
-        context = {
-            "execution_id": execution.execution_id,
-            "command_id": execution.command_id,
-            "command_name": command.command_name if command else "未知命令",
-            "command_type": command.command_type if command else "未知类型",
-            "action_id": execution.action_id,
-            "action_name": action.action_name if action else "未知动作",
-            "task_id": execution.task_id,
-            "task_name": task.task_name if task else "未知任务",
-            "event_id": execution.event_id,
-            "round_id": execution.round_id,
-            "execution_status": original_status, # Use original status for context
-            "execution_result": execution_result,
-            "req_id": str(uuid.uuid4()),
-            "res_id": str(uuid.uuid4())
-        }
-        
-        # 将上下文转换为JSON格式
-        yaml_context = yaml.dump(context, allow_unicode=True, default_flow_style=False, indent=2)
+        # 构建上下文信息：所属事件/任务/动作/命令在前，执行本身的信息在后
+        stable_context, volatile_context = build_execution_context(execution, command, action, task)
 
         # 构建系统提示词
-        system_prompt = """
-        你是一个经验丰富的安全专家，擅长从执行结果中提取关键信息，并用精炼的文字生成适合人类阅读的文本。
-        请不要做总结评论，只保留客观结果。
-        """
+        system_prompt = EXECUTION_SUMMARY_SYSTEM_PROMPT
         
         # 构建用户提示词
-        user_prompt = f"""
-            ```yaml
-            {yaml_context}
-            ```
-            以上是基于_caption的任务安排，和_manager的动作细化，以及_operator的命令设置，通过SOAR安全之剧本执行的返回结果。
-            当然也有可能是，人类工程师在页面手工完成的处置结果。
-            请从信息提炼的角度，帮我提取关键信息，作客观结果的保留，不需要做总结评论。
-            简单地说，就是告诉我剧本做了什么，得到了什么结果，不窜改，不臆造。
-            """
+        user_prompt = build_user_prompt(stable_context, volatile_context, instruction=EXECUTION_SUMMARY_INSTRUCTION)
         
         # 调用大模型生成摘要
         prompt_service = PromptService('_expert')
@@ -125,8 +191,8 @@ def process_execution_summary(execution: Execution, publisher: RabbitMQPublisher
             except Exception as e_pub:
                 logger.error(f"发布专家LLM请求执行摘要消息失败: {e_pub}")
         
-        # 使用长文本模型
-        response = call_llm(system_prompt, user_prompt, temperature=0.3, long_text=True)
+        # 模型按提示词大小自动选择
+        response = call_llm(system_prompt, user_prompt, temperature=0.3, role='_expert')
         
         logger.info(f"生成摘要成功: {execution.execution_id}")
         
@@ -163,253 +229,22 @@ def process_execution_summary(execution: Execution, publisher: RabbitMQPublisher
             except Exception as e_pub_err:
                 logger.error(f"发布执行摘要错误消息失败: {e_pub_err}")
     finally:
-        # Ensure status is committed and then trigger command status update
+        # Ensure status is committed and then roll up command/action/task statuses for the event
         try:
             db.session.commit() 
-            logger.info(f"Execution {execution.execution_id} status updated to {execution.execution_status}. Triggering command status check.")
-            _check_and_update_command_status(execution.command_id, publisher)
+            logger.info(f"Execution {execution.execution_id} status updated to {execution.execution_status}. Triggering status rollup.")
+            rollup_event_statuses(execution.event_id, publisher=publisher)
         except Exception as e_final:
             logger.error(f"Error in finally block of process_execution_summary for {execution.execution_id}: {e_final}")
             db.session.rollback()
 
-def _check_and_update_command_status(command_id: str, publisher: RabbitMQPublisher):
-    """
-    Checks all executions for a command. If all are finalized (summarized, summarized_error, failed),
-    updates the command's status. If command is finalized, triggers action status check.
-    Uses pessimistic locking for command update.
-    """
-    if not command_id:
-        logger.warning("_check_and_update_command_status: command_id is None. Skipping.")
-        return
-
-    logger.debug(f"Checking command status for Command ID: {command_id}")
-    try:
-        db.session.expire_all() # Ensure fresh data
-        command = db.session.query(Command).with_for_update().filter_by(command_id=command_id).first()
-
-        if not command:
-            logger.warning(f"Command {command_id} not found for status update.")
-            return
-
-        if command.command_status in ['completed', 'failed']:
-            logger.info(f"Command {command_id} already in a final state: {command.command_status}. Skipping.")
-            # Release the row lock before propagating upwards
-            db.session.commit()
-            if command.action_id:
-                 _check_and_update_action_status(command.action_id, publisher)
-            return
-
-        executions = Execution.query.filter_by(command_id=command_id).all()
-        if not executions:
-            logger.warning(f"No executions found for command {command_id}. Cannot determine command status. Setting to 'failed'.")
-            command.command_status = 'failed' # Or 'pending' if no executions means it hasn't started. 'failed' if executions were expected.
-            # Let's assume 'failed' if it was supposed to have executions.
-            # If a command has no executions it implies an issue.
-            # Alternatively, could leave as 'pending' or 'processing' if that makes more sense contextually.
-            # For now, 'failed' seems a safe default if it's in a state expecting executions.
-            # A command should not reach here without executions if it was 'processing'.
-        else:
-            all_executions_finalized = True
-            has_any_execution_failed = False
-            for ex in executions:
-                if ex.execution_status not in ['summarized', 'summarized_error', 'failed']:
-                    all_executions_finalized = False
-                    break
-                if ex.execution_status in ['summarized_error', 'failed']:
-                    has_any_execution_failed = True
-            
-            if all_executions_finalized:
-                if has_any_execution_failed:
-                    command.command_status = 'failed'
-                else:
-                    command.command_status = 'completed'
-            else:
-                # Still processing, no status change for command yet
-                logger.debug(f"Command {command_id} has non-finalized executions. Status remains {command.command_status}.")
-                db.session.commit() # Commit any changes from with_for_update even if status doesn't change (e.g. lock release)
-                return 
-
-        db.session.commit()
-        logger.info(f"Command {command_id} status updated to {command.command_status}.")
-
-        # Propagate to Action
-        if command.command_status in ['completed', 'failed'] and command.action_id:
-            _check_and_update_action_status(command.action_id, publisher)
-        elif not command.action_id:
-             logger.warning(f"Command {command_id} does not have an action_id. Cannot propagate status upwards from command.")
-
-
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"Error in _check_and_update_command_status for {command_id}: {e}")
-        logger.error(traceback.format_exc())
-
-def _check_and_update_action_status(action_id: str, publisher: RabbitMQPublisher):
-    """
-    Checks all commands for an action. If all are finalized (completed, failed),
-    updates the action's status. If action is finalized, triggers task status check.
-    Uses pessimistic locking for action update.
-    """
-    if not action_id:
-        logger.warning("_check_and_update_action_status: action_id is None. Skipping.")
-        return
-
-    logger.debug(f"Checking action status for Action ID: {action_id}")
-    try:
-        db.session.expire_all()
-        action = db.session.query(Action).with_for_update().filter_by(action_id=action_id).first()
-
-        if not action:
-            logger.warning(f"Action {action_id} not found for status update.")
-            return
-
-        if action.action_status in ['completed', 'failed']:
-            logger.info(f"Action {action_id} already in a final state: {action.action_status}. Skipping.")
-            db.session.commit()  # release lock before propagating
-            if action.task_id:  # Ensure task check is still triggered if action is final
-                _check_and_update_task_status(action.task_id, publisher)
-            return
-
-        commands = Command.query.filter_by(action_id=action_id).all()
-        if not commands:
-            logger.warning(f"No commands found for action {action_id}. Cannot determine action status. Setting to 'failed'.")
-            action.action_status = 'failed' # Similar logic to command with no executions
-        else:
-            all_commands_finalized = True
-            has_any_command_failed = False
-            for cmd in commands:
-                if cmd.command_status not in ['completed', 'failed']:
-                    all_commands_finalized = False
-                    break
-                if cmd.command_status == 'failed':
-                    has_any_command_failed = True
-            
-            if all_commands_finalized:
-                if has_any_command_failed:
-                    action.action_status = 'failed'
-                else:
-                    action.action_status = 'completed'
-            else:
-                logger.debug(f"Action {action_id} has non-finalized commands. Status remains {action.action_status}.")
-                db.session.commit()
-                return
-
-        db.session.commit()
-        logger.info(f"Action {action_id} status updated to {action.action_status}.")
-
-        # Propagate to Task
-        if action.action_status in ['completed', 'failed'] and action.task_id:
-            _check_and_update_task_status(action.task_id, publisher)
-        elif not action.task_id:
-            logger.warning(f"Action {action_id} does not have a task_id. Cannot propagate status upwards from action.")
-
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"Error in _check_and_update_action_status for {action_id}: {e}")
-        logger.error(traceback.format_exc())
-
-def _check_and_update_task_status(task_id: str, publisher: RabbitMQPublisher):
-    """
-    Checks all actions (or commands if no actions) for a task. If all are finalized,
-    updates the task's status. If task is finalized, triggers event round evaluation.
-    Uses pessimistic locking for task update.
-    """
-    if not task_id:
-        logger.warning("_check_and_update_task_status: task_id is None. Skipping.")
-        return
-
-    logger.debug(f"Checking task status for Task ID: {task_id}")
-    try:
-        db.session.expire_all()
-        task = db.session.query(Task).with_for_update().filter_by(task_id=task_id).first()
-
-        if not task:
-            logger.warning(f"Task {task_id} not found for status update.")
-            return
-
-        if task.task_status in ['completed', 'failed']:
-            logger.info(f"Task {task_id} already in a final state: {task.task_status}. Skipping further event round evaluation trigger from this path.")
-            # Previously, we still triggered event round evaluation here.
-            # By removing it, we reduce redundant calls to check_and_update_event_tasks_completion,
-            # potentially alleviating lock contention. The event_lifecycle_manager_worker
-            # should eventually pick up the event if it needs further state changes based on task completion.
-            # _trigger_event_round_evaluation(task.event_id, task.round_id, publisher)
-            db.session.commit() # Commit to release lock if acquired by with_for_update
-            return
-        
-        actions = Action.query.filter_by(task_id=task_id).all()
-        if not actions:
-             # This case should ideally not happen if actions are always part of the flow.
-             # If it does, means all commands must be checked directly under the task, which is not the current model.
-             # For now, if no actions, we assume the task cannot be completed this way.
-            logger.warning(f"No actions found for task {task_id}. Cannot determine task status based on actions. Assuming 'failed' or needs review.")
-            task.task_status = 'failed' # Or some other indeterminate status
-        else:
-            all_actions_finalized = True
-            has_any_action_failed = False
-            for act in actions:
-                if act.action_status not in ['completed', 'failed']:
-                    all_actions_finalized = False
-                    break
-                if act.action_status == 'failed':
-                    has_any_action_failed = True
-            
-            if all_actions_finalized:
-                if has_any_action_failed:
-                    task.task_status = 'failed'
-                else:
-                    task.task_status = 'completed'
-            else:
-                logger.debug(f"Task {task_id} has non-finalized actions. Status remains {task.task_status}.")
-                db.session.commit()
-                return
-
-        db.session.commit()
-        logger.info(f"Task {task_id} status updated to {task.task_status}.")
-
-        # Propagate to Event Round Evaluation
-        if task.task_status in ['completed', 'failed']:
-            _trigger_event_round_evaluation(task.event_id, task.round_id, publisher)
-
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"Error in _check_and_update_task_status for {task_id}: {e}")
-        logger.error(traceback.format_exc())
-
-def _trigger_event_round_evaluation(event_id: str, round_id: int, publisher: RabbitMQPublisher):
-    """
-    Called when a task's status is finalized. This function will invoke
-    check_and_update_event_tasks_completion, which is now responsible for checking
-    if all tasks (and their underlying executions) for the current event round are done,
-    and then updating the event status to 'tasks_completed' or 'failed'.
-    The event_lifecycle_manager_worker will then pick up 'tasks_completed' events.
-    """
-    if not event_id or round_id is None:
-        logger.warning(f"_trigger_event_round_evaluation: Invalid event_id ({event_id}) or round_id ({round_id}). Skipping.")
-        return
-
-    logger.info(f"Triggering event round evaluation for Event ID: {event_id}, Round: {round_id}")
-    try:
-        # check_and_update_event_tasks_completion handles its own db session and locking
-        # It will determine if the event round is complete and update event status.
-        # The publisher might be needed by check_and_update_event_tasks_completion for notifications.
-        status_changed = check_and_update_event_tasks_completion(event_id, round_id, publisher)
-        if status_changed:
-            logger.info(f"Event {event_id} round {round_id} evaluation resulted in a status change.")
-        else:
-            logger.info(f"Event {event_id} round {round_id} evaluation did not result in a status change (or event not ready).")
-
-    except Exception as e:
-        # db.session.rollback() # check_and_update_event_tasks_completion should manage its own rollback on error
-        logger.error(f"Error in _trigger_event_round_evaluation for Event {event_id}, Round {round_id}: {e}")
-        logger.error(traceback.format_exc())
-
 def check_and_update_event_tasks_completion(event_id, round_id, publisher: RabbitMQPublisher):
     """
     Checks if all tasks for a given event and round are completed or failed,
     AND all their underlying executions are also finalized (summarized, summarized_error, or failed).
     If so, updates the event status to 'tasks_completed' or 'failed' (if any task/execution failed).
-    This function is called by _trigger_event_round_evaluation.
+    Called by the lifecycle sweep as a fallback; the status rollup
+    (rollup_event_statuses) performs the same evaluation after each execution summary.
     Uses pessimistic locking for event update.
 
     Returns:
@@ -462,8 +297,8 @@ def check_and_update_event_tasks_completion(event_id, round_id, publisher: Rabbi
 
     # All tasks are finalized (completed or failed).
     # Now, we need to ensure all EXECUTIONS under these tasks (via commands and actions) are also finalized.
-    # The chained status updates (_check_and_update_command_status -> _check_and_update_action_status -> _check_and_update_task_status)
-    # should mean that if a task is 'completed' or 'failed', its underlying commands/executions are already final.
+    # The status rollup (rollup_event_statuses) finalizes commands -> actions -> tasks bottom-up,
+    # which should mean that if a task is 'completed' or 'failed', its underlying commands/executions are already final.
     # So, an additional check for execution statuses here might be redundant if the chain is working correctly.
     # However, for defense, a quick check can be done.
 
@@ -482,7 +317,7 @@ def check_and_update_event_tasks_completion(event_id, round_id, publisher: Rabbi
 
     changed = False
     if event.event_status != new_event_status:
-        event.event_status = new_event_status
+        set_event_status(event, new_event_status)
         changed = True
         logger.info(f"check_and_update_event_tasks_completion: Event {event_id} R{round_id} status updated from '{original_event_status}' to '{event.event_status}'.")
     else:
@@ -491,30 +326,6 @@ def check_and_update_event_tasks_completion(event_id, round_id, publisher: Rabbi
     db.session.commit() # Commit changes and release lock
     return changed
 
-def create_execution_summary_message(execution, summary_text, publisher: RabbitMQPublisher):
-    """创建执行结果摘要消息"""
-    content_data = {
-        "execution_id": execution.execution_id,
-        "command_id": execution.command_id,
-        "action_id": execution.action_id,
-        "task_id": execution.task_id,
-        "ai_summary": summary_text
-    }
-    db_message = create_standard_message(
-        event_id=execution.event_id,
-        message_from='_expert',
-        round_id=execution.round_id,
-        message_type='execution_summary_generated', # Keep type specific
-        content_data=content_data
-    )
-    if db_message and publisher:
-        try:
-            routing_key = f"notifications.frontend.{db_message.event_id}._expert.{db_message.message_type}"
-            publisher.publish_message(message_body=db_message.to_dict(), routing_key=routing_key)
-            logger.info(f"消息 [Exec Summary Gen] {db_message.message_id} 已发布. RK: {routing_key}")
-        except Exception as e_pub:
-            logger.error(f"发布执行摘要生成消息失败: {e_pub}")
-
 def create_event_summary_message(event, summary_obj, publisher: RabbitMQPublisher):
     """创建事件总结消息"""
     content_data = {
@@ -542,214 +353,195 @@ def create_event_summary_message(event, summary_obj, publisher: RabbitMQPublishe
             logger.error(f"发布事件总结生成消息失败: {e_pub}")
 
 # --- Worker thread for processing execution summaries ---
-def execution_summary_worker(app, publisher: RabbitMQPublisher):
-    """处理执行结果摘要的工作线程"""
+def execution_summary_worker(app, publisher: ThreadSafePublisher):
+    """执行结果摘要的分发线程
+
+    认领 completed 的执行结果交给最多 EXPERT_SUMMARY_WORKERS 个摘要线程并发处理，每个线程在独立的应用上下文
+    （独立的数据库会话）中生成摘要。摘要线程全忙或进程内的LLM调用已在限流排队时暂停认领，
+    未认领的结果留给空闲的线程或其他Expert副本。
+    """
+    pool = AgentWorkerPool(app, '_expert', config.EXPERT_SUMMARY_WORKERS)
+    claim_limit = max(1, config.EXPERT_SUMMARY_BATCH_MAX_ITEMS)
     with app.app_context():
-        logger.info("启动执行结果摘要处理线程 (execution_summary_worker)")
+        logger.info(f"启动执行结果摘要处理线程 (execution_summary_worker)，并发数: {pool.concurrency}")
         while True:
             try:
                 # 开始循环先回滚，确保使用最新快照，避免长事务
                 db.session.rollback()
-                db.session.expire_all() # Ensure fresh data if worker sleeps for long
-                pending_executions = get_executions_for_summarization()
-                if pending_executions:
-                    # logger.info(f"ExecutionSummaryWorker: 发现 {len(pending_executions)} 个待处理的执行结果") # Reduced verbosity from get_executions... itself
-                    for execution in pending_executions:
-                        # Re-fetch execution inside the loop to ensure it's still 'completed'
-                        # This helps avoid race conditions if another process/thread modifies it.
-                        fresh_execution = Execution.query.filter_by(execution_id=execution.execution_id, execution_status='completed').first()
-                        if fresh_execution:
-                            process_execution_summary(fresh_execution, publisher)
-                        else:
-                            logger.info(f"ExecutionSummaryWorker: Execution {execution.execution_id} no longer 'completed' or not found. Skipping.")
-                    time.sleep(1) # Shorter sleep if there was work
+                requeue_stale_summarizing()
+                if pool.full():
+                    pool.wait_for_slot()
+                    continue
+                if llm_limiter.saturated():
+                    # LLM限流已饱和，认领更多工作只会排队，稍后再试
+                    time.sleep(1)
+                    continue
+                if time.monotonic() < _summary_claims_paused_until:
+                    # 批量摘要的LLM请求刚失败过，暂缓认领
+                    time.sleep(1)
+                    continue
+                execution_ids = claim_executions_for_summarization(claim_limit)
+                if execution_ids:
+                    pool.submit(execution_ids[0], summarize_claimed_executions, execution_ids, publisher)
                 else:
                     # Use configured interval, default if not set
                     sleep_duration = getattr(config, 'EXPERT_EXECUTION_SUMMARY_INTERVAL', 5)
                     time.sleep(sleep_duration)
-            except pika.exceptions.AMQPConnectionError as amqp_err:
-                logger.error(f"ExecutionSummaryWorker: RabbitMQ连接错误: {amqp_err}. Retrying in 10s.")
-                time.sleep(10)
             except Exception as e:
-                logger.error(f"ExecutionSummaryWorker: 处理执行结果摘要时出错: {str(e)}")
+                db.session.rollback()
+                logger.error(f"ExecutionSummaryWorker: 认领执行结果摘要时出错: {str(e)}")
                 logger.error(traceback.format_exc())
                 sleep_duration_error = getattr(config, 'EXPERT_EXECUTION_SUMMARY_INTERVAL_ERROR', 15)
                 time.sleep(sleep_duration_error) # Sleep on other errors
 
+def _finish_summarized_event(event_id):
+    """summarized -> round_finished / completed（达到最大轮次或已人工解决），summary_failed -> failed"""
+    event = db.session.query(Event).with_for_update().filter_by(event_id=event_id).filter(
+        or_(Event.event_status == 'summarized', Event.event_status == 'summary_failed')
+    ).first()
+    if not event:
+        db.session.rollback()
+        logger.debug(f"LifecycleManager: Event {event_id} no longer 'summarized'/'summary_failed' or disappeared.")
+        return False
+
+    original_status = event.event_status
+    if original_status == 'summarized':
+        if event.current_round >= config.EVENT_MAX_ROUND:
+            set_event_status(event, 'completed')
+        else:
+            # 安全解析 context 判断是否为人工解决
+            context_dict = {}
+            if event.context:
+                if isinstance(event.context, dict):
+                    context_dict = event.context
+                elif isinstance(event.context, str):
+                    try:
+                        context_dict = json.loads(event.context)
+                    except Exception as ctx_err:
+                        logger.warning(f"LifecycleManager: 解析事件 context JSON 失败 (event={event_id}): {ctx_err}")
+            if 'resolution_note' in context_dict:
+                set_event_status(event, 'completed')
+                logger.info(f"LifecycleManager: Event {event_id} was resolved and now summarized, setting to 'completed'.")
+            else:
+                set_event_status(event, 'round_finished')
+    else:
+        set_event_status(event, 'failed') # Event processing failed overall due to summary failure.
+
+    db.session.commit()
+    logger.info(f"LifecycleManager: Event {event_id} ({event.event_name}) status updated '{original_status}' -> '{event.event_status}' (Round: {event.current_round}).")
+    return True
+
+
+def process_event_lifecycle(event_id, publisher: RabbitMQPublisher, sweep=False):
+    """按事件当前状态推进一步生命周期
+
+    推进后的新状态会写入状态变更记录，由生命周期线程在下一批中继续处理。
+
+    Args:
+        event_id: 事件ID
+        publisher: RabbitMQPublisher instance
+        sweep: 是否为全量扫描；processing 状态平时由状态汇总推进，只在扫描时兜底检查
+
+    Returns:
+        bool: 是否执行了推进动作
+    """
+    db.session.expire_all()
+    event = Event.query.filter_by(event_id=event_id).first()
+    if not event:
+        db.session.rollback()
+        return False
+    status = event.event_status
+
+    if status == 'processing':
+        if not sweep:
+            db.session.rollback()
+            return False
+        changed = check_and_update_event_tasks_completion(event_id, event.current_round, publisher)
+        if changed:
+            logger.info(f"LifecycleManager: Sweep check for Event {event_id} resulted in status change (likely to 'tasks_completed' or 'failed').")
+        return changed
+
+    if status == 'tasks_completed':
+        locked = db.session.query(Event).with_for_update().filter_by(event_id=event_id, event_status='tasks_completed').first()
+        if not locked:
+            db.session.rollback()
+            logger.debug(f"LifecycleManager: Event {event_id} no longer 'tasks_completed' before 'to_be_summarized' update.")
+            return False
+        set_event_status(locked, 'to_be_summarized')
+        db.session.commit()
+        logger.info(f"LifecycleManager: Event {event_id} ({locked.event_name}) status updated 'tasks_completed' -> 'to_be_summarized'.")
+        return True
+
+    if status in ('to_be_summarized', 'resolved'):
+        logger.info(f"LifecycleManager: Event {event_id} ({event.event_name}, Status: {status}) calling generate_event_summary.")
+        generate_event_summary(event_id, publisher)
+        return True
+
+    if status in ('summarized', 'summary_failed'):
+        return _finish_summarized_event(event_id)
+
+    if status == 'round_finished':
+        logger.info(f"LifecycleManager: Event {event_id} ({event.event_name}, Round {event.current_round}) calling advance_event_to_next_round.")
+        advanced = advance_event_to_next_round(event_id, publisher)
+        logger.info(f"LifecycleManager: Event {event_id} after advance call. Advanced: {advanced}. New Status: {event.event_status}, New Round: {event.current_round}")
+        return True
+
+    db.session.rollback()
+    return False
+
+
+def _process_lifecycle_events(event_ids, publisher, sweep=False):
+    """逐个推进事件，单个事件出错不影响同批的其他事件（遗漏的由全量扫描兜底）"""
+    for event_id in event_ids:
+        try:
+            process_event_lifecycle(event_id, publisher, sweep=sweep)
+        except pika.exceptions.AMQPConnectionError:
+            raise
+        except Exception as e:
+            logger.error(f"LifecycleManager: 推进事件 {event_id} 失败: {e}")
+            logger.error(traceback.format_exc())
+            db.session.rollback()
+
+
 def event_lifecycle_manager_worker(app, publisher: RabbitMQPublisher):
+    """事件生命周期线程：只处理发生了状态变更的事件，并定期全量扫描兜底"""
     with app.app_context():
         logger.info("Starting Event Lifecycle Manager Worker...")
-        sleep_interval = config.EXPERT_LIFECYCLE_INTERVAL or 7 
-        max_sleep_interval = sleep_interval * 4 
-        current_sleep = sleep_interval
+        waiter = WorkQueueWaiter(LIFECYCLE_ROLE)
+        # 启动时先做一次全量扫描，接管停机期间积压的事件
+        next_sweep = 0.0
 
         while True:
             try:
                 # 先回滚，避免长事务快照
                 db.session.rollback()
-                db.session.expire_all() 
-                did_work_in_cycle = False
-
-                # 0. Check for 'processing' events whose tasks might be complete
-                # This step ensures that if _trigger_event_round_evaluation was missed or if an event
-                # is stuck in 'processing', we can re-evaluate it.
-                # This is a more proactive check in the lifecycle manager itself.
-                processing_events = Event.query.filter_by(event_status='processing').order_by(Event.updated_at.asc()).all()
-                if processing_events:
-                    logger.debug(f"LifecycleManager: Found {len(processing_events)} 'processing' events to check for task completion.")
-                    for event in processing_events:
-                        # Re-check if tasks are completed. check_and_update_event_tasks_completion handles locking.
-                        status_changed = check_and_update_event_tasks_completion(event.event_id, event.current_round, publisher)
-                        if status_changed:
-                            logger.info(f"LifecycleManager: Proactive check for Event {event.event_id} R{event.current_round} resulted in status change (likely to 'tasks_completed' or 'failed').")
-                            did_work_in_cycle = True
-                            # After status change, re-fetch the event to get its new status for subsequent steps in this same cycle
-                            # This avoids waiting for the next loop iteration if it moved to tasks_completed.
-                            # db.session.expire(event) # Expire the specific event object
-                            # event = Event.query.filter_by(event_id=event.event_id).first() # Re-fetch
-                            # if not event: continue # Should not happen
-
-                # 1. Process events where tasks are completed (status: 'tasks_completed')
-                #    Action: Mark for summarization (status: 'to_be_summarized')
-                # Re-query after the potential changes from step 0
-                db.session.expire_all()
-                events_tasks_completed = Event.query.filter_by(event_status='tasks_completed').order_by(Event.updated_at.asc()).all()
-                if events_tasks_completed:
-                    logger.info(f"LifecycleManager: Found {len(events_tasks_completed)} events with 'tasks_completed'.")
-                    for event_tc in events_tasks_completed: # Use different var name
-                        # Re-fetch with lock to prevent race condition before update
-                        fresh_event_tc = db.session.query(Event).with_for_update().filter_by(event_id=event_tc.event_id, event_status='tasks_completed').first()
-                        if fresh_event_tc:
-                            fresh_event_tc.event_status = 'to_be_summarized'
-                            db.session.commit()
-                            logger.info(f"LifecycleManager: Event {fresh_event_tc.event_id} ({fresh_event_tc.event_name}) status updated 'tasks_completed' -> 'to_be_summarized'.")
-                            did_work_in_cycle = True
-                        else:
-                            logger.debug(f"LifecycleManager: Event {event_tc.event_id} no longer 'tasks_completed' or disappeared before 'to_be_summarized' update.")
-                
-                # 2. Process events marked for summarization (status: 'to_be_summarized' or 'resolved')
-                #    'resolved' also leads to a final summary.
-                #    Action: Call generate_event_summary (which sets status to 'summarized' or 'summary_failed')
-                db.session.expire_all()
-                events_to_be_summarized = Event.query.filter(
-                    or_(Event.event_status == 'to_be_summarized', Event.event_status == 'resolved')
-                ).order_by(Event.updated_at.asc()).all()
-                if events_to_be_summarized:
-                    logger.info(f"LifecycleManager: Found {len(events_to_be_summarized)} events 'to_be_summarized' or 'resolved'.")
-                    for event_tbs in events_to_be_summarized: # Use different var name
-                        # generate_event_summary handles its own concurrency for LLM call and DB updates for summary object
-                        # It also re-fetches event before final status update to 'summarized' or 'summary_failed'.
-                        # It expects event status 'to_be_summarized'. For 'resolved', generate_event_summary should perhaps handle it.
-                        # For now, generate_event_summary is called. It internally checks for 'to_be_summarized'.
-                        # If event is 'resolved', generate_event_summary will log "事件状态不是to_be_summarized" and return.
-                        # We need to ensure generate_event_summary can handle 'resolved' or we adjust logic here.
-
-                        # Let's make generate_event_summary accept 'resolved' as a trigger for final summary.
-                        # For now, assume generate_event_summary is robust or will be adapted.
-                        
-                        # Check status before calling to avoid unnecessary calls if it changed.
-                        checked_event_tbs = Event.query.filter_by(event_id=event_tbs.event_id).filter(
-                            or_(Event.event_status == 'to_be_summarized', Event.event_status == 'resolved')
-                        ).first()
-
-                        if checked_event_tbs:
-                            logger.info(f"LifecycleManager: Event {checked_event_tbs.event_id} ({checked_event_tbs.event_name}, Status: {checked_event_tbs.event_status}) calling generate_event_summary.")
-                            generate_event_summary(checked_event_tbs.event_id, publisher) # generate_event_summary needs to handle 'resolved' state properly
-                            did_work_in_cycle = True 
-                        else:
-                            logger.debug(f"LifecycleManager: Event {event_tbs.event_id} no longer 'to_be_summarized'/'resolved' before calling generate_event_summary.")
-
-                # 3. Process summarized events (status: 'summarized') or summary_failed events
-                #    Action for 'summarized': Mark 'round_finished' or 'completed' (if max rounds)
-                #    Action for 'summary_failed': Mark 'failed' (event failed)
-                db.session.expire_all()
-                events_summary_done_or_failed = Event.query.filter(
-                    or_(Event.event_status == 'summarized', Event.event_status == 'summary_failed')
-                ).order_by(Event.updated_at.asc()).all()
-
-                if events_summary_done_or_failed:
-                    logger.info(f"LifecycleManager: Found {len(events_summary_done_or_failed)} events 'summarized' or 'summary_failed'.")
-                    for event_s_or_sf in events_summary_done_or_failed: # Use different var name
-                        fresh_event_s_or_sf = db.session.query(Event).with_for_update().filter_by(event_id=event_s_or_sf.event_id).filter(
-                             or_(Event.event_status == 'summarized', Event.event_status == 'summary_failed')
-                        ).first()
-
-                        if fresh_event_s_or_sf:
-                            original_status_for_log = fresh_event_s_or_sf.event_status
-                            if original_status_for_log == 'summarized':
-                                if fresh_event_s_or_sf.current_round >= config.EVENT_MAX_ROUND:
-                                    fresh_event_s_or_sf.event_status = 'completed'
-                                else:
-                                    # 安全解析 context 判断是否为人工解决
-                                    context_dict = {}
-                                    if fresh_event_s_or_sf.context:
-                                        if isinstance(fresh_event_s_or_sf.context, dict):
-                                            context_dict = fresh_event_s_or_sf.context
-                                        elif isinstance(fresh_event_s_or_sf.context, str):
-                                            try:
-                                                context_dict = json.loads(fresh_event_s_or_sf.context)
-                                            except Exception as ctx_err:
-                                                logger.warning(f"LifecycleManager: 解析事件 context JSON 失败 (event={fresh_event_s_or_sf.event_id}): {ctx_err}")
-                                    is_resolved_event = 'resolution_note' in context_dict
-                                    
-                                    if is_resolved_event:
-                                        fresh_event_s_or_sf.event_status = 'completed'
-                                        logger.info(f"LifecycleManager: Event {fresh_event_s_or_sf.event_id} was resolved and now summarized, setting to 'completed'.")
-                                    else:
-                                        fresh_event_s_or_sf.event_status = 'round_finished'
-
-                            elif original_status_for_log == 'summary_failed':
-                                fresh_event_s_or_sf.event_status = 'failed' # Event processing failed overall due to summary failure.
-                            
-                            db.session.commit()
-                            logger.info(f"LifecycleManager: Event {fresh_event_s_or_sf.event_id} ({fresh_event_s_or_sf.event_name}) status updated '{original_status_for_log}' -> '{fresh_event_s_or_sf.event_status}' (Round: {fresh_event_s_or_sf.current_round}).")
-                            did_work_in_cycle = True
-                        else:
-                            logger.debug(f"LifecycleManager: Event {event_s_or_sf.event_id} no longer 'summarized'/'summary_failed' or disappeared.")
-
-                # 4. Process round_finished events (status: 'round_finished')
-                #    Action: Call advance_event_to_next_round (sets to 'pending' or 'completed')
-                db.session.expire_all()
-                events_round_finished = Event.query.filter_by(event_status='round_finished').order_by(Event.updated_at.asc()).all()
-                if events_round_finished:
-                    logger.info(f"LifecycleManager: Found {len(events_round_finished)} events 'round_finished'.")
-                    for event_rf in events_round_finished: # Use different var name
-                        # advance_event_to_next_round handles its own concurrency and status updates.
-                        checked_event_rf = Event.query.filter_by(event_id=event_rf.event_id, event_status='round_finished').first()
-                        if checked_event_rf:
-                            logger.info(f"LifecycleManager: Event {checked_event_rf.event_id} ({checked_event_rf.event_name}, Round {checked_event_rf.current_round}) calling advance_event_to_next_round.")
-                            advanced = advance_event_to_next_round(checked_event_rf.event_id, publisher)
-                            # Log current status after advance_event_to_next_round for clarity
-                            db.session.expire(checked_event_rf) # Expire to re-fetch
-                            final_event_state = Event.query.filter_by(event_id=checked_event_rf.event_id).first()
-                            if final_event_state:
-                                logger.info(f"LifecycleManager: Event {final_event_state.event_id} after advance call. Advanced: {advanced}. New Status: {final_event_state.event_status}, New Round: {final_event_state.current_round}")
-                            else:
-                                logger.warning(f"LifecycleManager: Event {checked_event_rf.event_id} disappeared after advance_event_to_next_round call.")
-                            did_work_in_cycle = True 
-                        else:
-                            logger.debug(f"LifecycleManager: Event {event_rf.event_id} no longer 'round_finished' before calling advance_event_to_next_round.")
-                
-                # Adjust sleep time based on whether work was done in this cycle
-                if did_work_in_cycle:
-                    current_sleep = sleep_interval # Reset to base interval if work was done
-                else:
-                    current_sleep = min(current_sleep * 1.5, max_sleep_interval)
-                    logger.debug(f"Event Lifecycle Manager: No actionable events in this cycle, sleeping for {current_sleep:.2f}s.")
-                
-                time.sleep(current_sleep)
+
+                if time.monotonic() >= next_sweep:
+                    event_ids = sweep_lifecycle_event_ids()
+                    if event_ids:
+                        logger.info(f"LifecycleManager: 全量扫描发现 {len(event_ids)} 个处于生命周期状态的事件")
+                    _process_lifecycle_events(event_ids, publisher, sweep=True)
+                    purge_processed_transitions()
+                    next_sweep = time.monotonic() + config.EXPERT_LIFECYCLE_SWEEP_INTERVAL
+
+                event_ids = claim_transitions(config.EXPERT_LIFECYCLE_BATCH)
+                if event_ids:
+                    logger.debug(f"LifecycleManager: 处理 {len(event_ids)} 个发生状态变更的事件")
+                    _process_lifecycle_events(event_ids, publisher)
+                    continue
+
+                # 没有待处理的变更时等待通知，最迟在下次全量扫描时醒来
+                waiter.wait(timeout=max(1.0, min(next_sweep - time.monotonic(), WORK_RECONCILE_INTERVAL)))
 
             except pika.exceptions.AMQPConnectionError as amqp_err:
                 logger.error(f"EventLifecycleManager: RabbitMQ connection error: {amqp_err}. Retrying in 15s.")
                 db.session.rollback() # Rollback any transaction due to AMQP error
                 time.sleep(15)
-                current_sleep = sleep_interval # Reset sleep on presumed recovery
             except Exception as e:
                 logger.error(f"EventLifecycleManager: Unhandled error: {str(e)}")
                 logger.error(traceback.format_exc())
                 db.session.rollback() # Rollback potentially problematic transaction
-                time.sleep(max_sleep_interval) # Longer sleep on unknown error
-                current_sleep = sleep_interval # Reset sleep on presumed recovery
+                time.sleep(config.EXPERT_LIFECYCLE_INTERVAL_ERROR)
 
 def run_expert():
     logger.info("启动_expert服务...")
@@ -757,7 +549,8 @@ def run_expert():
 
     publisher = None
     try:
-        publisher = RabbitMQPublisher()
+        # 摘要线程池与生命周期线程共用同一个发布器，pika连接不是线程安全的
+        publisher = ThreadSafePublisher()
         logger.info("RabbitMQ Publisher for Expert Service initialized.")
 
         threads = []
@@ -820,16 +613,17 @@ def advance_event_to_next_round(event_id, publisher: RabbitMQPublisher):
     if current_round >= config.EVENT_MAX_ROUND:
         logger.warning(f"事件 {event_id} 已达到最大轮次 ({current_round}), 无法推进. 事件状态将设置为 'completed'.")
         if event.event_status != 'completed': # Ensure it's not already completed
-            event.event_status = 'completed'
+            set_event_status(event, 'completed')
             db.session.commit()
             logger.info(f"事件 {event_id} 在最大轮次时状态已设置为 'completed'.")
         return False # Cannot advance further, already handled.
     
     previous_round_id = event.current_round
     event.current_round = current_round + 1
-    event.event_status = 'pending' # New round starts as pending
+    set_event_status(event, 'pending') # New round starts as pending
     db.session.commit()
     logger.info(f"事件 {event_id} 从轮次 {previous_round_id} 推进到新轮次: {event.current_round}, 状态: 'pending'.")
+    notify_work('_captain', publisher, event_id=event_id, round_id=event.current_round)
 
     next_round_content = {
         "event_id": event.event_id, "event_name": event.event_name,
@@ -874,7 +668,7 @@ def resolve_event(event_id, publisher: RabbitMQPublisher, resolution_note=None):
     event.context = json.dumps(current_context)
 
     # Set status to indicate resolution, then to 'to_be_summarized' for final report
-    event.event_status = 'resolved' 
+    set_event_status(event, 'resolved')
     # if hasattr(event, 'resolved_at'): # Assuming 'resolved_at' is a field on the model
     #     event.resolved_at = datetime.utcnow()
     db.session.commit()
@@ -898,14 +692,11 @@ def resolve_event(event_id, publisher: RabbitMQPublisher, resolution_note=None):
             logger.error(f"发布事件解决消息失败: {e_pub}")
 
     # Now, mark for final summarization
-    event.event_status = 'to_be_summarized'
+    set_event_status(event, 'to_be_summarized')
     db.session.commit()
     logger.info(f"事件 {event_id} 解决后，标记为 'to_be_summarized' 以生成最终总结。")
-    
-    # Explicitly trigger summary generation. In a fully refactored model,
-    # the event_lifecycle_manager_worker would pick this up.
-    # For now, direct call after setting status.
-    # generate_event_summary(event_id, publisher) # This will be handled by the worker that polls 'to_be_summarized'
+    # 由事件生命周期线程处理状态变更并生成最终总结
+    notify_lifecycle(event_id, publisher)
     
     return True
 
@@ -936,9 +727,11 @@ def debug_event_status(event_id):
 
 # ------------- 生成事件总结核心函数（恢复）-------------
 
-def generate_event_summary(event_id: str, publisher: RabbitMQPublisher):
-    """根据当前事件的所有数据生成总结，并更新事件状态
+def generate_event_summary(event_id: str, publisher: RabbitMQPublisher, full_rebuild=False):
+    """生成事件总结，并更新事件状态
 
+    默认增量生成：只把上一条总结的滚动摘要和此后新增的执行结果交给模型（见 app/services/event_summary.py）；
+    full_rebuild 为 True 或配置了 EXPERT_EVENT_SUMMARY_FULL_REBUILD 时按事件全部数据重建。
     仅在 Event.event_status 为 'to_be_summarized' 或 'resolved' 时执行。
     生成完成后将事件状态更新为 'summarized'（正常流程）或 'completed'（若已解决或达到最大轮次）。
     失败时将事件状态置为 'summary_failed'。
@@ -955,27 +748,9 @@ def generate_event_summary(event_id: str, publisher: RabbitMQPublisher):
 
     try:
         logger.info(f"generate_event_summary: 开始生成事件 {event_id} 第 {event.current_round} 轮总结，状态 {event.event_status}")
-        # 收集上下文
-        tasks = Task.query.filter_by(event_id=event_id).all()
-        actions = Action.query.filter_by(event_id=event_id).all()
-        commands = Command.query.filter_by(event_id=event_id).all()
-        executions = Execution.query.filter_by(event_id=event_id).all()
-
-        ctx = {
-            "event_id": event.event_id,
-            "event_name": event.event_name,
-            "event_message": event.message,
-            "round_id": event.current_round,
-            "event_status": event.event_status,
-            "tasks": [{"id": t.task_id, "name": t.task_name, "status": t.task_status} for t in tasks],
-            "actions": [{"id": a.action_id, "name": a.action_name, "status": a.action_status} for a in actions],
-            "commands": [{"id": c.command_id, "name": c.command_name, "status": c.command_status} for c in commands],
-            "executions": [{"id": e.execution_id, "status": e.execution_status, "ai_summary": e.ai_summary} for e in executions]
-        }
-        yaml_ctx = yaml.dump(ctx, allow_unicode=True, default_flow_style=False, indent=2)
-
-        system_prompt = """你是经验丰富的安全专家，请根据给定 YAML 信息生成仅包含客观事实的事件战况概述。"""
-        user_prompt = f"""```yaml\n{yaml_ctx}\n```\n请生成事件战况概述。"""
+        user_prompt, execution_watermark, summary_mode = build_event_summary_prompt(
+            event, full_rebuild=full_rebuild or config.EXPERT_EVENT_SUMMARY_FULL_REBUILD
+        )
 
         # 通知前端开始 LLM
         start_msg = create_standard_message(event_id=event_id, message_from='system', round_id=event.current_round, message_type='expert_llm_request_event_summary', content_data={"text": f"_expert 正在为事件 {event_id} 生成总结"})
@@ -986,17 +761,20 @@ def generate_event_summary(event_id: str, publisher: RabbitMQPublisher):
             except Exception as mq_err:
                 logger.error(f"generate_event_summary: 发布开始消息失败: {mq_err}")
 
-        summary_text = call_llm(system_prompt, user_prompt, temperature=0.3, long_text=True).strip()
-        logger.info(f"generate_event_summary: LLM 返回完成。长度 {len(summary_text)} 字")
+        response = call_llm(EVENT_SUMMARY_SYSTEM_PROMPT, user_prompt, temperature=0.3, role='_expert')
+        summary_text, digest = parse_event_summary(response)
+        logger.info(f"generate_event_summary: LLM 返回完成（{summary_mode}）。总结 {len(summary_text)} 字，滚动摘要 {len(digest)} 字")
 
-        summary_obj = Summary(summary_id=str(uuid.uuid4()), event_id=event_id, round_id=event.current_round, event_summary=summary_text, event_suggestion="")
+        summary_obj = Summary(summary_id=str(uuid.uuid4()), event_id=event_id, round_id=event.current_round,
+                              event_summary=summary_text, event_suggestion="", digest=digest,
+                              execution_watermark=execution_watermark, summary_mode=summary_mode)
         db.session.add(summary_obj)
 
         # 更新事件状态
         if event.event_status == 'resolved' or event.current_round >= config.EVENT_MAX_ROUND:
-            event.event_status = 'completed'
+            set_event_status(event, 'completed')
         else:
-            event.event_status = 'summarized'
+            set_event_status(event, 'summarized')
         db.session.commit()
         logger.info(f"generate_event_summary: 事件 {event_id} 状态更新为 {event.event_status}")
 
@@ -1008,5 +786,5 @@ def generate_event_summary(event_id: str, publisher: RabbitMQPublisher):
         db.session.rollback()
         evt = Event.query.filter_by(event_id=event_id).first()
         if evt and evt.event_status in ['to_be_summarized', 'resolved']:
-            evt.event_status = 'summary_failed'
+            set_event_status(evt, 'summary_failed')
             db.session.commit() 
\ No newline at end of file
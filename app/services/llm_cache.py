@@ -0,0 +1,159 @@
+"""LLM响应缓存
+
+以 模型 + 温度 + 完整messages（系统提示词、历史对话、用户提示词）的哈希作为键，
+命中时直接返回之前的响应，跳过一次大模型往返。
+
+- 进程内LRU层：容量由 LLM_CACHE_MAX_ENTRIES 控制
+- 可选的磁盘层（SQLite）：配置 LLM_CACHE_DISK_PATH 后启用，同一主机上的多个Agent进程共享
+- 两层均按 LLM_CACHE_TTL 过期
+- 按角色开启：LLM_CACHE_ENABLED 总开关 + LLM_CACHE_ROLES 角色列表
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'False').lower() == 'true'
+LLM_CACHE_ROLES = [r.strip() for r in os.getenv('LLM_CACHE_ROLES', '_expert,_captain').split(',') if r.strip()]
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 512))
+LLM_CACHE_DISK_PATH = os.getenv('LLM_CACHE_DISK_PATH', '')
+
+
+def make_cache_key(model, temperature, messages, extra=None):
+    """根据模型、温度和完整messages计算缓存键；extra 为其他影响输出的请求参数（如 response_format）"""
+    parts = [model, temperature, messages]
+    if extra:
+        parts.append(extra)
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """线程安全的进程内LRU缓存，条目带过期时间"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteCache:
+    """基于SQLite文件的磁盘缓存层，可被同一主机上的多个进程共享"""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS llm_cache ('
+            'cache_key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM llm_cache WHERE cache_key = ?', (key,)
+            ).fetchone()
+        if not row:
+            return None
+        value, expires_at = row
+        if expires_at < time.time():
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (cache_key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), expires_at)
+            )
+            # 顺带清理过期条目，避免文件无限增长
+            self._conn.execute('DELETE FROM llm_cache WHERE expires_at < ?', (time.time(),))
+            self._conn.commit()
+
+
+class LLMResponseCache:
+    """两级LLM响应缓存（进程内LRU + 可选SQLite）"""
+
+    def __init__(self, enabled=LLM_CACHE_ENABLED, roles=None, ttl=LLM_CACHE_TTL,
+                 max_entries=LLM_CACHE_MAX_ENTRIES, disk_path=LLM_CACHE_DISK_PATH):
+        self.enabled = enabled
+        self.roles = set(roles if roles is not None else LLM_CACHE_ROLES)
+        self.memory = LRUCache(max_entries, ttl)
+        self.disk = None
+        if enabled and disk_path:
+            try:
+                self.disk = SQLiteCache(disk_path, ttl)
+            except Exception as e:
+                logger.error(f"初始化LLM磁盘缓存失败，仅使用内存缓存: {e}")
+
+    def is_enabled_for(self, role):
+        return self.enabled and role in self.roles
+
+    def get(self, key):
+        """返回缓存条目（{'content': ..., 'usage': ..., 'request_id': ...}），未命中返回None"""
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        if self.disk:
+            try:
+                value = self.disk.get(key)
+            except Exception as e:
+                logger.warning(f"读取LLM磁盘缓存失败: {e}")
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk:
+            try:
+                self.disk.set(key, value)
+            except Exception as e:
+                logger.warning(f"写入LLM磁盘缓存失败: {e}")
+
+
+llm_cache = LLMResponseCache()
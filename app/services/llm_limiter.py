@@ -0,0 +1,334 @@
+"""LLM调用限流器
+
+对所有 call_llm / call_llm_stream 调用统一施加三类限制（任一配置为0表示不限制）：
+
+- LLM_RATE_LIMIT_RPS：每秒请求数（令牌桶）
+- LLM_RATE_LIMIT_TPM：每分钟token数（令牌桶，按估算token预扣，调用完成后按实际usage校正）
+- LLM_MAX_INFLIGHT：同时在途的调用数
+
+等待按优先级排队（数值越小越优先），例如严重事件的指挥官决策先于后台摘要获得名额。
+
+后端（LLM_LIMIT_BACKEND）：
+- local：进程内限流，每个Agent进程各自计数
+- file：基于文件锁（fcntl.flock）的跨进程限流，同一主机上的所有Agent进程共享
+  令牌桶状态和在途名额；进程内仍按优先级排队，跨进程时高优先级的轮询间隔更短
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_RATE_LIMIT_RPS = float(os.getenv('LLM_RATE_LIMIT_RPS', 0))
+LLM_RATE_LIMIT_TPM = int(os.getenv('LLM_RATE_LIMIT_TPM', 0))
+LLM_MAX_INFLIGHT = int(os.getenv('LLM_MAX_INFLIGHT', 0))
+LLM_LIMIT_BACKEND = os.getenv('LLM_LIMIT_BACKEND', 'local').lower()
+LLM_LIMIT_LOCK_DIR = os.getenv('LLM_LIMIT_LOCK_DIR', '/tmp/deepsoc_llm_limiter')
+LLM_LIMIT_WAIT_TIMEOUT = float(os.getenv('LLM_LIMIT_WAIT_TIMEOUT', 300))
+
+# 优先级：数值越小越优先
+PRIORITY_CRITICAL = 0
+PRIORITY_HIGH = 1
+PRIORITY_NORMAL = 2
+PRIORITY_LOW = 3
+
+ROLE_PRIORITIES = {
+    '_captain': PRIORITY_HIGH,
+    'engineer_chat': PRIORITY_HIGH,
+    '_manager': PRIORITY_NORMAL,
+    '_operator': PRIORITY_NORMAL,
+    '_expert': PRIORITY_LOW,
+}
+
+
+class LLMRateLimitTimeout(Exception):
+    """等待限流名额超时"""
+
+
+def priority_for(role, severity=None):
+    """根据调用方角色和事件严重程度得到优先级"""
+    priority = ROLE_PRIORITIES.get(role, PRIORITY_NORMAL)
+    if role == '_captain' and severity in ('critical', 'high'):
+        priority = PRIORITY_CRITICAL
+    return priority
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充量，capacity 为桶容量"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """距离桶内令牌足够 amount 还需等待的秒数"""
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+
+
+class _Permit:
+    def __init__(self, priority, tokens):
+        self.priority = priority
+        self.tokens = tokens
+        self.slot_file = None
+
+
+class FileLimiterBackend:
+    """基于文件锁的跨进程限流后端
+
+    - 令牌桶状态保存在 state.json 中，读写时持有排他锁
+    - 在途名额为 slot_<n>.lock 文件，持有其中一个文件的排他锁即占用一个名额
+    """
+
+    def __init__(self, lock_dir, rps, tpm, max_inflight):
+        self.lock_dir = lock_dir
+        self.rps = rps
+        self.tpm = tpm
+        self.max_inflight = max_inflight
+        os.makedirs(lock_dir, exist_ok=True)
+        self.state_path = os.path.join(lock_dir, 'state.json')
+
+    def try_acquire_rate(self, tokens):
+        """尝试扣减共享令牌桶，成功返回0，否则返回建议等待秒数"""
+        if self.rps <= 0 and self.tpm <= 0:
+            return 0
+        with open(self.state_path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                state = self._read_state(f)
+                now = time.time()
+                demands = []
+                if self.rps > 0:
+                    demands.append(('rps_tokens', self._bucket(state, 'rps_tokens', self.rps, max(1.0, self.rps), now), 1))
+                if self.tpm > 0:
+                    demands.append(('tpm_tokens', self._bucket(state, 'tpm_tokens', self.tpm / 60.0, self.tpm, now), tokens))
+                wait = max(bucket.wait_time(amount) for _, bucket, amount in demands)
+                if wait <= 0:
+                    state['updated'] = now
+                    for name, bucket, amount in demands:
+                        state[name] = bucket.tokens - min(amount, bucket.capacity)
+                    self._write_state(f, state)
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def adjust_tokens(self, delta):
+        """按实际usage校正共享token桶（delta为实际减去预扣的token数）"""
+        if self.tpm <= 0 or not delta:
+            return
+        with open(self.state_path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                state = self._read_state(f)
+                state['tpm_tokens'] = state.get('tpm_tokens', self.tpm) - delta
+                self._write_state(f, state)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _bucket(state, name, rate, capacity, now):
+        """根据共享状态还原令牌桶并补充到当前时刻"""
+        bucket = TokenBucket(rate, capacity)
+        elapsed = max(0, now - state.get('updated', now))
+        bucket.tokens = min(capacity, state.get(name, capacity) + elapsed * rate)
+        return bucket
+
+    @staticmethod
+    def _read_state(f):
+        f.seek(0)
+        raw = f.read()
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _write_state(f, state):
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(state))
+        f.flush()
+
+    def try_acquire_slot(self):
+        """尝试占用一个跨进程在途名额，成功返回持有锁的文件对象"""
+        if self.max_inflight <= 0:
+            return True
+        for i in range(self.max_inflight):
+            f = open(os.path.join(self.lock_dir, f'slot_{i}.lock'), 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except OSError:
+                f.close()
+        return None
+
+    @staticmethod
+    def release_slot(f):
+        if f and f is not True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            finally:
+                f.close()
+
+
+class LLMLimiter:
+    """按优先级排队的LLM调用限流器"""
+
+    def __init__(self, rps=LLM_RATE_LIMIT_RPS, tpm=LLM_RATE_LIMIT_TPM, max_inflight=LLM_MAX_INFLIGHT,
+                 backend=LLM_LIMIT_BACKEND, lock_dir=LLM_LIMIT_LOCK_DIR, wait_timeout=LLM_LIMIT_WAIT_TIMEOUT):
+        self.max_inflight = max_inflight
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._inflight = 0
+        self._file = None
+        if backend == 'file':
+            if fcntl is None:
+                logger.warning("当前平台不支持fcntl文件锁，LLM限流退化为进程内模式")
+            else:
+                self._file = FileLimiterBackend(lock_dir, rps, tpm, max_inflight)
+        # 使用文件后端时令牌桶由所有进程共享，进程内不再单独计数
+        self._rps_bucket = TokenBucket(rps, max(1.0, rps)) if rps > 0 and not self._file else None
+        self._tpm_bucket = TokenBucket(tpm / 60.0, tpm) if tpm > 0 and not self._file else None
+
+    @property
+    def enabled(self):
+        return bool(self.max_inflight > 0 or self._rps_bucket or self._tpm_bucket or self._file)
+
+    @contextmanager
+    def acquire(self, priority=PRIORITY_NORMAL, tokens=0):
+        """获取一个调用名额，退出上下文时释放
+
+        Args:
+            priority: 优先级，数值越小越优先
+            tokens: 本次调用的预估token数（用于每分钟token限制）
+
+        Raises:
+            LLMRateLimitTimeout: 等待超过 LLM_LIMIT_WAIT_TIMEOUT 秒
+        """
+        if not self.enabled:
+            yield _Permit(priority, tokens)
+            return
+
+        deadline = time.monotonic() + self.wait_timeout
+        permit = _Permit(priority, tokens)
+        self._acquire_local(permit, deadline)
+        try:
+            if self._file:
+                self._acquire_file(permit, deadline)
+            yield permit
+        finally:
+            if self._file:
+                FileLimiterBackend.release_slot(permit.slot_file)
+            with self._cond:
+                self._inflight -= 1
+                self._cond.notify_all()
+
+    def saturated(self):
+        """进程内是否已有调用在排队等待名额（或在途调用已达上限）
+
+        后台任务（如执行结果摘要）在认领新工作前检查，饱和时暂缓认领，避免认领后长时间排队占着工作不处理。
+        """
+        if not self.enabled:
+            return False
+        with self._cond:
+            if self.max_inflight > 0 and self._inflight >= self.max_inflight:
+                return True
+            return bool(self._waiters)
+
+    def settle(self, permit, actual_tokens):
+        """调用完成后按实际token用量校正token桶"""
+        if not actual_tokens or permit is None:
+            return
+        delta = actual_tokens - permit.tokens
+        if self._file:
+            try:
+                self._file.adjust_tokens(delta)
+            except Exception as e:
+                logger.warning(f"校正跨进程LLM token桶失败: {e}")
+        elif self._tpm_bucket:
+            with self._cond:
+                self._tpm_bucket.tokens -= delta
+
+    def _acquire_local(self, permit, deadline):
+        entry = (permit.priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    wait = None
+                    if self._waiters[0] == entry and (self.max_inflight <= 0 or self._inflight < self.max_inflight):
+                        wait = self._take_local_buckets(permit.tokens)
+                        if wait == 0:
+                            break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMRateLimitTimeout(f"等待LLM限流名额超时（{self.wait_timeout}秒）")
+                    self._cond.wait(timeout=min(remaining, wait) if wait else remaining)
+                heapq.heappop(self._waiters)
+                self._inflight += 1
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                raise
+            finally:
+                self._cond.notify_all()
+
+    def _take_local_buckets(self, tokens):
+        now = time.monotonic()
+        demands = []
+        if self._rps_bucket:
+            self._rps_bucket.refill(now)
+            demands.append((self._rps_bucket, 1))
+        if self._tpm_bucket:
+            self._tpm_bucket.refill(now)
+            demands.append((self._tpm_bucket, tokens))
+        wait = max([b.wait_time(n) for b, n in demands] or [0])
+        if wait <= 0:
+            for bucket, amount in demands:
+                bucket.tokens -= min(amount, bucket.capacity)
+            return 0
+        return wait
+
+    def _acquire_file(self, permit, deadline):
+        # 高优先级的轮询间隔更短，跨进程竞争时更容易先拿到名额
+        poll = 0.05 * (permit.priority + 1)
+        while True:
+            if permit.slot_file is None:
+                permit.slot_file = self._file.try_acquire_slot()
+            if permit.slot_file is not None:
+                wait = self._file.try_acquire_rate(permit.tokens)
+                if wait <= 0:
+                    return
+            else:
+                wait = poll
+            if time.monotonic() + min(wait, poll) > deadline:
+                raise LLMRateLimitTimeout(f"等待跨进程LLM限流名额超时（{self.wait_timeout}秒）")
+            time.sleep(min(wait, poll))
+
+
+llm_limiter = LLMLimiter()
@@ -0,0 +1,150 @@
+"""LLM调用记录（llm_records）的异步批量写入器
+
+每次 call_llm 都会产生一条包含完整请求messages和完整响应JSON的记录。
+同步写入会让每次Agent决策都等待一次较大的INSERT，并且会顺带提交调用方
+会话中尚未提交的其他改动。这里将记录放入内存队列，由后台线程按数量或时间
+阈值批量INSERT，使用独立的数据库会话，与Agent自身的事务完全解耦。
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from app.models.models import db, LLMRecord
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_RECORD_ASYNC = os.getenv('LLM_RECORD_ASYNC', 'True').lower() == 'true'
+LLM_RECORD_BATCH_SIZE = int(os.getenv('LLM_RECORD_BATCH_SIZE', 20))
+LLM_RECORD_FLUSH_INTERVAL = float(os.getenv('LLM_RECORD_FLUSH_INTERVAL', 2))
+LLM_RECORD_QUEUE_MAX = int(os.getenv('LLM_RECORD_QUEUE_MAX', 1000))
+
+_STOP = object()
+
+
+class LLMRecordWriter:
+    """后台批量写入 LLMRecord 的写入器，进程内单例使用"""
+
+    def __init__(self, batch_size=LLM_RECORD_BATCH_SIZE, flush_interval=LLM_RECORD_FLUSH_INTERVAL,
+                 max_queue=LLM_RECORD_QUEUE_MAX, async_enabled=LLM_RECORD_ASYNC):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.1, flush_interval)
+        self.async_enabled = async_enabled
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._engine = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, record_values: dict):
+        """提交一条记录（LLMRecord的列值字典）
+
+        需在Flask应用上下文中调用（首次调用时从中获取数据库引擎）。
+        异步模式下立即返回；队列已满时退化为同步写入，避免丢失审计数据。
+        """
+        record_values.setdefault('created_at', datetime.utcnow())
+        if self._engine is None:
+            self._engine = db.engine
+
+        if not self.async_enabled:
+            self._write_batch([record_values])
+            return
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record_values)
+        except queue.Full:
+            logger.warning("LLMRecord写入队列已满，改为同步写入")
+            self._write_batch([record_values])
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="LLMRecordWriterThread", daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+            logger.debug("LLMRecord写入线程已启动")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+            # 攒批：达到数量阈值或时间阈值即写入
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+            if stopping:
+                self._drain()
+                return
+
+    def _drain(self):
+        """写入队列中剩余的全部记录"""
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch)
+                batch = []
+        if batch:
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        """使用独立会话批量INSERT，失败只记录日志，不影响调用方"""
+        if not batch or self._engine is None:
+            return
+        session = Session(bind=self._engine)
+        try:
+            session.execute(LLMRecord.__table__.insert(), batch)
+            session.commit()
+            logger.debug(f"已批量写入 {len(batch)} 条LLMRecord")
+        except Exception as e:
+            session.rollback()
+            logger.error(f"批量写入LLMRecord失败（{len(batch)} 条）: {e}")
+        finally:
+            session.close()
+
+    def shutdown(self, timeout=10):
+        """停止写入线程，并在退出前写完队列中的记录"""
+        thread = self._thread
+        if not thread or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("LLMRecord写入队列已满，无法发送停止信号")
+            return
+        thread.join(timeout=timeout)
+        if thread.is_alive():
+            logger.warning("LLMRecord写入线程未能在超时时间内退出")
+
+
+llm_record_writer = LLMRecordWriter()
@@ -0,0 +1,339 @@
+"""大模型结构化响应解析
+
+替代原先的 parse_yaml_response：
+- 一次正则扫描定位第一个 yaml/yml/json（或未标注语言）的代码块，未闭合的代码块（输出被截断）同样可用
+- 优先使用 libyaml 的 CSafeLoader 加速解析，JSON 响应直接走 json 解析
+- 解析失败时依次尝试修复常见问题：Tab缩进、前后多余的说明文字、值中未加引号的冒号等
+- 仍失败时按顶层字段、列表元素逐段解析，尽量抢救出可用部分
+- 按角色的响应结构（llm_schemas）校验：非法的可选字段和列表元素会被剔除，必填字段缺失才判定失败
+"""
+import json
+import logging
+import re
+
+import yaml
+
+from app.services.llm_schemas import ROLE_RESPONSE_SCHEMAS, RESPONSE_TYPE_LISTS
+
+logger = logging.getLogger(__name__)
+
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_FENCE_PATTERN = re.compile(
+    r"```[ \t]*(?P<lang>[A-Za-z]*)[^\n]*\n(?P<body>.*?)(?:\n[ \t]*```|\Z)", re.S
+)
+_STRUCTURED_LANGS = ('', 'yaml', 'yml', 'json')
+_KEY_LINE = re.compile(r"^[A-Za-z_][\w\-]*:(?:\s|$)")
+_SCALAR_LINE = re.compile(r"^(?P<prefix>\s*(?:-\s+)?[A-Za-z_][\w\-]*:[ \t]+)(?P<value>\S.*?)[ \t]*$")
+_LIST_ITEM = re.compile(r"^(?P<indent>[ \t]*)-(?:\s|$)")
+
+
+class ParseResult:
+    """解析结果
+
+    Attributes:
+        data: 解析得到的字典，失败为None
+        errors: 校验/解析中发现的问题（已被剔除或修复的也会列出）
+        repairs: 实际生效的修复步骤
+        salvaged: 是否通过逐段解析或剔除非法内容得到结果
+    """
+
+    def __init__(self):
+        self.data = None
+        self.errors = []
+        self.repairs = []
+        self.salvaged = False
+
+    @property
+    def ok(self):
+        return self.data is not None
+
+
+def _load(text):
+    return yaml.load(text, Loader=_Loader)
+
+
+def extract_structured_block(text):
+    """返回第一个结构化代码块的内容；没有代码块时返回原文"""
+    for match in _FENCE_PATTERN.finditer(text):
+        if match.group('lang').lower() in _STRUCTURED_LANGS:
+            return match.group('body')
+    return text
+
+
+# --- 修复 ---
+
+def _fix_tabs(text):
+    return text.expandtabs(2)
+
+
+def _strip_prose(text):
+    """去掉首个顶层字段之前、以及末尾不属于YAML结构的说明文字"""
+    lines = text.splitlines()
+    start = next((i for i, line in enumerate(lines) if _KEY_LINE.match(line) or line.startswith('{')), None)
+    if start is None:
+        return text
+    end = len(lines)
+    while end > start + 1:
+        line = lines[end - 1]
+        if not line.strip() or line[0] in ' \t-#}' or _KEY_LINE.match(line):
+            break
+        end -= 1
+    return "\n".join(lines[start:end])
+
+
+def _quote_unsafe_scalars(text):
+    """给值中含有 ': ' 或以YAML特殊字符开头、导致解析失败的标量加上引号"""
+    fixed = []
+    for line in text.splitlines():
+        match = _SCALAR_LINE.match(line)
+        if match:
+            value = match.group('value')
+            if value[0] not in '\'"|>#' and _needs_quote(value):
+                line = match.group('prefix') + json.dumps(value, ensure_ascii=False)
+        fixed.append(line)
+    return "\n".join(fixed)
+
+
+def _needs_quote(value):
+    if ': ' in value or value[0] in '@`%!*&':
+        return True
+    if value[0] in '{[':
+        try:
+            _load(f"k: {value}")
+        except yaml.YAMLError:
+            return True
+    return False
+
+
+_REPAIRS = [
+    ('tabs', _fix_tabs),
+    ('prose', _strip_prose),
+    ('quote_scalars', _quote_unsafe_scalars),
+]
+
+
+# --- 抢救 ---
+
+def _split_top_level(text):
+    """按顶层字段切分为若干段"""
+    chunks, current = [], []
+    for line in text.splitlines():
+        if _KEY_LINE.match(line) and current:
+            chunks.append(current)
+            current = []
+        current.append(line)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _salvage_list(chunk):
+    """逐个列表元素解析，返回 (key, 可解析的元素列表)"""
+    key = chunk[0].split(':', 1)[0].strip()
+    items, current, indent = [], [], None
+    for line in chunk[1:]:
+        match = _LIST_ITEM.match(line)
+        if match and (indent is None or len(match.group('indent')) == indent):
+            indent = len(match.group('indent'))
+            if current:
+                items.append(current)
+            current = [line]
+        elif current:
+            current.append(line)
+    if current:
+        items.append(current)
+
+    parsed = []
+    for item in items:
+        try:
+            value = _load(f"{key}:\n" + "\n".join(item))
+        except yaml.YAMLError:
+            continue
+        if isinstance(value, dict) and isinstance(value.get(key), list):
+            parsed.extend(value[key])
+    return key, parsed
+
+
+def _salvage(text, result):
+    data = {}
+    for chunk in _split_top_level(text):
+        try:
+            value = _load("\n".join(chunk))
+        except yaml.YAMLError:
+            if chunk[0].split(':', 1)[1].strip() == '':
+                key, items = _salvage_list(chunk)
+                if items:
+                    data[key] = items
+                    result.errors.append(f"字段 {key} 部分元素无法解析，已保留 {len(items)} 个可解析的元素")
+                    continue
+            result.errors.append(f"无法解析的片段已丢弃: {chunk[0][:80]}")
+            continue
+        if isinstance(value, dict):
+            data.update(value)
+    return data or None
+
+
+# --- 校验 ---
+
+_TYPE_CHECKS = {
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, list),
+    'string': lambda v: isinstance(v, str),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+    'null': lambda v: v is None,
+}
+
+
+def validate(value, schema, path='$'):
+    """按 JSON Schema 子集校验，返回错误列表"""
+    errors = []
+    types = schema.get('type')
+    if types:
+        types = types if isinstance(types, list) else [types]
+        if not any(_TYPE_CHECKS[t](value) for t in types):
+            return [f"{path}: 类型应为 {'/'.join(types)}"]
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append(f"{path}: 取值应为 {schema['enum']} 之一")
+    if isinstance(value, dict):
+        for key in schema.get('required', []):
+            if value.get(key) in (None, ''):
+                errors.append(f"{path}.{key}: 缺少必填字段")
+        for key, sub_schema in schema.get('properties', {}).items():
+            if key in value and value[key] is not None:
+                errors.extend(validate(value[key], sub_schema, f"{path}.{key}"))
+    if isinstance(value, list):
+        if len(value) < schema.get('minItems', 0):
+            errors.append(f"{path}: 至少需要 {schema['minItems']} 个元素")
+        for i, item in enumerate(value):
+            errors.extend(validate(item, schema.get('items', {}), f"{path}[{i}]"))
+    return errors
+
+
+def _coerce(value, schema):
+    """把常见的类型偏差（数字写成字符串、ID写成数字）转换为期望类型"""
+    types = schema.get('type')
+    types = types if isinstance(types, list) else [types]
+    if any(t in _TYPE_CHECKS and _TYPE_CHECKS[t](value) for t in types):
+        return value
+    if 'string' in types and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    if 'integer' in types and isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+
+def _conform(data, schema, result):
+    """剔除非法的可选字段和列表元素，返回是否仍满足必填要求"""
+    properties = schema.get('properties', {})
+    for key in list(data.keys()):
+        sub_schema = properties.get(key)
+        if sub_schema is None or data[key] is None:
+            continue
+        data[key] = _coerce(data[key], sub_schema)
+        if isinstance(data[key], list) and 'items' in sub_schema:
+            kept = []
+            for i, item in enumerate(data[key]):
+                if isinstance(item, dict):
+                    item = {k: _coerce(v, sub_schema['items'].get('properties', {}).get(k, {}))
+                            for k, v in item.items()}
+                item_errors = validate(item, sub_schema['items'], f"$.{key}[{i}]")
+                if item_errors:
+                    result.errors.extend(item_errors)
+                    result.salvaged = True
+                else:
+                    kept.append(item)
+            data[key] = kept
+        errors = validate(data[key], sub_schema, f"$.{key}")
+        if errors and key not in schema.get('required', []):
+            result.errors.extend(errors)
+            result.salvaged = True
+            del data[key]
+
+    # 缺少 response_type 时按携带的列表字段推断
+    if not data.get('response_type') and 'response_type' in properties:
+        inferred = next((t for t, list_key in RESPONSE_TYPE_LISTS.items()
+                         if data.get(list_key) and t in properties['response_type'].get('enum', [])), None)
+        if inferred:
+            data['response_type'] = inferred
+            result.errors.append(f"$.response_type: 缺失，按 {RESPONSE_TYPE_LISTS[inferred]} 推断为 {inferred}")
+            result.salvaged = True
+
+    errors = validate(data, schema)
+    result.errors.extend(errors)
+    return not errors
+
+
+# --- 入口 ---
+
+def parse_structured_response(text, schema=None):
+    """解析大模型返回的YAML/JSON响应
+
+    Args:
+        text: 大模型返回的原始文本
+        schema: 可选的响应结构（见 llm_schemas），提供时进行校验和抢救
+
+    Returns:
+        ParseResult
+    """
+    result = ParseResult()
+    if not text:
+        result.errors.append("响应为空")
+        return result
+
+    block = extract_structured_block(text).strip()
+    data = None
+
+    if block.startswith('{'):
+        try:
+            data = json.loads(block)
+        except ValueError:
+            pass
+
+    if data is None:
+        candidate = block
+        try:
+            data = _load(candidate)
+        except yaml.YAMLError as e:
+            result.errors.append(f"YAML解析失败: {e}")
+            # 修复步骤依次叠加，只有最终得到采用的解析结果时才记为生效
+            applied = []
+            for name, repair in _REPAIRS:
+                repaired = repair(candidate)
+                if repaired == candidate:
+                    continue
+                candidate = repaired
+                applied.append(name)
+                try:
+                    data = _load(candidate)
+                    break
+                except yaml.YAMLError:
+                    pass
+            else:
+                data = _salvage(candidate, result)
+                result.salvaged = data is not None
+            if data is not None:
+                result.repairs.extend(applied)
+
+    if not isinstance(data, dict):
+        if data is not None:
+            result.errors.append("响应不是键值结构")
+        return result
+
+    if schema and not _conform(data, schema, result):
+        return result
+
+    result.data = data
+    return result
+
+
+def parse_llm_response(text, role=None):
+    """解析响应并按角色结构校验，成功返回字典，失败返回None"""
+    schema = ROLE_RESPONSE_SCHEMAS.get(role)
+    result = parse_structured_response(text, schema)
+    if result.repairs or result.salvaged or not result.ok:
+        logger.warning(f"LLM响应解析{'成功' if result.ok else '失败'}（角色: {role}，修复: {result.repairs}，"
+                       f"抢救: {result.salvaged}）: {result.errors}")
+    return result.data
@@ -0,0 +1,164 @@
+"""多LLM接口路由
+
+支持配置多个OpenAI兼容的接口（网关/供应商），每次请求按近期表现选择接口：
+
+- 每个接口维护延迟和错误率的指数加权移动平均（EWMA），得分 = 延迟EWMA × (1 + 错误率惩罚)，选得分最低者
+- 连续失败达到 LLM_ROUTER_EJECT_AFTER 次的接口被摘除一段时间（每次探测失败后翻倍，有上限）
+- 摘除到期后放行一个探测请求，成功则恢复，失败则继续摘除
+- 重试时优先换用其他接口，实现故障转移
+
+配置 LLM_ENDPOINTS（JSON数组）启用多接口，例如：
+[{"name": "dashscope", "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+  "api_key": "sk-***", "model": "deepseek-v3", "long_text_model": "qwen-long"}]
+未配置时使用 LLM_BASE_URL / LLM_API_KEY / LLM_MODEL / LLM_MODEL_LONG_TEXT 作为唯一接口。
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_ENDPOINTS = os.getenv('LLM_ENDPOINTS', '')
+LLM_ROUTER_EWMA_ALPHA = float(os.getenv('LLM_ROUTER_EWMA_ALPHA', 0.3))
+LLM_ROUTER_ERROR_PENALTY = float(os.getenv('LLM_ROUTER_ERROR_PENALTY', 10))
+LLM_ROUTER_EJECT_AFTER = int(os.getenv('LLM_ROUTER_EJECT_AFTER', 3))
+LLM_ROUTER_EJECT_SECONDS = float(os.getenv('LLM_ROUTER_EJECT_SECONDS', 30))
+LLM_ROUTER_MAX_EJECT_SECONDS = float(os.getenv('LLM_ROUTER_MAX_EJECT_SECONDS', 300))
+
+# 没有样本时的初始延迟估计（秒），使新接口也能被选中
+INITIAL_LATENCY = 1.0
+
+
+class Endpoint:
+    """一个OpenAI兼容接口及其健康统计"""
+
+    def __init__(self, name, base_url, api_key, model, long_text_model=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.models = {'default': model, 'long_text': long_text_model or model}
+        self.ewma_latency = None
+        self.ewma_error = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.eject_seconds = LLM_ROUTER_EJECT_SECONDS
+        self.probing = False
+        self.inflight = 0
+
+    def model_for(self, long_text=False):
+        return self.models['long_text' if long_text else 'default']
+
+    def score(self):
+        latency = self.ewma_latency if self.ewma_latency is not None else INITIAL_LATENCY
+        # 在途请求数作为并列时的微调，避免同时涌向同一个接口
+        return latency * (1 + LLM_ROUTER_ERROR_PENALTY * self.ewma_error) * (1 + 0.1 * self.inflight)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'base_url': self.base_url,
+            'models': self.models,
+            'ewma_latency': self.ewma_latency,
+            'ewma_error': self.ewma_error,
+            'consecutive_failures': self.consecutive_failures,
+            'ejected': self.ejected_until > time.monotonic(),
+            'inflight': self.inflight,
+        }
+
+
+class LLMRouter:
+    """按延迟和错误率EWMA选择接口，失败接口自动摘除并定期探测"""
+
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+
+    def choose(self, exclude=()):
+        """选择一个接口；exclude 为本次调用中刚失败过的接口名（其他接口均不可用时仍会选回）"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.name not in exclude]
+            healthy = [e for e in candidates if e.ejected_until <= now and not e.probing]
+            if not healthy:
+                # 未尝试过的接口都不可用时，退回到全部接口中选择
+                candidates = list(self.endpoints)
+                healthy = [e for e in candidates if e.ejected_until <= now and not e.probing]
+            # 摘除到期、尚无探测在途的接口：放行一个探测请求
+            probe = [e for e in healthy if e.consecutive_failures >= LLM_ROUTER_EJECT_AFTER]
+            if probe:
+                chosen = probe[0]
+                chosen.probing = True
+                logger.info(f"探测已摘除的LLM接口: {chosen.name}")
+            elif healthy:
+                chosen = min(healthy, key=lambda e: e.score())
+            else:
+                # 全部摘除时选最早到期的，保证请求仍能发出
+                chosen = min(candidates, key=lambda e: e.ejected_until)
+            chosen.inflight += 1
+            return chosen
+
+    def has_available(self, exclude=()):
+        """除 exclude 外是否还有未摘除、可立即选用的接口（即 choose 不会退回到 exclude 中的接口）"""
+        now = time.monotonic()
+        with self._lock:
+            return any(e.name not in exclude and e.ejected_until <= now and not e.probing
+                       for e in self.endpoints)
+
+    def report(self, endpoint, success, latency=None):
+        """上报一次请求结果；success=None 表示与接口健康无关的失败（如请求参数错误）"""
+        with self._lock:
+            endpoint.inflight = max(0, endpoint.inflight - 1)
+            endpoint.probing = False
+            if success is None:
+                return
+            alpha = LLM_ROUTER_EWMA_ALPHA
+            endpoint.ewma_error = alpha * (0.0 if success else 1.0) + (1 - alpha) * endpoint.ewma_error
+            if success:
+                if latency is not None:
+                    if endpoint.ewma_latency is None:
+                        endpoint.ewma_latency = latency
+                    else:
+                        endpoint.ewma_latency = alpha * latency + (1 - alpha) * endpoint.ewma_latency
+                if endpoint.consecutive_failures >= LLM_ROUTER_EJECT_AFTER:
+                    logger.info(f"LLM接口已恢复: {endpoint.name}")
+                endpoint.consecutive_failures = 0
+                endpoint.eject_seconds = LLM_ROUTER_EJECT_SECONDS
+                return
+
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= LLM_ROUTER_EJECT_AFTER:
+                endpoint.ejected_until = time.monotonic() + endpoint.eject_seconds
+                logger.warning(f"LLM接口连续失败 {endpoint.consecutive_failures} 次，摘除 "
+                               f"{endpoint.eject_seconds:.0f} 秒: {endpoint.name}")
+                endpoint.eject_seconds = min(LLM_ROUTER_MAX_EJECT_SECONDS, endpoint.eject_seconds * 2)
+
+    def snapshot(self):
+        with self._lock:
+            return [e.to_dict() for e in self.endpoints]
+
+
+def load_endpoints(base_url, api_key, model, long_text_model):
+    """从 LLM_ENDPOINTS 加载接口列表，未配置时使用单接口配置"""
+    endpoints = []
+    if LLM_ENDPOINTS.strip():
+        try:
+            for i, item in enumerate(json.loads(LLM_ENDPOINTS)):
+                endpoints.append(Endpoint(
+                    name=item.get('name') or f"endpoint_{i}",
+                    base_url=item['base_url'],
+                    api_key=item.get('api_key') or api_key,
+                    model=item.get('model') or model,
+                    long_text_model=item.get('long_text_model') or long_text_model
+                ))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error(f"解析LLM_ENDPOINTS失败，使用单接口配置: {e}")
+            endpoints = []
+    if not endpoints and api_key:
+        endpoints.append(Endpoint('default', base_url, api_key, model, long_text_model))
+    return endpoints
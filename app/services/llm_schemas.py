@@ -0,0 +1,98 @@
+"""Agent响应结构定义
+
+以 JSON Schema 的子集（type / required / properties / items / enum / minItems）描述各角色的响应，
+既用于解析后的校验与抢救（llm_response_parser），也可直接作为服务商结构化输出（JSON Schema）的约束。
+字段与 default_prompts 中各角色提示词的示例保持一致。
+"""
+
+# 轮次必须是整数；模型原样回显占位符等非法值时会被剔除，由调用方使用当前轮次
+_ROUND_ID = {"type": "integer"}
+_STRING = {"type": "string"}
+
+# 所有响应共有的信封字段
+_ENVELOPE_PROPERTIES = {
+    "type": _STRING,
+    "from": _STRING,
+    "to": _STRING,
+    "event_id": _STRING,
+    "round_id": _ROUND_ID,
+    "response_text": _STRING,
+    "req_id": _STRING,
+    "res_id": _STRING,
+}
+
+TASK_ITEM_SCHEMA = {
+    "type": "object",
+    "required": ["task_name"],
+    "properties": {
+        "task_assignee": _STRING,
+        "task_type": _STRING,
+        "task_name": _STRING,
+    },
+}
+
+ACTION_ITEM_SCHEMA = {
+    "type": "object",
+    "required": ["task_id", "action_name"],
+    "properties": {
+        "action_assignee": _STRING,
+        "action_name": _STRING,
+        "action_type": _STRING,
+        "task_id": _STRING,
+    },
+}
+
+COMMAND_ITEM_SCHEMA = {
+    "type": "object",
+    "required": ["action_id", "command_type", "command_name"],
+    "properties": {
+        "command_type": {"type": "string", "enum": ["playbook", "manual"]},
+        "command_name": _STRING,
+        "command_assignee": _STRING,
+        "action_id": _STRING,
+        "task_id": _STRING,
+        "command_entity": {"type": "object"},
+        "command_params": {"type": "object"},
+    },
+}
+
+CAPTAIN_RESPONSE_SCHEMA = {
+    "type": "object",
+    "required": ["response_type"],
+    "properties": dict(_ENVELOPE_PROPERTIES, **{
+        "event_name": _STRING,
+        "response_type": {"type": "string", "enum": ["ROGER", "TASK", "MISSION_COMPLETE"]},
+        "tasks": {"type": "array", "items": TASK_ITEM_SCHEMA},
+    }),
+}
+
+MANAGER_RESPONSE_SCHEMA = {
+    "type": "object",
+    "required": ["response_type"],
+    "properties": dict(_ENVELOPE_PROPERTIES, **{
+        "response_type": {"type": "string", "enum": ["ROGER", "ACTION"]},
+        "actions": {"type": "array", "items": ACTION_ITEM_SCHEMA},
+    }),
+}
+
+OPERATOR_RESPONSE_SCHEMA = {
+    "type": "object",
+    "required": ["response_type"],
+    "properties": dict(_ENVELOPE_PROPERTIES, **{
+        "response_type": {"type": "string", "enum": ["ROGER", "COMMAND"]},
+        "commands": {"type": "array", "items": COMMAND_ITEM_SCHEMA},
+    }),
+}
+
+ROLE_RESPONSE_SCHEMAS = {
+    '_captain': CAPTAIN_RESPONSE_SCHEMA,
+    '_manager': MANAGER_RESPONSE_SCHEMA,
+    '_operator': OPERATOR_RESPONSE_SCHEMA,
+}
+
+# 响应类型与其必须携带的列表字段，缺少 response_type 时也据此推断
+RESPONSE_TYPE_LISTS = {
+    'TASK': 'tasks',
+    'ACTION': 'actions',
+    'COMMAND': 'commands',
+}
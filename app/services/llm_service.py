@@ -1,9 +1,20 @@
 import os
 import json
+import random
+import threading
+import time
 import requests
-import yaml
+from contextlib import ExitStack
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from app.models.models import db, LLMRecord
+from app.services.llm_record_writer import llm_record_writer
+from app.services.llm_cache import llm_cache, make_cache_key
+from app.services.llm_singleflight import llm_singleflight
+from app.services.llm_limiter import llm_limiter, priority_for
+from app.services.llm_tokens import estimate_tokens, select_model_tier
+from app.services.llm_response_parser import parse_llm_response
+from app.services.llm_router import LLMRouter, load_endpoints
 
 # 加载环境变量
 load_dotenv()
@@ -15,23 +26,48 @@ LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-4o-mini')
 LLM_MODEL_LONG_TEXT = os.getenv('LLM_MODEL_LONG_TEXT', 'qwen-long')
 LLM_TEMPERATURE = float(os.getenv('LLM_TEMPERATURE', 0.6))
 
-def call_llm(system_prompt, user_prompt, history=None, temperature=None, long_text=False):
-    """调用大模型API
-    
-    Args:
-        system_prompt: 系统提示词
-        user_prompt: 用户提示词
-        history: 历史对话记录，格式为[{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]
-        temperature: 温度参数，控制随机性
-        
-    Returns:
-        大模型返回的文本
+# HTTP连接池配置：同一进程内的所有Agent循环和工程师对话线程共享
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', 10))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 10))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', 300))
+
+# 重试配置：可重试的HTTP状态码、最大重试次数、指数退避的基础/最大间隔（秒）、单次调用总时限（秒）
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', 1))
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', 30))
+LLM_CALL_DEADLINE = float(os.getenv('LLM_CALL_DEADLINE', 600))
+LLM_RETRYABLE_STATUS = {
+    int(code) for code in os.getenv('LLM_RETRYABLE_STATUS', '408,409,425,429,500,502,503,504').split(',') if code.strip()
+}
+
+# LLM接口池：配置 LLM_ENDPOINTS 时按延迟/错误率在多个接口间路由，否则只有上面的单个接口
+llm_router = LLMRouter(load_endpoints(LLM_BASE_URL, LLM_API_KEY, LLM_MODEL, LLM_MODEL_LONG_TEXT))
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """获取进程内共享的LLM HTTP会话
+
+    requests.Session 复用底层的TCP/TLS连接（keep-alive），避免每次调用都重新握手。
+    连接池大小由 LLM_POOL_SIZE 控制，应不小于进程内并发调用LLM的线程数。
     """
-    if not LLM_API_KEY:
-        raise ValueError("LLM_API_KEY环境变量未设置")
-    model = LLM_MODEL_LONG_TEXT if long_text else LLM_MODEL
-    
-    # 构建消息列表
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=LLM_POOL_SIZE, pool_maxsize=LLM_POOL_SIZE, pool_block=True)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({"Connection": "keep-alive"})
+                _http_session = session
+    return _http_session
+
+
+def _build_messages(system_prompt, user_prompt, history=None):
+    """构建chat completion的messages列表"""
     messages = [{"role": "system", "content": system_prompt}]
     
     # 添加历史对话
@@ -40,43 +76,142 @@ def call_llm(system_prompt, user_prompt, history=None, temperature=None, long_te
     
     # 添加当前用户提示
     messages.append({"role": "user", "content": user_prompt})
-    
-    # 设置温度参数
-    temp = temperature if temperature is not None else LLM_TEMPERATURE
-    
-    # 构建请求数据
-    data = {
-        "model": model,
-        "messages": messages,
-        "temperature": temp
-    }
-    
-    # 发送请求
-    headers = {
+    return messages
+
+
+def _build_headers(api_key=None):
+    return {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {LLM_API_KEY}"
+        "Authorization": f"Bearer {api_key or LLM_API_KEY}"
     }
-    
-    response = requests.post(
-        f"{LLM_BASE_URL}/chat/completions",
-        headers=headers,
-        json=data
-    )
-    
-    # 检查响应
-    if response.status_code != 200:
-        raise Exception(f"API请求失败: {response.status_code} - {response.text}")
-    
-    # 解析响应
-    result = response.json()
-    
-    # 记录请求和响应
+
+
+def _parse_retry_after(value):
+    """解析Retry-After响应头（秒数或HTTP日期），返回等待秒数"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_delay(attempt, response=None):
+    """计算第 attempt 次重试前的等待时间：优先遵循Retry-After，否则指数退避加全抖动"""
+    if response is not None:
+        retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            return retry_after
+    backoff = min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, backoff)
+
+
+def _post_with_retry(data, priority, tokens, stream=False, long_text=False):
+    """发送chat completion请求，遇到可重试的错误时退避重试
+
+    每次尝试由路由器选择接口，并按接口填入对应的模型名；失败后还有未摘除且尚未尝试过的接口时立即换用（故障转移），
+    否则按退避时间等待，故障转移不占用 LLM_MAX_RETRIES 次数；路由器选回已尝试过的接口时一律先退避再发送。
+    可重试：连接错误、超时以及 LLM_RETRYABLE_STATUS 中的状态码；每次尝试单独获取限流名额，
+    退避等待期间不占用名额。所有尝试（含等待）不超过 LLM_CALL_DEADLINE 秒。
+
+    Returns:
+        (response, limiter_ctx, permit, retry_stats)：调用方读取完response后需关闭 limiter_ctx 释放名额
+    """
+    deadline = time.monotonic() + LLM_CALL_DEADLINE
+    retry_count = 0
+    backoff_count = 0
+    retry_wait = 0.0
+    tried = []
+    last_error = None
+    last_response = None
+    backed_off = True
+    while True:
+        limiter_ctx = ExitStack()
+        response = None
+        error = None
+        endpoint = None
+        try:
+            permit = limiter_ctx.enter_context(llm_limiter.acquire(priority=priority, tokens=tokens))
+            endpoint = llm_router.choose(exclude=tried)
+            if endpoint.name in tried and not backed_off:
+                # 故障转移的目标在此期间被摘除，选回了刚失败的接口：归还名额，退避后再发送
+                limiter_ctx.close()
+                llm_router.report(endpoint, None)
+                endpoint = None
+            else:
+                remaining = max(1.0, deadline - time.monotonic())
+                started = time.monotonic()
+                response = get_http_session().post(
+                    f"{endpoint.base_url}/chat/completions",
+                    headers=_build_headers(endpoint.api_key),
+                    json=dict(data, model=endpoint.model_for(long_text)),
+                    timeout=(LLM_CONNECT_TIMEOUT, min(LLM_READ_TIMEOUT, remaining)),
+                    stream=stream
+                )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            limiter_ctx.close()
+            llm_router.report(endpoint, False)
+            error = e
+        except BaseException:
+            limiter_ctx.close()
+            if endpoint is not None:
+                llm_router.report(endpoint, None)
+            raise
+
+        if response is not None:
+            if response.status_code == 200:
+                llm_router.report(endpoint, True, time.monotonic() - started)
+                return response, limiter_ctx, permit, {
+                    "retry_count": retry_count, "retry_wait": retry_wait, "endpoint": endpoint.name
+                }
+            retryable = response.status_code in LLM_RETRYABLE_STATUS
+            # 不可重试的状态码（如400）通常是请求本身的问题，不计入接口健康统计
+            llm_router.report(endpoint, False if retryable else None)
+            try:
+                error = Exception(f"API请求失败({endpoint.name}): {response.status_code} - {response.text}")
+            finally:
+                response.close()
+                limiter_ctx.close()
+            if not retryable:
+                raise error
+
+        if endpoint is not None:
+            tried.append(endpoint.name)
+            last_error, last_response = error, response
+        # 还有未摘除且未尝试过的接口时立即故障转移，否则退避等待
+        failover = endpoint is not None and llm_router.has_available(exclude=tried)
+        delay = 0 if failover else _retry_delay(backoff_count, last_response)
+        if (not failover and backoff_count >= LLM_MAX_RETRIES) or time.monotonic() + delay >= deadline:
+            print(f"LLM请求失败，已重试 {retry_count} 次，放弃: {last_error}")
+            raise last_error
+        if endpoint is not None:
+            retry_count += 1
+        if failover:
+            print(f"LLM请求失败，换用其他接口进行第 {retry_count} 次重试: {last_error}")
+        else:
+            print(f"LLM请求失败，{delay:.1f}秒后进行第 {retry_count} 次重试: {last_error}")
+            time.sleep(delay)
+            backoff_count += 1
+        retry_wait += delay
+        backed_off = not failover
+
+
+def _save_llm_record(result, model, messages, role=None, cache_status=None, request_hash=None, retry_stats=None,
+                     selection=None):
+    """将一次LLM调用（普通、流式或缓存命中）记录到 llm_records 表
+
+    记录交给后台写入器批量落库，不占用调用方的数据库会话；记录失败不影响主流程。
+    """
     try:
         # 提取响应内容
         response_content = result["choices"][0]["message"]["content"]
         
         # 提取usage信息
-        usage = result.get("usage", {})
+        usage = result.get("usage") or {}
         prompt_tokens = usage.get("prompt_tokens", None)
         completion_tokens = usage.get("completion_tokens", None)
         total_tokens = usage.get("total_tokens", None)
@@ -86,57 +221,215 @@ def call_llm(system_prompt, user_prompt, history=None, temperature=None, long_te
         if usage.get("prompt_tokens_details"):
             cached_tokens = usage["prompt_tokens_details"].get("cached_tokens", None)
         
-        # 创建记录
-        llm_record = LLMRecord(
-            request_id=result.get("id"),
-            model_name=result.get("model", model),
-            request_messages=messages,
-            response_content=response_content,
-            response_full=result,
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            total_tokens=total_tokens,
-            cached_tokens=cached_tokens
-        )
-        
-        # 保存到数据库
-        db.session.add(llm_record)
-        db.session.commit()
+        llm_record_writer.submit({
+            'request_id': result.get("id"),
+            'model_name': result.get("model") or model,
+            'request_messages': messages,
+            'response_content': response_content,
+            'response_full': result,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': total_tokens,
+            'cached_tokens': cached_tokens,
+            'role': role,
+            'cache_status': cache_status,
+            'request_hash': request_hash,
+            'retry_count': (retry_stats or {}).get("retry_count"),
+            'retry_wait_seconds': (retry_stats or {}).get("retry_wait"),
+            'endpoint': (retry_stats or {}).get("endpoint"),
+            'estimated_prompt_tokens': (selection or {}).get("estimated_tokens"),
+            'model_selection': (selection or {}).get("decision")
+        })
     except Exception as e:
         print(f"记录LLM请求失败: {e}")
         # 记录失败不影响主流程，继续返回结果
+
+
+def call_llm(system_prompt, user_prompt, history=None, temperature=None, long_text=None, role=None, priority=None,
+             response_format=None):
+    """调用大模型API
     
-    return result["choices"][0]["message"]["content"]
+    Args:
+        system_prompt: 系统提示词
+        user_prompt: 用户提示词
+        history: 历史对话记录，格式为[{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]
+        temperature: 温度参数，控制随机性
+        long_text: 是否使用长文本模型；默认None，按估算的提示词token数自动选择能容纳的最快模型
+        role: 调用方角色（_captain, _manager, _operator, _expert, engineer_chat），用于缓存开关和调用记录
+        priority: 限流排队优先级，数值越小越优先，默认按角色确定
+        response_format: 结构化输出约束，原样作为请求的 response_format 字段（如 json_object / json_schema）
+        
+    Returns:
+        大模型返回的文本
+    """
+    if not llm_router.endpoints:
+        raise ValueError("LLM_API_KEY环境变量未设置（或LLM_ENDPOINTS未配置可用接口）")
+    
+    # 构建消息列表
+    messages = _build_messages(system_prompt, user_prompt, history)
+
+    # 按估算的提示词token数选择模型档位
+    estimated_tokens = estimate_tokens(messages)
+    long_text, decision = select_model_tier(estimated_tokens, long_text)
+    selection = {"estimated_tokens": estimated_tokens, "decision": decision}
+    # 逻辑模型名，用于请求哈希和记录兜底；实际模型由路由到的接口决定
+    model = LLM_MODEL_LONG_TEXT if long_text else LLM_MODEL
+    
+    # 设置温度参数
+    temp = temperature if temperature is not None else LLM_TEMPERATURE
+    
+    call_priority = priority if priority is not None else priority_for(role)
+
+    # 请求哈希：同时作为响应缓存键和并发合并键
+    request_hash = make_cache_key(model, temp, messages, extra=response_format)
+    cache_enabled = llm_cache.is_enabled_for(role)
+
+    # 查询响应缓存
+    if cache_enabled:
+        cached = llm_cache.get(request_hash)
+        if cached is not None:
+            cached_result = {
+                "id": cached.get("request_id"),
+                "model": model,
+                "cache_hit": True,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": cached["content"]}}],
+                # 原始调用的usage，用于统计缓存节省的token；本次记录的token列为空
+                "original_usage": cached.get("usage")
+            }
+            _save_llm_record(cached_result, model, messages, role=role, cache_status='hit', request_hash=request_hash,
+                             selection=selection)
+            return cached["content"]
+
+    def _request():
+        # 构建请求数据
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temp
+        }
+        if response_format:
+            data["response_format"] = response_format
+
+        # 发送请求（含限流和失败重试）
+        response, limiter_ctx, permit, retry_stats = _post_with_retry(
+            data, call_priority, estimated_tokens, long_text=long_text)
+        with limiter_ctx:
+            # 解析响应
+            result = response.json()
+            llm_limiter.settle(permit, (result.get("usage") or {}).get("total_tokens"))
+
+        # 记录请求和响应
+        _save_llm_record(result, model, messages, role=role,
+                         cache_status='miss' if cache_enabled else None, request_hash=request_hash,
+                         retry_stats=retry_stats, selection=selection)
+
+        content = result["choices"][0]["message"]["content"]
+        if cache_enabled:
+            llm_cache.set(request_hash, {"content": content, "usage": result.get("usage"), "request_id": result.get("id")})
+        return content
+
+    # 相同请求并发在途时只请求一次上游，其余调用方共享结果
+    content, shared = llm_singleflight.do(request_hash, _request)
+    if shared:
+        shared_result = {
+            "id": None,
+            "model": model,
+            "coalesced": True,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]
+        }
+        _save_llm_record(shared_result, model, messages, role=role, cache_status='shared', request_hash=request_hash,
+                         selection=selection)
+
+    return content
+
+
+def call_llm_stream(system_prompt, user_prompt, history=None, temperature=None, long_text=None, role=None,
+                    priority=None):
+    """以流式（SSE, stream: true）方式调用大模型API
+
+    参数与 call_llm 相同。返回一个生成器，按到达顺序逐段产出增量文本。
+    流结束后会按完整响应写入一条 LLMRecord（包含usage信息），
+    若调用方提前停止迭代则不会写入记录。
+
+    Yields:
+        大模型返回的增量文本片段
+    """
+    if not llm_router.endpoints:
+        raise ValueError("LLM_API_KEY环境变量未设置（或LLM_ENDPOINTS未配置可用接口）")
+    messages = _build_messages(system_prompt, user_prompt, history)
+    estimated_tokens = estimate_tokens(messages)
+    long_text, decision = select_model_tier(estimated_tokens, long_text)
+    selection = {"estimated_tokens": estimated_tokens, "decision": decision}
+    model = LLM_MODEL_LONG_TEXT if long_text else LLM_MODEL
+    temp = temperature if temperature is not None else LLM_TEMPERATURE
+
+    data = {
+        "model": model,
+        "messages": messages,
+        "temperature": temp,
+        "stream": True,
+        # 要求在最后一个chunk中返回usage，保证流式调用也能记录token用量
+        "stream_options": {"include_usage": True}
+    }
+
+    call_priority = priority if priority is not None else priority_for(role)
+    content_parts = []
+    request_id = None
+    model_name = model
+    usage = None
+    # 只在建立连接阶段重试；开始输出后中断不再重试，避免重复输出
+    response, limiter_ctx, permit, retry_stats = _post_with_retry(
+        data, call_priority, estimated_tokens, stream=True, long_text=long_text)
+    # 流式调用在整个读取过程中占用一个限流名额
+    with limiter_ctx:
+        # SSE响应通常不带charset，显式按UTF-8解码，避免中文乱码
+        response.encoding = 'utf-8'
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                try:
+                    chunk = json.loads(payload)
+                except json.JSONDecodeError:
+                    print(f"无法解析的流式数据块: {payload[:200]}")
+                    continue
+
+                request_id = chunk.get("id") or request_id
+                model_name = chunk.get("model") or model_name
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                for choice in chunk.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        content_parts.append(delta)
+                        yield delta
+        finally:
+            response.close()
+        llm_limiter.settle(permit, (usage or {}).get("total_tokens"))
+
+    # 组装与非流式响应结构一致的结果，便于统一记录
+    result = {
+        "id": request_id,
+        "object": "chat.completion",
+        "model": model_name,
+        "stream": True,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(content_parts)}}],
+        "usage": usage
+    }
+    _save_llm_record(result, model, messages, role=role, retry_stats=retry_stats, selection=selection)
 
 def parse_yaml_response(response_text):
     """解析YAML格式的大模型响应
     
+    保留给旧的调用方使用，实际解析由 llm_response_parser 完成（含修复与抢救，不做角色结构校验）。
+    
     Args:
         response_text: 大模型返回的YAML文本
         
     Returns:
-        解析后的Python对象
+        解析后的Python对象，失败返回None
     """
-    try:
-        # 尝试提取YAML部分
-        if '```yaml' in response_text:
-            yaml_parts = response_text.split('```yaml')
-            if len(yaml_parts) > 1:
-                yaml_content = yaml_parts[1].split('```')[0].strip()
-            else:
-                yaml_content = response_text
-        elif '```' in response_text:
-            yaml_parts = response_text.split('```')
-            if len(yaml_parts) > 1:
-                yaml_content = yaml_parts[1].strip()
-            else:
-                yaml_content = response_text
-        else:
-            yaml_content = response_text
-            
-        # 解析YAML
-        return yaml.safe_load(yaml_content)
-    except Exception as e:
-        print(f"YAML解析错误: {e}")
-        print(f"原始响应: {response_text}")
-        return None 
\ No newline at end of file
+    return parse_llm_response(response_text)
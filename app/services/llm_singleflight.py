@@ -0,0 +1,217 @@
+"""相同LLM请求的并发合并（single-flight）
+
+多个线程（或进程）同时发送内容完全相同的请求时，只有一个调用方（leader）真正请求
+上游大模型，其余调用方等待并共享它的结果。
+
+- 进程内：按请求哈希维护在途请求表，等待方阻塞在 threading.Event 上
+- 跨进程（可选，LLM_SINGLEFLIGHT_DB=true）：通过 llm_inflight_locks 表加轻量锁，
+  leader 完成后把结果写回锁记录，只保留 LLM_SINGLEFLIGHT_RESULT_TTL 秒供轮询中的等待方读取；
+  leader 失败或锁过期时由等待方接手重新请求
+
+这里只合并在途请求，不缓存结果：只有在 leader 请求期间（看到 running 状态）开始等待的调用方才会读取结果，
+leader 完成后才到达的相同请求会删除已完成的记录、重新请求上游（结果缓存由 llm_cache 负责）。
+过期的锁记录（连同响应内容）每 LLM_SINGLEFLIGHT_PURGE_INTERVAL 秒清理一次。
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.models import db, LLMInflightLock
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_SINGLEFLIGHT_ENABLED = os.getenv('LLM_SINGLEFLIGHT_ENABLED', 'True').lower() == 'true'
+LLM_SINGLEFLIGHT_DB = os.getenv('LLM_SINGLEFLIGHT_DB', 'False').lower() == 'true'
+LLM_SINGLEFLIGHT_LOCK_TTL = int(os.getenv('LLM_SINGLEFLIGHT_LOCK_TTL', 600))
+LLM_SINGLEFLIGHT_RESULT_TTL = int(os.getenv('LLM_SINGLEFLIGHT_RESULT_TTL', 5))
+LLM_SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv('LLM_SINGLEFLIGHT_POLL_INTERVAL', 0.5))
+LLM_SINGLEFLIGHT_PURGE_INTERVAL = float(os.getenv('LLM_SINGLEFLIGHT_PURGE_INTERVAL', 60))
+
+# 锁持有者标识：主机名 + 进程号 + 随机后缀
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """按键合并并发调用"""
+
+    def __init__(self, enabled=LLM_SINGLEFLIGHT_ENABLED, use_db=LLM_SINGLEFLIGHT_DB):
+        self.enabled = enabled
+        self.use_db = use_db
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._last_purge = 0.0
+
+    def do(self, key, fn):
+        """执行 fn 或等待相同 key 的在途调用
+
+        Returns:
+            (result, shared)：shared 为 True 表示结果来自其他调用方
+        """
+        if not self.enabled:
+            return fn(), False
+
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            if self.use_db:
+                call.result, shared = self._do_cross_process(key, fn)
+            else:
+                call.result, shared = fn(), False
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    # --- 跨进程锁 ---
+
+    def _do_cross_process(self, key, fn):
+        deadline = time.monotonic() + LLM_SINGLEFLIGHT_LOCK_TTL
+        while True:
+            if self._try_acquire(key):
+                try:
+                    result = fn()
+                except BaseException:
+                    self._finish(key, status='failed')
+                    raise
+                self._finish(key, status='done', result=result)
+                return result, False
+
+            result, state = self._wait_for_result(key, deadline)
+            if state == 'done':
+                return result, True
+            if time.monotonic() >= deadline:
+                # 等待超时，不再依赖其他进程，直接自行请求
+                logger.warning(f"等待跨进程在途LLM请求超时，自行请求: {key[:12]}")
+                return fn(), False
+            # leader失败或锁已失效：重新竞争成为leader
+
+    def _try_acquire(self, key):
+        self._purge_expired()
+        session = Session(bind=db.engine)
+        try:
+            now = datetime.utcnow()
+            # 已过期或已结束的记录不再代表在途请求：删除后重新竞争，不复用已完成的结果
+            session.query(LLMInflightLock).filter(
+                LLMInflightLock.request_hash == key,
+                or_(LLMInflightLock.expires_at < now, LLMInflightLock.status != 'running')
+            ).delete(synchronize_session=False)
+            session.add(LLMInflightLock(
+                request_hash=key,
+                owner=OWNER_ID,
+                status='running',
+                created_at=now,
+                expires_at=now + timedelta(seconds=LLM_SINGLEFLIGHT_LOCK_TTL)
+            ))
+            session.commit()
+            return True
+        except IntegrityError:
+            session.rollback()
+            return False
+        except Exception as e:
+            # 锁表不可用时不阻塞调用，退化为进程内合并
+            session.rollback()
+            logger.warning(f"获取跨进程LLM请求锁失败，退化为进程内合并: {e}")
+            return True
+        finally:
+            session.close()
+
+    def _finish(self, key, status, result=None):
+        session = Session(bind=db.engine)
+        try:
+            lock = session.query(LLMInflightLock).filter_by(request_hash=key, owner=OWNER_ID).first()
+            if lock:
+                lock.status = status
+                lock.response_content = result
+                # 完成后只短暂保留结果，供请求期间已在等待的其他进程读取；失败则立即过期，等待方可接手
+                ttl = LLM_SINGLEFLIGHT_RESULT_TTL if status == 'done' else 0
+                lock.expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+                session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.warning(f"更新跨进程LLM请求锁失败: {e}")
+        finally:
+            session.close()
+
+    def _wait_for_result(self, key, deadline):
+        """轮询锁记录，返回 (result, state)，state 为 done / retry
+
+        只有先看到 running（即在 leader 请求期间开始等待）才接受结果；
+        第一次读取就已是 done 说明请求早已结束，按 retry 处理以重新请求。
+        """
+        seen_running = False
+        while time.monotonic() < deadline:
+            session = Session(bind=db.engine)
+            try:
+                lock = session.query(LLMInflightLock).filter_by(request_hash=key).first()
+                if lock is None or lock.expires_at < datetime.utcnow():
+                    return None, 'retry'
+                if lock.status == 'running':
+                    seen_running = True
+                elif lock.status == 'done':
+                    return (lock.response_content, 'done') if seen_running else (None, 'retry')
+                if lock.status == 'failed':
+                    return None, 'retry'
+            except Exception as e:
+                logger.warning(f"读取跨进程LLM请求锁失败: {e}")
+                return None, 'retry'
+            finally:
+                session.close()
+            time.sleep(LLM_SINGLEFLIGHT_POLL_INTERVAL)
+        return None, 'retry'
+
+    def _purge_expired(self):
+        """删除已过期的锁记录及其响应内容，按 LLM_SINGLEFLIGHT_PURGE_INTERVAL 节流"""
+        now_mono = time.monotonic()
+        with self._lock:
+            if now_mono - self._last_purge < LLM_SINGLEFLIGHT_PURGE_INTERVAL:
+                return
+            self._last_purge = now_mono
+        session = Session(bind=db.engine)
+        try:
+            deleted = session.query(LLMInflightLock).filter(
+                LLMInflightLock.expires_at < datetime.utcnow()
+            ).delete(synchronize_session=False)
+            session.commit()
+            if deleted:
+                logger.debug(f"清理了 {deleted} 条过期的跨进程LLM请求锁")
+        except Exception as e:
+            session.rollback()
+            logger.warning(f"清理过期的跨进程LLM请求锁失败: {e}")
+        finally:
+            session.close()
+
+
+llm_singleflight = SingleFlight()
@@ -0,0 +1,102 @@
+"""Agent决策的结构化输出
+
+call_llm_structured 在 call_llm 之上完成“请求 → 解析校验 → 必要时修复”：
+
+- 结构化输出模式（LLM_STRUCTURED_OUTPUT=true，默认关闭）：请求携带 response_format，
+  json_schema 模式直接传入角色的响应结构，json_object 模式只要求输出JSON对象（兼容不支持JSON Schema的服务商），
+  并在系统提示词末尾追加JSON输出要求（放在末尾不影响前缀缓存）
+- 未开启时仍按提示词要求输出YAML
+- 无论哪种模式，解析或校验失败时发起一次低成本的修复调用：只携带原始输出、错误列表和响应结构，
+  让模型改写为合法JSON，而不是重跑整轮决策
+"""
+import json
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from app.services.llm_service import call_llm
+from app.services.llm_response_parser import parse_structured_response
+from app.services.llm_schemas import ROLE_RESPONSE_SCHEMAS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_STRUCTURED_OUTPUT = os.getenv('LLM_STRUCTURED_OUTPUT', 'False').lower() == 'true'
+LLM_STRUCTURED_OUTPUT_MODE = os.getenv('LLM_STRUCTURED_OUTPUT_MODE', 'json_schema').lower()
+LLM_REPAIR_ENABLED = os.getenv('LLM_REPAIR_ENABLED', 'True').lower() == 'true'
+
+REPAIR_SYSTEM_PROMPT = """你是一个数据格式修复器。你会收到一段不符合要求的模型输出、校验错误和目标JSON Schema。
+请在不改变原意、不编造新内容的前提下，把它改写为一个符合Schema的JSON对象。
+只输出JSON对象本身，不要输出代码块标记或任何解释。"""
+
+
+def _response_format(schema, role):
+    if LLM_STRUCTURED_OUTPUT_MODE == 'json_object':
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": f"{role.strip('_')}_response", "schema": schema, "strict": False}
+    }
+
+
+def _json_instruction(schema):
+    return ("\n\n【输出格式】本次请求启用结构化输出：请输出与上述示例字段完全相同的JSON对象（不是YAML，不要使用代码块），"
+            f"并符合以下JSON Schema：\n{json.dumps(schema, ensure_ascii=False)}")
+
+
+def repair_structured_response(raw_response, errors, schema, role):
+    """让模型把不合法的输出改写为符合结构的JSON，返回 ParseResult"""
+    user_prompt = (
+        f"<original_output>\n{raw_response}\n</original_output>\n\n"
+        f"<errors>\n" + "\n".join(f"- {e}" for e in errors[:20]) + "\n</errors>\n\n"
+        f"<json_schema>\n{json.dumps(schema, ensure_ascii=False)}\n</json_schema>"
+    )
+    repaired = call_llm(
+        REPAIR_SYSTEM_PROMPT, user_prompt, temperature=0, long_text=False, role=role,
+        response_format={"type": "json_object"} if LLM_STRUCTURED_OUTPUT else None
+    )
+    return parse_structured_response(repaired, schema)
+
+
+def call_llm_structured(system_prompt, user_prompt, role, schema=None, **kwargs):
+    """请求大模型并返回校验通过的结构化结果
+
+    Args:
+        system_prompt: 系统提示词
+        user_prompt: 用户提示词
+        role: 调用方角色，同时决定默认的响应结构
+        schema: 响应结构，默认取 ROLE_RESPONSE_SCHEMAS[role]
+        **kwargs: 透传给 call_llm 的其他参数（priority、temperature 等）
+
+    Returns:
+        (data, raw_response)：data 为校验通过的字典，解析和修复都失败时为None；raw_response 为首次调用的原始输出
+    """
+    schema = schema or ROLE_RESPONSE_SCHEMAS.get(role)
+    if LLM_STRUCTURED_OUTPUT and schema:
+        raw_response = call_llm(system_prompt + _json_instruction(schema), user_prompt, role=role,
+                                response_format=_response_format(schema, role), **kwargs)
+    else:
+        raw_response = call_llm(system_prompt, user_prompt, role=role, **kwargs)
+
+    result = parse_structured_response(raw_response, schema)
+    if result.ok:
+        if result.repairs or result.salvaged:
+            logger.warning(f"{role} 响应经修复/抢救后可用（修复: {result.repairs}）: {result.errors}")
+        return result.data, raw_response
+
+    logger.warning(f"{role} 响应解析或校验失败: {result.errors}")
+    if not (LLM_REPAIR_ENABLED and schema):
+        return None, raw_response
+
+    try:
+        repaired = repair_structured_response(raw_response, result.errors, schema, role)
+    except Exception as e:
+        logger.error(f"{role} 响应修复调用失败: {e}")
+        return None, raw_response
+    if repaired.ok:
+        logger.info(f"{role} 响应已通过修复调用恢复")
+        return repaired.data, raw_response
+    logger.error(f"{role} 响应修复后仍不合法: {repaired.errors}")
+    return None, raw_response
@@ -0,0 +1,62 @@
+"""提示词token估算与模型自动选择
+
+不依赖具体分词器，按字符类别近似估算token数：
+- 中日韩字符（含全角标点）约 1 个字符 1 个token
+- 其他字符（英文、数字、YAML/JSON符号等）约 LLM_ASCII_CHARS_PER_TOKEN 个字符 1 个token
+- 每条message额外计入少量格式开销
+
+模型选择：在能容纳 估算提示词token + 输出预留 的模型中，选择更快更便宜的默认模型，
+放不下时才使用长文本模型。
+"""
+import os
+import re
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_AUTO_MODEL = os.getenv('LLM_AUTO_MODEL', 'True').lower() == 'true'
+LLM_MODEL_CONTEXT_WINDOW = int(os.getenv('LLM_MODEL_CONTEXT_WINDOW', 64000))
+LLM_MODEL_LONG_TEXT_CONTEXT_WINDOW = int(os.getenv('LLM_MODEL_LONG_TEXT_CONTEXT_WINDOW', 1000000))
+LLM_OUTPUT_TOKEN_RESERVE = int(os.getenv('LLM_OUTPUT_TOKEN_RESERVE', 4096))
+LLM_ASCII_CHARS_PER_TOKEN = float(os.getenv('LLM_ASCII_CHARS_PER_TOKEN', 4))
+
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+
+def estimate_text_tokens(text):
+    """估算一段文本的token数"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return cjk + int(other / LLM_ASCII_CHARS_PER_TOKEN + 0.5)
+
+
+def estimate_tokens(messages):
+    """估算messages的提示词token数"""
+    return sum(estimate_text_tokens(m.get('content') or '') + MESSAGE_OVERHEAD_TOKENS for m in messages) + 1
+
+
+def select_model_tier(estimated_tokens, long_text=None):
+    """根据估算的提示词token数选择模型档位
+
+    Args:
+        estimated_tokens: 估算的提示词token数
+        long_text: 调用方显式指定时（True/False）直接使用，None 表示自动选择
+
+    Returns:
+        (use_long_text, decision)：decision 形如 auto:default、auto:long_text、forced:long_text，记录到 LLMRecord
+    """
+    if long_text is not None:
+        return bool(long_text), f"forced:{'long_text' if long_text else 'default'}"
+    if not LLM_AUTO_MODEL:
+        return False, 'fixed:default'
+    if estimated_tokens + LLM_OUTPUT_TOKEN_RESERVE <= LLM_MODEL_CONTEXT_WINDOW:
+        return False, 'auto:default'
+    if estimated_tokens + LLM_OUTPUT_TOKEN_RESERVE > LLM_MODEL_LONG_TEXT_CONTEXT_WINDOW:
+        # 两个模型都放不下，仍交给长文本模型，由上游返回明确的错误
+        return True, 'auto:long_text_overflow'
+    return True, 'auto:long_text'
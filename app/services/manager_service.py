@@ -1,3 +1,4 @@
+import os
 import time
 import uuid
 import json
@@ -5,23 +6,30 @@ import traceback
 from datetime import datetime
 from sqlalchemy import func
 from app.models import db, Event, Task, Action, Message
-from app.services.llm_service import call_llm, parse_yaml_response
-from app.services.prompt_service import PromptService
+from app.services.llm_structured import call_llm_structured
+from app.services.prompt_service import PromptService, build_user_prompt
 from app.utils.message_utils import create_standard_message
-from app.utils.mq_utils import RabbitMQPublisher
+from app.utils.mq_utils import RabbitMQPublisher, ThreadSafePublisher
+from app.utils.work_queue import WorkQueueWaiter, notify_work, WORK_POLL_FALLBACK_INTERVAL
+from app.services.work_lease import claim_rows, LeaseKeeper, reap_expired_leases
+from app.services.agent_pool import AgentWorkerPool
 import pika
-import yaml
 import logging
 logger = logging.getLogger(__name__)
 
 
-def get_pending_tasks():
-    """获取待处理的任务，按照event_id和round_id分组
+def get_pending_tasks(exclude_event_ids=None):
+    """认领一组待处理的任务（同一event_id和round_id），按照event_id和round_id分组
     
+    任务以 SKIP LOCKED 原子认领，多个Manager副本不会重复处理同一任务
+
+    Args:
+        exclude_event_ids: 本进程中已有任务组在途的事件ID，同一事件的任务组按顺序处理
+
     Returns:
         字典，键为(event_id, round_id)元组，值为该组的任务列表
     """
-    pending_tasks = Task.query.filter_by(task_status='pending').order_by(Task.created_at.asc()).all()
+    pending_tasks = claim_rows('_manager', group_by=['event_id', 'round_id'], exclude_event_ids=exclude_event_ids)
     grouped_tasks = {}
     for task in pending_tasks:
         key = (task.event_id, task.round_id)
@@ -57,24 +65,24 @@ def process_task_group(event_id, round_id, tasks, publisher: RabbitMQPublisher):
             'task_type': task.task_type
         })
 
-    request_data = {
+    # 事件主体在前，轮次、任务和请求ID在后，以利于服务商的前缀缓存
+    stable_data = {
         'type': 'generate_actions_by_tasks',
-        'req_id': str(uuid.uuid4()),
-        'res_id': str(uuid.uuid4()),
         'event_id': event_id,
-        'event_round': round_id,
         'event_name': event.event_name,
-        'event_message': event.message,
-        'tasks': tasks_data
+        'event_message': event.message
     }
-    yaml_data = yaml.dump(request_data, allow_unicode=True, default_flow_style=False, indent=2)
-
-    user_prompt = f"""```yaml
-{yaml_data}
-```
-
-分析来自`_captain`的任务要求，生成可供`_operator`操作的具体的`ACTION`。
-"""
+    volatile_data = {
+        'event_round': round_id,
+        'tasks': tasks_data,
+        'req_id': str(uuid.uuid4()),
+        'res_id': str(uuid.uuid4())
+    }
+    user_prompt = build_user_prompt(
+        stable_data,
+        volatile_data,
+        instruction="分析来自`_captain`的任务要求，生成可供`_operator`操作的具体的`ACTION`。"
+    )
     logger.info(f"Manager User prompt for event {event_id}, round {round_id}:\n{user_prompt}")
     logger.info("--------------------------------")
     
@@ -100,11 +108,11 @@ def process_task_group(event_id, round_id, tasks, publisher: RabbitMQPublisher):
             logger.error(f"发布消息 [Manager LLM Req] {db_message_llm_req.message_id} 到 RabbitMQ 失败: {e_pub}")
             logger.error(traceback.format_exc())
 
-    response = call_llm(system_prompt, user_prompt)
+    # 请求并解析为校验通过的结构化结果，解析失败时会自动发起一次修复调用
+    parsed_response, response = call_llm_structured(system_prompt, user_prompt, role='_manager')
     logger.info(f"Manager LLM Response for event {event_id}, round {round_id}:\n{response}")
     logger.info("--------------------------------")
     
-    parsed_response = parse_yaml_response(response)
     if not parsed_response:
         logger.error(f"Manager解析LLM响应失败 for event {event_id}: {response}")
         error_content = {"text": "安全经理未能正确解析LLM响应数据，请检查日志。", "original_response": response}
@@ -210,6 +218,7 @@ def process_manager_response(response, tasks, publisher: RabbitMQPublisher, even
         if created_action_ids:
             db.session.commit()
             logger.info(f"为事件 {event_id} 轮次 {round_id} 创建了 {len(created_action_ids)} 个动作: {created_action_ids}")
+            notify_work('_operator', publisher, event_id=event_id, action_ids=created_action_ids)
         else:
             logger.warning(f"LLM响应类型为ACTION，但未提供有效actions数据或未能匹配任务。Event: {event_id}, Round: {round_id}")
     else:
@@ -225,35 +234,62 @@ def process_manager_response(response, tasks, publisher: RabbitMQPublisher, even
                 publisher.publish_message(message_body=db_message_unexpected.to_dict(), routing_key=routing_key)
             except Exception as e_pub_unexp: logger.error(f"发布LLM意外响应类型消息失败: {e_pub_unexp}")
 
+def process_claimed_task_group(event_id, round_id, task_pks, publisher):
+    """在工作线程中处理一组已认领的任务（由 AgentWorkerPool 在独立的应用上下文中调用）"""
+    tasks = Task.query.filter(Task.id.in_(task_pks)).order_by(Task.created_at.asc(), Task.id.asc()).all()
+    if not tasks:
+        return
+    # 处理期间持续续约，结束后释放认领
+    with LeaseKeeper('_manager', tasks):
+        process_task_group(event_id, round_id, tasks, publisher)
+        # 任务处理完成后提交，以结束事务和释放锁
+        try:
+            db.session.commit()
+        except Exception as commit_err:
+            logger.error(f"Manager 提交事件 {event_id} 轮次 {round_id} 的事务失败: {commit_err}")
+            db.session.rollback()
+
+
 def run_manager():
-    """运行_manager服务"""
+    """运行_manager服务
+
+    主线程负责认领任务组，交给最多 MANAGER_CONCURRENCY 个工作线程并发处理；
+    同一事件的任务组串行处理，不同事件之间互不阻塞。
+    """
     logger.info("启动_manager服务...")
     from main import app # For app_context
 
     publisher = None
+    waiter = None
+    pool = None
     try:
-        publisher = RabbitMQPublisher()
-        logger.info("RabbitMQ Publisher for Manager initialized.")
+        publisher = ThreadSafePublisher()
+        pool = AgentWorkerPool(app, '_manager', os.getenv('MANAGER_CONCURRENCY', '4'))
+        logger.info(f"RabbitMQ Publisher for Manager initialized. 并发处理任务组数: {pool.concurrency}")
+        waiter = WorkQueueWaiter('_manager')
 
         with app.app_context():
             while True:
                 try:
-                    grouped_tasks = get_pending_tasks()
+                    if pool.full():
+                        # 工作线程已满，等待任意一组处理完成再认领
+                        pool.wait_for_slot()
+                        continue
+
+                    reap_expired_leases('_manager', publisher)
+                    grouped_tasks = get_pending_tasks(exclude_event_ids=pool.busy_keys)
                     if grouped_tasks:
-                        logger.info(f"Manager发现 {len(grouped_tasks)} 组待处理任务")
                         for (event_id, round_id), tasks in grouped_tasks.items():
-                            process_task_group(event_id, round_id, tasks, publisher)
-                        # 任务处理完成后提交，以结束事务和释放锁
-                        try:
-                            db.session.commit()
-                        except Exception as loop_commit_err:
-                            logger.error(f"Manager 主循环提交事务失败: {loop_commit_err}")
-                            db.session.rollback()
+                            logger.info(f"Manager认领了事件 {event_id} 轮次 {round_id} 的 {len(tasks)} 个任务")
+                            pool.submit(event_id, process_claimed_task_group,
+                                        event_id, round_id, [task.id for task in tasks], publisher)
                     else:
                         # logger.debug("Manager: 没有待处理任务，等待中...")
                         # 本轮无任务也回滚，避免长事务持有快照
                         db.session.rollback()
-                        time.sleep(5)
+                        # 等待新任务通知，超时后重新查询一次作为兜底对账；
+                        # 有工作在途时缩短等待，以便及时认领因同一事件在途而被跳过的工作
+                        waiter.wait(timeout=WORK_POLL_FALLBACK_INTERVAL if pool.busy_keys else None)
                 except pika.exceptions.AMQPConnectionError as amqp_err:
                     logger.error(f"Manager服务 RabbitMQ连接错误: {amqp_err}. Publisher会尝试重连。")
                     time.sleep(10) 
@@ -269,6 +305,11 @@ def run_manager():
         logger.critical(f"Manager服务启动时发生未知严重错误: {e_startup}")
         logger.critical(traceback.format_exc())
     finally:
+        if pool:
+            logger.info("Manager服务正在等待处理中的任务组完成...")
+            pool.shutdown()
+        if waiter:
+            waiter.close()
         if publisher:
             logger.info("Manager服务正在关闭RabbitMQ publisher...")
             publisher.close()
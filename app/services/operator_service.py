@@ -1,3 +1,4 @@
+import os
 import time
 import uuid
 import json
@@ -5,23 +6,29 @@ import traceback
 from datetime import datetime
 from sqlalchemy import func
 from app.models import db, Event, Task, Action, Command, Message
-from app.services.llm_service import call_llm, parse_yaml_response
-from app.services.prompt_service import PromptService
+from app.services.llm_structured import call_llm_structured
+from app.services.prompt_service import PromptService, build_user_prompt
 from app.utils.message_utils import create_standard_message
-from app.utils.mq_utils import RabbitMQPublisher
+from app.utils.mq_utils import RabbitMQPublisher, ThreadSafePublisher
+from app.utils.work_queue import WorkQueueWaiter, notify_work, WORK_POLL_FALLBACK_INTERVAL
+from app.services.work_lease import claim_rows, LeaseKeeper, reap_expired_leases
+from app.services.agent_pool import AgentWorkerPool
 import pika
-import yaml
 import logging
 logger = logging.getLogger(__name__)
 
-def get_pending_actions():
-    """获取待处理的动作，按照event_id和round_id分组
+def get_pending_actions(exclude_event_ids=None):
+    """认领一组待处理的动作（同一event_id和round_id），按照event_id和round_id分组
     
+    动作以 SKIP LOCKED 原子认领，多个Operator副本不会重复处理同一动作
+
+    Args:
+        exclude_event_ids: 本进程中已有动作组在途的事件ID，同一事件的动作组按顺序处理
+
     Returns:
         字典，键为(event_id, round_id)元组，值为该组的动作列表
     """
-    # 查询所有pending状态的动作
-    pending_actions = Action.query.filter_by(action_status='pending').order_by(Action.created_at.asc()).all()
+    pending_actions = claim_rows('_operator', group_by=['event_id', 'round_id'], exclude_event_ids=exclude_event_ids)
     
     # 按照event_id和round_id分组
     grouped_actions = {}
@@ -67,27 +74,24 @@ def process_action_group(event_id, round_id, actions, publisher: RabbitMQPublish
             'task_name': task_name
         })
 
-    request_data = {
+    # 构建用户提示词：事件主体在前，轮次、动作和请求ID在后，以利于服务商的前缀缓存
+    stable_data = {
         'type': 'generate_commands_by_actions',
-        'req_id': str(uuid.uuid4()),
-        'res_id': str(uuid.uuid4()),
         'event_id': event_id,
-        'event_round': round_id,
         'event_name': event.event_name,
-        'event_message': event.message,
-        'actions': actions_data
+        'event_message': event.message
     }
-    
-    yaml_data = yaml.dump(request_data, allow_unicode=True, default_flow_style=False, indent=2)
-
-    # 构建用户提示词
-    user_prompt = f"""
-```yaml
-{yaml_data}
-```
-
-请根据以上动作要求，输出可以供`_executor`通过机器执行的`COMMAND`。
-"""
+    volatile_data = {
+        'event_round': round_id,
+        'actions': actions_data,
+        'req_id': str(uuid.uuid4()),
+        'res_id': str(uuid.uuid4())
+    }
+    user_prompt = build_user_prompt(
+        stable_data,
+        volatile_data,
+        instruction="请根据以上动作要求，输出可以供`_executor`通过机器执行的`COMMAND`。"
+    )
     logger.info(f"Operator User prompt for event {event_id}, round {round_id}:\n{user_prompt}")
     logger.info("--------------------------------")
     
@@ -110,12 +114,11 @@ def process_action_group(event_id, round_id, actions, publisher: RabbitMQPublish
             logger.info(f"消息 [Operator LLM Req] {db_message_llm_req.message_id} 已发布. RK: {routing_key}")
         except Exception as e_pub: logger.error(f"发布消息 [Operator LLM Req] {db_message_llm_req.message_id} 失败: {e_pub}"); logger.error(traceback.format_exc())
 
-    response = call_llm(system_prompt, user_prompt)
+    # 请求并解析为校验通过的结构化结果，解析失败时会自动发起一次修复调用
+    parsed_response, response = call_llm_structured(system_prompt, user_prompt, role='_operator')
     logger.info(f"Operator LLM Response for event {event_id}, round {round_id}:\n{response}")
     logger.info("--------------------------------")
 
-    # 解析响应
-    parsed_response = parse_yaml_response(response)
     if not parsed_response:
         logger.error(f"Operator解析LLM响应失败 for event {event_id}: {response}")
         error_content = {"text": "安全操作员未能正确解析LLM响应数据。", "original_response": response}
@@ -195,6 +198,7 @@ def process_operator_response(response, actions, publisher: RabbitMQPublisher, e
         if created_command_ids:
             db.session.commit()
             logger.info(f"为事件 {event_id} 轮次 {round_id} 创建了 {len(created_command_ids)} 个命令: {created_command_ids}")
+            notify_work('_executor', publisher, event_id=event_id, command_ids=created_command_ids)
         else:
             logger.warning(f"LLM响应类型为COMMAND，但未提供有效commands数据。Event: {event_id}")
     else:
@@ -203,40 +207,65 @@ def process_operator_response(response, actions, publisher: RabbitMQPublisher, e
         db_msg_unexpected = create_standard_message(event_id=event_id, message_from='_operator', round_id=round_id, message_type='llm_unexpected_response', content_data=unexpected_resp_content)
         if db_msg_unexpected and publisher: publisher.publish_message(message_body=db_msg_unexpected.to_dict(), routing_key=f"notifications.frontend.{event_id}._operator.llm_unexpected_response")
 
+def process_claimed_action_group(event_id, round_id, action_pks, publisher):
+    """在工作线程中处理一组已认领的动作（由 AgentWorkerPool 在独立的应用上下文中调用）"""
+    actions = Action.query.filter(Action.id.in_(action_pks)).order_by(Action.created_at.asc(), Action.id.asc()).all()
+    if not actions:
+        return
+    # 处理期间持续续约，结束后释放认领
+    with LeaseKeeper('_operator', actions):
+        process_action_group(event_id, round_id, actions, publisher)
+        # 一组动作处理完后提交事务，释放锁
+        try:
+            db.session.commit()
+        except Exception as commit_err:
+            logger.error(f"Operator 提交事件 {event_id} 轮次 {round_id} 的事务失败: {commit_err}")
+            db.session.rollback()
+
+
 def run_operator():
-    """运行_operator服务"""
+    """运行_operator服务
+
+    主线程负责认领动作组，交给最多 OPERATOR_CONCURRENCY 个工作线程并发处理；
+    同一事件的动作组串行处理，不同事件之间互不阻塞。
+    """
     logger.info("启动_operator服务...")
     
     # 导入Flask应用
     from main import app
     
     publisher = None
+    waiter = None
+    pool = None
     try:
-        publisher = RabbitMQPublisher()
-        logger.info("RabbitMQ Publisher for Operator initialized.")
+        publisher = ThreadSafePublisher()
+        pool = AgentWorkerPool(app, '_operator', os.getenv('OPERATOR_CONCURRENCY', '4'))
+        logger.info(f"RabbitMQ Publisher for Operator initialized. 并发处理动作组数: {pool.concurrency}")
+        waiter = WorkQueueWaiter('_operator')
         with app.app_context():
             while True:
                 try:
-                    # 获取待处理动作组
-                    grouped_actions = get_pending_actions()
+                    if pool.full():
+                        # 工作线程已满，等待任意一组处理完成再认领
+                        pool.wait_for_slot()
+                        continue
+
+                    reap_expired_leases('_operator', publisher)
+                    # 认领待处理动作组
+                    grouped_actions = get_pending_actions(exclude_event_ids=pool.busy_keys)
                     
                     if grouped_actions:
-                        logger.info(f"Operator发现 {len(grouped_actions)} 组待处理动作")
-                        
-                        # 处理每组动作
                         for (event_id, round_id), actions in grouped_actions.items():
-                            process_action_group(event_id, round_id, actions, publisher)
-                            # 一组动作处理完后提交事务，释放锁
-                            try:
-                                db.session.commit()
-                            except Exception as loop_commit_err:
-                                logger.error(f"Operator 主循环提交事务失败: {loop_commit_err}")
-                                db.session.rollback()
+                            logger.info(f"Operator认领了事件 {event_id} 轮次 {round_id} 的 {len(actions)} 个动作")
+                            pool.submit(event_id, process_claimed_action_group,
+                                        event_id, round_id, [action.id for action in actions], publisher)
                     else:
                         logger.info("没有待处理动作，等待中...")
                         # 回滚以结束事务，确保下一次能看到最新数据
                         db.session.rollback()
-                        time.sleep(5)
+                        # 等待新动作通知，超时后重新查询一次作为兜底对账；
+                        # 有工作在途时缩短等待，以便及时认领因同一事件在途而被跳过的工作
+                        waiter.wait(timeout=WORK_POLL_FALLBACK_INTERVAL if pool.busy_keys else None)
                 except pika.exceptions.AMQPConnectionError as amqp_err:
                     logger.error(f"Operator服务 RabbitMQ连接错误: {amqp_err}.")
                     time.sleep(10)
@@ -251,6 +280,11 @@ def run_operator():
         logger.critical(f"Operator服务启动时发生未知严重错误: {e_startup}")
         logger.critical(traceback.format_exc())
     finally:
+        if pool:
+            logger.info("Operator服务正在等待处理中的动作组完成...")
+            pool.shutdown()
+        if waiter:
+            waiter.close()
         if publisher:
             logger.info("Operator服务正在关闭RabbitMQ publisher...")
             publisher.close()
@@ -0,0 +1,264 @@
+"""SOAR剧本异步执行引擎
+
+原先 Executor 提交剧本后在 SOARClient.wait_for_completion 中 sleep 轮询，一个慢剧本会阻塞其他所有待执行命令。
+现在拆分为提交和跟踪两步：
+
+- Executor 主循环只负责提交剧本（PlaybookService.submit_playbook），把SOAR返回的活动ID写入 playbook_activities 表后立即处理下一条命令
+- PlaybookActivityPoller 调度线程按 next_poll_at 认领到期的活动（FOR UPDATE SKIP LOCKED，多个Executor副本不会重复查询），
+  交给查询线程池并发查询状态，查询间隔从 PLAYBOOK_POLL_MIN_INTERVAL 按 PLAYBOOK_POLL_BACKOFF 逐次放大到 PLAYBOOK_POLL_MAX_INTERVAL
+- 配置了SOAR批量状态接口（SOAR_BATCH_STATUS_PATH）时，每 SOAR_BATCH_STATUS_SIZE 个活动只发一次查询请求；
+  状态中已带有执行结果时不再单独获取结果，N 个并发剧本每轮的请求数从 2N 降到约 N / SOAR_BATCH_STATUS_SIZE
+- 活动成功、失败或超过 PLAYBOOK_TIMEOUT 时先置为 finishing，写入 Execution 并回调 Executor 完成命令后才置为终态；
+  其间进程退出或数据库出错时，finishing 的活动在认领租约到期后被重新查询并补完命令，已写入的 Execution 不会重复创建
+- 活动记录持久化在数据库中，Executor 重启后由任一副本继续跟踪
+"""
+import json
+import logging
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import func
+
+from app.config import config
+from app.models import db, Command, Execution, PlaybookActivity
+from app.services.playbook_service import PlaybookService
+from app.utils.soar_client import SOARError, SOAR_BATCH_STATUS_SIZE
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PLAYBOOK_TIMEOUT = int(os.getenv('PLAYBOOK_TIMEOUT', '600'))
+PLAYBOOK_POLL_MIN_INTERVAL = float(os.getenv('PLAYBOOK_POLL_MIN_INTERVAL', '2'))
+PLAYBOOK_POLL_MAX_INTERVAL = float(os.getenv('PLAYBOOK_POLL_MAX_INTERVAL', '30'))
+PLAYBOOK_POLL_BACKOFF = float(os.getenv('PLAYBOOK_POLL_BACKOFF', '1.5'))
+PLAYBOOK_POLL_WORKERS = int(os.getenv('PLAYBOOK_POLL_WORKERS', '8'))
+PLAYBOOK_POLL_BATCH = int(os.getenv('PLAYBOOK_POLL_BATCH', '100'))
+# SOAR判定为失败的执行状态，出现时不再等待超时
+PLAYBOOK_FAILED_STATUSES = {
+    s.strip().upper() for s in os.getenv('PLAYBOOK_FAILED_STATUSES', 'FAILED,FAIL,ERROR').split(',') if s.strip()
+}
+# 认领到期活动后顺延的时间，覆盖一次状态查询和结果获取（含重试）
+_POLL_CLAIM_SECONDS = (config.SOAR_RETRY_COUNT + 1) * config.SOAR_API_TIMEOUT * 2 + 5
+# 调度线程跟踪的活动状态：finishing 表示已查询到结束但命令尚未完成
+_TRACKED_STATUSES = ('running', 'finishing')
+
+
+def poll_interval(poll_count):
+    """第 poll_count 次查询后的等待间隔（秒）"""
+    return min(PLAYBOOK_POLL_MAX_INTERVAL, PLAYBOOK_POLL_MIN_INTERVAL * (PLAYBOOK_POLL_BACKOFF ** poll_count))
+
+
+def track_activity(command, submitted):
+    """记录已提交的剧本活动，由调度线程跟踪，调用方负责提交事务
+
+    Args:
+        command: 命令对象
+        submitted: PlaybookService.submit_playbook 的返回值
+    """
+    now = datetime.utcnow()
+    activity = PlaybookActivity(
+        activity_id=submitted['activity_id'],
+        command_id=command.command_id,
+        playbook_id=submitted.get('playbook_id'),
+        status='running',
+        poll_count=0,
+        next_poll_at=now + timedelta(seconds=PLAYBOOK_POLL_MIN_INTERVAL),
+        deadline_at=now + timedelta(seconds=PLAYBOOK_TIMEOUT)
+    )
+    db.session.add(activity)
+    return activity
+
+
+class PlaybookActivityPoller:
+    """在后台线程中跟踪 running 状态的剧本活动
+
+    Args:
+        app: Flask应用
+        on_finished: 活动结束后的回调 on_finished(command, result)，在查询线程的应用上下文中调用，
+            result 与 PlaybookService.execute_playbook 的返回值格式相同
+    """
+
+    def __init__(self, app, on_finished, workers=PLAYBOOK_POLL_WORKERS):
+        self.app = app
+        self.on_finished = on_finished
+        self.playbook_service = PlaybookService()
+        self.workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='PlaybookPoll')
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='PlaybookActivityPoller', daemon=True)
+        self._thread.start()
+        logger.info(f"剧本活动调度线程已启动（查询线程数: {self.workers}）")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self._pool.shutdown(wait=True)
+
+    def _run(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    activity_pks = self._claim_due()
+                    if activity_pks:
+                        # 支持批量查询时按批分组，否则每个活动单独查询，由查询线程池有界并发
+                        size = SOAR_BATCH_STATUS_SIZE if self.playbook_service.soar_client.supports_batch_status else 1
+                        groups = [activity_pks[i:i + size] for i in range(0, len(activity_pks), size)]
+                        # 等待本批查询完成后再认领下一批，避免查询线程池积压
+                        for future in [self._pool.submit(self._poll_in_context, group) for group in groups]:
+                            future.result()
+                        continue
+                    self._stop.wait(self._idle_wait())
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"剧本活动调度出错: {e}")
+                    logger.error(traceback.format_exc())
+                    self._stop.wait(PLAYBOOK_POLL_MIN_INTERVAL)
+
+    def _claim_due(self):
+        """认领到期的活动并顺延其 next_poll_at，返回主键列表"""
+        now = datetime.utcnow()
+        activities = PlaybookActivity.query.filter(
+            PlaybookActivity.status.in_(_TRACKED_STATUSES),
+            PlaybookActivity.next_poll_at <= now
+        ).order_by(PlaybookActivity.next_poll_at.asc()).limit(PLAYBOOK_POLL_BATCH).with_for_update(skip_locked=True).all()
+        if not activities:
+            db.session.rollback()
+            return []
+        claimed_until = now + timedelta(seconds=_POLL_CLAIM_SECONDS)
+        for activity in activities:
+            activity.next_poll_at = claimed_until
+        pks = [activity.id for activity in activities]
+        db.session.commit()
+        return pks
+
+    def _idle_wait(self):
+        """距离最早一个活动到期的秒数，限制在 [0.5, PLAYBOOK_POLL_MAX_INTERVAL] 之间"""
+        next_due = db.session.query(func.min(PlaybookActivity.next_poll_at)).filter(
+            PlaybookActivity.status.in_(_TRACKED_STATUSES)
+        ).scalar()
+        db.session.rollback()
+        if not next_due:
+            return PLAYBOOK_POLL_MAX_INTERVAL
+        return max(0.5, min(PLAYBOOK_POLL_MAX_INTERVAL, (next_due - datetime.utcnow()).total_seconds()))
+
+    def _poll_in_context(self, activity_pks):
+        with self.app.app_context():
+            try:
+                self._poll(activity_pks)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"查询剧本活动 {activity_pks} 出错: {e}")
+                logger.error(traceback.format_exc())
+
+    def _poll(self, activity_pks):
+        """查询一组活动的状态：批量接口一次查询整组，否则逐个查询"""
+        activities = PlaybookActivity.query.filter(
+            PlaybookActivity.id.in_(activity_pks),
+            PlaybookActivity.status.in_(_TRACKED_STATUSES)
+        ).all()
+        if not activities:
+            db.session.rollback()
+            return
+
+        soar_client = self.playbook_service.soar_client
+        if soar_client.supports_batch_status:
+            try:
+                statuses = soar_client.get_playbook_statuses([activity.activity_id for activity in activities])
+                error = None
+            except SOARError as e:
+                statuses, error = {}, e
+            for activity in activities:
+                self._apply(activity, statuses.get(activity.activity_id), error)
+            return
+
+        for activity in activities:
+            try:
+                self._apply(activity, soar_client.get_playbook_status(activity.activity_id), None)
+            except SOARError as e:
+                self._apply(activity, None, e)
+
+    def _apply(self, activity, status, status_error):
+        """根据查询到的状态推进活动：结束时写入结果并回调，否则按退避间隔安排下一次查询"""
+        soar_client = self.playbook_service.soar_client
+        recovering = activity.status == 'finishing'
+        activity.poll_count = (activity.poll_count or 0) + 1
+        now = datetime.utcnow()
+        soar_status = activity.soar_status
+        result = None
+        if status_error is None:
+            soar_status = ((status or {}).get('executeStatus') or '').upper() or None
+            activity.soar_status = soar_status
+            if soar_status == 'SUCCESS':
+                # 状态中已带有执行结果时不再单独获取
+                result = soar_client.extract_result(status)
+                if result is None:
+                    try:
+                        result = soar_client.get_playbook_result(activity.activity_id)
+                    except SOARError as e:
+                        status_error = e
+
+        if status_error is None and soar_status == 'SUCCESS':
+            final_status = 'completed' if result else 'failed'
+        elif status_error is None and soar_status in PLAYBOOK_FAILED_STATUSES:
+            final_status = 'failed'
+        elif activity.deadline_at and now >= activity.deadline_at:
+            result = None
+            final_status = 'timeout'
+            logger.warning(f"剧本执行超时: {activity.activity_id}")
+        else:
+            # SOAR不可用（含熔断）时不判定剧本失败，按退避间隔稍后再查，仍受超时限制
+            activity.next_poll_at = now + timedelta(seconds=poll_interval(activity.poll_count))
+            db.session.commit()
+            if status_error is not None:
+                logger.warning(f"查询剧本活动 {activity.activity_id} 失败，稍后重试: {status_error}")
+            return
+
+        # 命令完成前保持 finishing 并顺延 next_poll_at 作为租约，中途失败时由调度线程重新认领补完
+        activity.status = 'finishing'
+        activity.next_poll_at = now + timedelta(seconds=_POLL_CLAIM_SECONDS)
+        db.session.commit()
+
+        self._finish(activity, result, recovering)
+        activity.status = final_status
+        db.session.commit()
+        logger.info(f"剧本活动 {activity.activity_id} 结束（{activity.status}，查询 {activity.poll_count} 次）")
+
+    def _finish(self, activity, result, recovering):
+        """写入执行结果并回调完成命令；补完中断的活动时跳过已完成的步骤"""
+        command = Command.query.filter_by(command_id=activity.command_id).first()
+        if not command:
+            logger.warning(f"剧本活动 {activity.activity_id} 关联的命令 {activity.command_id} 不存在")
+            return
+        if recovering:
+            if command.command_status != 'processing':
+                logger.info(f"剧本活动 {activity.activity_id} 关联的命令已是 {command.command_status}，只更新活动状态")
+                return
+            execution = Execution.query.filter_by(command_id=command.command_id).order_by(Execution.id.desc()).first()
+            if execution:
+                logger.info(f"补完剧本活动 {activity.activity_id}：沿用已写入的执行记录 {execution.execution_id}")
+                self.on_finished(command, self._outcome_from_execution(execution))
+                return
+        outcome = self.playbook_service.complete_playbook(command, activity.playbook_id, activity.activity_id, result)
+        self.on_finished(command, outcome)
+
+    @staticmethod
+    def _outcome_from_execution(execution):
+        """由已写入的执行记录还原 complete_playbook / fail_playbook 的返回值"""
+        if execution.execution_status == 'failed':
+            return {"status": "failed", "message": execution.execution_summary or "剧本执行失败"}
+        data = execution.execution_result
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                pass
+        return {"status": "success", "message": execution.execution_summary, "data": data}
@@ -6,27 +6,30 @@ from app.models import db, Command, Execution
 import uuid
 
 # 导入SOARClient
-from app.utils.soar_client import SOARClient
+from app.utils.soar_client import SOARClient, SOARUnavailableError
 
 logger = logging.getLogger(__name__)
 
 class PlaybookService:
-    def __init__(self):
-        self.soar_client = SOARClient()
+    def __init__(self, soar_client: Optional[SOARClient] = None):
+        self.soar_client = soar_client or SOARClient()
     
-    def execute_playbook(self, command: Command) -> Dict[str, Any]:
+    def submit_playbook(self, command: Command) -> Dict[str, Any]:
         """
-        执行SOAR剧本
+        提交SOAR剧本，不等待执行完成
         
         Args:
             command: 命令对象
         
         Returns:
-            执行结果
+            提交成功时 status 为 submitted 并携带 activity_id 和 playbook_id，失败时 status 为 failed
+
+        Raises:
+            SOARUnavailableError: SOAR接口熔断中
         """
         try:
             # 获取剧本ID和参数
-            playbook_id = command.command_entity.get('playbook_id')
+            playbook_id = (command.command_entity or {}).get('playbook_id')
             params = command.command_params or {}
             
             if not playbook_id:
@@ -49,17 +52,40 @@ class PlaybookService:
                     "message": error_msg
                 }
             
-            # 等待剧本执行完成
-            result = self.soar_client.wait_for_completion(activity_id)
-            
-            if not result:
-                error_msg = f"剧本执行超时或失败: {activity_id}"
-                logger.error(error_msg)
-                return {
-                    "status": "failed",
-                    "message": error_msg
-                }
-            
+            return {
+                "status": "submitted",
+                "message": f"剧本 {playbook_id} 已提交，活动ID: {activity_id}",
+                "activity_id": str(activity_id),
+                "playbook_id": str(playbook_id)
+            }
+        except SOARUnavailableError:
+            # 熔断期间请求没有发出，交由调用方决定稍后重试
+            raise
+        except Exception as e:
+            return self.fail_playbook(command, e)
+
+    def complete_playbook(self, command: Command, playbook_id, activity_id, result) -> Dict[str, Any]:
+        """
+        记录剧本的执行结果
+
+        Args:
+            command: 命令对象
+            playbook_id: 剧本ID
+            activity_id: 活动ID
+            result: SOAR返回的执行结果，为空表示超时或失败
+
+        Returns:
+            执行结果
+        """
+        if not result:
+            error_msg = f"剧本执行超时或失败: {activity_id}"
+            logger.error(error_msg)
+            return {
+                "status": "failed",
+                "message": error_msg
+            }
+
+        try:
             # 记录执行结果
             execution = Execution(
                 execution_id=str(uuid.uuid4()),
@@ -82,27 +108,51 @@ class PlaybookService:
                 "message": f"剧本 {playbook_id} 执行成功",
                 "data": result
             }
-            
         except Exception as e:
-            error_msg = f"执行剧本时出错: {str(e)}"
-            logger.error(error_msg)
-            
-            # 记录执行失败
-            execution = Execution(
-                execution_id=str(uuid.uuid4()),
-                command_id=command.command_id,
-                action_id=command.action_id,
-                task_id=command.task_id,
-                event_id=command.event_id,
-                round_id=command.round_id,
-                execution_result=json.dumps({"error": str(e)}),
-                execution_summary=error_msg,
-                execution_status="failed"
-            )
-            db.session.add(execution)
-            db.session.commit()
-            
-            return {
-                "status": "failed",
-                "message": error_msg
-            }
\ No newline at end of file
+            db.session.rollback()
+            return self.fail_playbook(command, e)
+
+    def fail_playbook(self, command: Command, error: Exception) -> Dict[str, Any]:
+        """记录剧本执行异常"""
+        error_msg = f"执行剧本时出错: {str(error)}"
+        logger.error(error_msg)
+
+        # 记录执行失败
+        execution = Execution(
+            execution_id=str(uuid.uuid4()),
+            command_id=command.command_id,
+            action_id=command.action_id,
+            task_id=command.task_id,
+            event_id=command.event_id,
+            round_id=command.round_id,
+            execution_result=json.dumps({"error": str(error)}),
+            execution_summary=error_msg,
+            execution_status="failed"
+        )
+        db.session.add(execution)
+        db.session.commit()
+
+        return {
+            "status": "failed",
+            "message": error_msg
+        }
+
+    def execute_playbook(self, command: Command) -> Dict[str, Any]:
+        """
+        执行SOAR剧本并阻塞等待完成（Executor 使用 submit_playbook + 活动轮询，不再调用此方法）
+
+        Args:
+            command: 命令对象
+
+        Returns:
+            执行结果
+        """
+        submitted = self.submit_playbook(command)
+        if submitted.get('status') != 'submitted':
+            return submitted
+        try:
+            # 等待剧本执行完成
+            result = self.soar_client.wait_for_completion(submitted['activity_id'])
+        except Exception as e:
+            return self.fail_playbook(command, e)
+        return self.complete_playbook(command, submitted['playbook_id'], submitted['activity_id'], result)
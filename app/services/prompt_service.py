@@ -1,3 +1,5 @@
+import yaml
+
 from app.prompts.generate_prompt import generate_prompt
 
 class PromptService:
@@ -9,3 +11,34 @@ class PromptService:
         role_to_use = role if role else self.role
         return generate_prompt(role_to_use)
 
+
+def build_user_prompt(stable_data, volatile_data=None, sections=None, instruction=''):
+    """按“稳定内容在前、易变内容在后”组装用户提示词
+
+    大模型服务商的前缀缓存（prompt prefix caching）只对完全相同的前缀生效。系统提示词
+    （角色提示词 + 背景信息 + 剧本列表）本身固定不变，用户提示词再按以下顺序拼接：
+
+    1. YAML块：先输出 stable_data（请求类型、事件主体等同一事件内不变的字段），
+       再输出 volatile_data（轮次、任务列表、req_id/res_id 等每次请求都会变化的字段），保持字典原有顺序
+    2. sections：附加的上下文段落（如上一轮战况），按给定顺序
+    3. instruction：本次请求的指令
+
+    Args:
+        stable_data: 稳定字段字典
+        volatile_data: 易变字段字典
+        sections: 附加段落列表，空值会被忽略
+        instruction: 指令文本
+
+    Returns:
+        用户提示词文本
+    """
+    data = dict(stable_data)
+    if volatile_data:
+        data.update(volatile_data)
+    yaml_data = yaml.dump(data, allow_unicode=True, default_flow_style=False, indent=2, sort_keys=False)
+
+    parts = [f"```yaml\n{yaml_data}```"]
+    parts.extend(section.strip() for section in (sections or []) if section and section.strip())
+    if instruction:
+        parts.append(instruction.strip())
+    return "\n\n".join(parts) + "\n"
@@ -0,0 +1,122 @@
+"""命令/动作/任务状态的集合式汇总
+
+原先每生成一条执行摘要，就依次调用命令、动作、任务三层的检查函数：每层 expire_all() 后对一行加 FOR UPDATE 锁，
+加载全部子记录在 Python 中循环判断。一个有几百条命令的事件会因此产生上千次查询和行锁。
+
+现在在一个事务中完成整个事件的汇总：
+
+- 只对事件行加一把 FOR UPDATE 锁，串行化同一事件的并发汇总
+- 命令、动作、任务各用一条 UPDATE ... JOIN (SELECT ... GROUP BY) 语句：子记录全部终结的父记录
+  一次性更新为 completed（有失败的子记录时为 failed），已终结的父记录不再改动
+- 最后按同样的规则检查当前轮次的任务，全部终结时把事件更新为 tasks_completed / failed，
+  并写入状态变更记录、唤醒事件生命周期线程
+
+汇总按事件整体重算，是幂等的，也能补上此前遗漏的状态传递。
+"""
+import logging
+
+from sqlalchemy import update, select, func, case
+
+from app.models import db, Event, Task, Action, Command, Execution
+from app.services.event_transitions import set_event_status, notify_lifecycle
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = ('completed', 'failed')
+EXECUTION_FINAL_STATUSES = ('summarized', 'summarized_error', 'failed')
+EXECUTION_FAILED_STATUSES = ('summarized_error', 'failed')
+
+
+def _aggregate(child_status, parent_key, event_filter, final_statuses, failed_statuses):
+    """按父记录分组统计子记录总数、已终结数和失败数"""
+    return select(
+        parent_key.label('parent_id'),
+        func.count().label('total'),
+        func.sum(case((child_status.in_(final_statuses), 1), else_=0)).label('finalized'),
+        func.sum(case((child_status.in_(failed_statuses), 1), else_=0)).label('failed'),
+    ).where(event_filter, parent_key.isnot(None)).group_by(parent_key).subquery()
+
+
+def _rollup(parent_model, parent_key, parent_status, agg, event_id):
+    """子记录全部终结的父记录更新为 completed / failed，返回更新的行数"""
+    return db.session.execute(
+        update(parent_model)
+        .where(
+            parent_key == agg.c.parent_id,
+            parent_model.event_id == event_id,
+            parent_status.notin_(FINAL_STATUSES),
+            agg.c.total == agg.c.finalized,
+        )
+        .values({parent_status.key: case((agg.c.failed > 0, 'failed'), else_='completed')})
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def rollup_event_statuses(event_id, commit=True, publisher=None):
+    """汇总事件下命令、动作、任务的状态，并在当前轮次任务全部终结时更新事件状态
+
+    Args:
+        event_id: 事件ID
+        commit: 是否提交事务；为False时只flush，由调用方与其他改动一起提交（事件行锁持续到调用方提交），
+            事件状态有变化时调用方应在提交后调用 notify_lifecycle
+        publisher: 可选的 RabbitMQPublisher，提交后用于唤醒事件生命周期线程
+
+    Returns:
+        dict: 各层更新的行数（commands / actions / tasks）以及事件的新状态（event_status，未变化时为None）
+    """
+    stats = {'commands': 0, 'actions': 0, 'tasks': 0, 'event_status': None}
+    if not event_id:
+        return stats
+    try:
+        event = db.session.query(Event).with_for_update().filter_by(event_id=event_id).first()
+        if not event:
+            logger.warning(f"汇总状态时未找到事件: {event_id}")
+            if commit:
+                db.session.rollback()
+            return stats
+
+        stats['commands'] = _rollup(
+            Command, Command.command_id, Command.command_status,
+            _aggregate(Execution.execution_status, Execution.command_id, Execution.event_id == event_id,
+                       EXECUTION_FINAL_STATUSES, EXECUTION_FAILED_STATUSES),
+            event_id
+        )
+        stats['actions'] = _rollup(
+            Action, Action.action_id, Action.action_status,
+            _aggregate(Command.command_status, Command.action_id, Command.event_id == event_id,
+                       FINAL_STATUSES, ('failed',)),
+            event_id
+        )
+        stats['tasks'] = _rollup(
+            Task, Task.task_id, Task.task_status,
+            _aggregate(Action.action_status, Action.task_id, Action.event_id == event_id,
+                       FINAL_STATUSES, ('failed',)),
+            event_id
+        )
+
+        if event.event_status == 'processing':
+            total, finalized, failed = db.session.query(
+                func.count(Task.id),
+                func.sum(case((Task.task_status.in_(FINAL_STATUSES), 1), else_=0)),
+                func.sum(case((Task.task_status == 'failed', 1), else_=0)),
+            ).filter(Task.event_id == event_id, Task.round_id == event.current_round).one()
+            if total and total == finalized:
+                set_event_status(event, 'failed' if failed else 'tasks_completed')
+                stats['event_status'] = event.event_status
+
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # 批量UPDATE绕过了会话中的对象，使其在下次访问时重新加载
+    db.session.expire_all()
+    if stats['commands'] or stats['actions'] or stats['tasks'] or stats['event_status']:
+        logger.info(f"事件 {event_id} 状态汇总: 命令 {stats['commands']}，动作 {stats['actions']}，"
+                    f"任务 {stats['tasks']}，事件状态 {stats['event_status'] or '未变化'}")
+    if commit and stats['event_status']:
+        notify_lifecycle(event_id, publisher)
+    return stats
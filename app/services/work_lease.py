@@ -0,0 +1,221 @@
+"""Agent工作认领与租约
+
+原先各Agent直接查询 pending 记录处理，多个副本会重复处理同一条记录，每个角色只能运行一个进程。
+现在处理前先原子地认领：
+
+- 认领：在事务中以 SELECT ... FOR UPDATE SKIP LOCKED 选出未被认领（或租约已过期）的 pending 记录，
+  写入 claimed_by / lease_expires_at 后提交；并发的其他副本会跳过被锁定的行，不会相互等待
+- 续约：LeaseKeeper 在后台线程中用独立会话定期延长租约，覆盖耗时较长的LLM调用和SOAR剧本执行
+- 释放：处理结束后清空认领信息，记录的业务状态仍由原有流程维护
+- 回收：持有者崩溃导致租约过期时，事件/命令若停留在处理中（processing）则重置为 pending 并重新通知；
+  任务/动作处理期间保持 pending，租约过期后即可被重新认领
+
+SKIP LOCKED 需要 MySQL 8.0+ / PostgreSQL；SQLite 会忽略行锁，只适合单副本开发环境。
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import update, or_, and_
+from sqlalchemy.orm import Session
+
+from app.models import db, Event, Task, Action, Command
+from app.utils.work_queue import notify_work
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WORK_LEASE_SECONDS = int(os.getenv('WORK_LEASE_SECONDS', '300'))
+WORK_LEASE_RENEW_INTERVAL = float(os.getenv('WORK_LEASE_RENEW_INTERVAL', str(WORK_LEASE_SECONDS / 3)))
+WORK_REAPER_INTERVAL = float(os.getenv('WORK_REAPER_INTERVAL', '60'))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# model: 认领的表；status: 状态字段名；requeue_statuses: 租约过期时需要重置为 pending 的处理中状态
+LeaseSpec = namedtuple('LeaseSpec', ['model', 'status', 'requeue_statuses'])
+
+LEASE_SPECS = {
+    '_captain': LeaseSpec(Event, 'event_status', ('processing',)),
+    '_manager': LeaseSpec(Task, 'task_status', ()),
+    '_operator': LeaseSpec(Action, 'action_status', ()),
+    '_executor': LeaseSpec(Command, 'command_status', ('processing',)),
+}
+
+
+def _lease_deadline():
+    return datetime.utcnow() + timedelta(seconds=WORK_LEASE_SECONDS)
+
+
+def _claimable(spec, now):
+    model = spec.model
+    return and_(
+        getattr(model, spec.status) == 'pending',
+        or_(model.claimed_by.is_(None), model.lease_expires_at < now)
+    )
+
+
+def claim_rows(role, limit=1, group_by=None, exclude_event_ids=None):
+    """认领该角色待处理的记录
+
+    Args:
+        role: Agent角色（见 LEASE_SPECS）
+        limit: 最多认领的条数（指定 group_by 时忽略）
+        group_by: 字段名列表；指定时先认领最早的一条，再认领与其这些字段相同的全部可认领记录
+        exclude_event_ids: 跳过这些事件的记录（本进程中已有工作在途的事件）
+
+    Returns:
+        已认领并提交的记录列表，没有可认领的记录时为空列表
+    """
+    spec = LEASE_SPECS[role]
+    model = spec.model
+    now = datetime.utcnow()
+    query = model.query.filter(_claimable(spec, now))
+    if exclude_event_ids:
+        query = query.filter(model.event_id.notin_(list(exclude_event_ids)))
+    query = query.order_by(model.created_at.asc(), model.id.asc())
+    try:
+        if group_by:
+            first = query.with_for_update(skip_locked=True).first()
+            rows = []
+            if first:
+                rows = query.filter(
+                    *[getattr(model, field) == getattr(first, field) for field in group_by]
+                ).with_for_update(skip_locked=True).all()
+        else:
+            rows = query.limit(limit).with_for_update(skip_locked=True).all()
+
+        if not rows:
+            db.session.rollback()
+            return []
+        deadline = _lease_deadline()
+        for row in rows:
+            row.claimed_by = WORKER_ID
+            row.lease_expires_at = deadline
+        db.session.commit()
+        return rows
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def release_rows(role, ids):
+    """清空本进程对这些记录的认领（按主键）"""
+    model = LEASE_SPECS[role].model
+    db.session.execute(
+        update(model)
+        .where(model.id.in_(ids), model.claimed_by == WORKER_ID)
+        .values(claimed_by=None, lease_expires_at=None)
+    )
+    db.session.commit()
+
+
+class LeaseKeeper:
+    """在处理期间定期续约，退出时释放认领
+
+    用法:
+        rows = claim_rows('_captain')
+        with LeaseKeeper('_captain', rows):
+            process(...)
+    """
+
+    def __init__(self, role, rows, renew_interval=WORK_LEASE_RENEW_INTERVAL):
+        self.role = role
+        self.model = LEASE_SPECS[role].model
+        self.ids = [row.id for row in rows]
+        self.renew_interval = renew_interval
+        self._engine = db.engine
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f"LeaseKeeper{self.role}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        try:
+            if exc_type is not None:
+                db.session.rollback()
+            release_rows(self.role, self.ids)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"{self.role} 释放认领失败（将等待租约过期）: {e}")
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.renew_interval):
+            session = Session(bind=self._engine)
+            try:
+                renewed = session.execute(
+                    update(self.model)
+                    .where(self.model.id.in_(self.ids), self.model.claimed_by == WORKER_ID)
+                    .values(lease_expires_at=_lease_deadline())
+                ).rowcount
+                session.commit()
+                if renewed < len(self.ids):
+                    logger.warning(f"{self.role} 有 {len(self.ids) - renewed} 条记录的租约已丢失（可能已被回收）")
+            except Exception as e:
+                session.rollback()
+                logger.error(f"{self.role} 续约失败: {e}")
+            finally:
+                session.close()
+
+
+_last_reap = {}
+
+
+def _requeue_values(spec):
+    values = {spec.status: 'pending', 'claimed_by': None, 'lease_expires_at': None}
+    if spec.model is Event:
+        # 批量重置不写状态变更记录，只更新进入状态的时间，避免把处理中的时长计入 pending
+        values['status_changed_at'] = datetime.utcnow()
+    return values
+
+
+def reap_expired_leases(role, publisher=None):
+    """回收该角色已过期的租约，返回回收的记录数
+
+    处理中状态的记录重置为 pending，其余只清空认领信息；有记录被回收时重新发布工作通知。
+    按 WORK_REAPER_INTERVAL 节流，可在主循环中每轮调用。
+    """
+    now_mono = time.monotonic()
+    if now_mono - _last_reap.get(role, 0) < WORK_REAPER_INTERVAL:
+        return 0
+    _last_reap[role] = now_mono
+
+    spec = LEASE_SPECS[role]
+    model = spec.model
+    status_column = getattr(model, spec.status)
+    expired = and_(model.claimed_by.isnot(None), model.lease_expires_at < datetime.utcnow())
+    try:
+        requeued = 0
+        if spec.requeue_statuses:
+            requeued = db.session.execute(
+                update(model)
+                .where(expired, status_column.in_(spec.requeue_statuses))
+                .values(_requeue_values(spec))
+            ).rowcount
+        cleared = db.session.execute(
+            update(model)
+            .where(expired, status_column == 'pending')
+            .values(claimed_by=None, lease_expires_at=None)
+        ).rowcount
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"{role} 回收过期租约失败: {e}")
+        return 0
+
+    if requeued or cleared:
+        logger.warning(f"{role} 回收了 {requeued + cleared} 条过期租约（其中 {requeued} 条从处理中重置为 pending）")
+        notify_work(role, publisher, reaped=requeued + cleared)
+    return requeued + cleared
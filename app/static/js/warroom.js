@@ -386,6 +386,12 @@ function setupSocketEventListeners() {
             if (message.sender_type === 'ai') {
                 hideAIThinkingIndicator();
                 console.log('%c[工程师对话] 收到AI回复，隐藏思考指示器', 'color: #4CAF50;');
+                
+                // 完整回复到达后，移除对应的流式输出临时消息
+                const streamId = message.message_content && message.message_content.stream_id;
+                if (streamId) {
+                    removeStreamingMessage(streamId);
+                }
             }
         }
         
@@ -409,6 +415,15 @@ function setupSocketEventListeners() {
         }
     });
     
+    // 工程师对话流式输出：AI回复的增量内容
+    socket.on('chat_stream', (chunk) => {
+        if (!chunk || !chunk.stream_id) return;
+        if (chunk.delta) {
+            hideAIThinkingIndicator();
+            appendStreamingMessage(chunk.stream_id, chunk.delta);
+        }
+    });
+    
     // 状态变化
     socket.on('status', (data) => {
         console.log('%c[WebSocket] 收到状态更新:', 'background: #9C27B0; color: white; padding: 2px 5px; border-radius: 3px;', data);
@@ -772,7 +787,8 @@ async function fetchEventMessages() {
     try {
         updateLoadingState('messages', true);
         
-        const lastId = messagesData.length > 0 ? Math.max(...messagesData.map(m => m.id)) : 0;
+        // 临时消息（如流式输出占位）的id不是数据库主键，不参与计算
+        const lastId = messagesData.reduce((max, m) => (Number.isInteger(m.id) && !m.temp_indicator && m.id > max) ? m.id : max, 0);
         
         const response = await fetch(`/api/event/${eventId}/messages?last_message_db_id=${lastId}`, {
             headers: getAuthHeaders(),
@@ -1356,6 +1372,50 @@ function hideAIThinkingIndicator() {
     }
 }
 
+// 工程师对话流式输出相关函数
+const streamingMessages = new Map(); // stream_id -> { id, text }
+
+function appendStreamingMessage(streamId, delta) {
+    let entry = streamingMessages.get(streamId);
+    if (!entry) {
+        entry = { id: `ai_stream_${streamId}`, text: '' };
+        const streamMessage = {
+            id: entry.id,
+            message_id: entry.id,
+            event_id: eventId,
+            message_from: 'ai_assistant',
+            message_content: { content: '' },
+            message_type: 'chat',
+            message_category: 'engineer_chat',
+            sender_type: 'ai',
+            created_at: new Date().toISOString(),
+            temp_indicator: true // 标记为临时消息，最终回复到达后移除
+        };
+        if (!addMessage(streamMessage)) return;
+        streamingMessages.set(streamId, entry);
+    }
+    
+    entry.text += delta;
+    const element = document.getElementById(`msg-${entry.id}`);
+    const responseElement = element ? element.querySelector('.ai-response') : null;
+    if (responseElement) {
+        responseElement.innerHTML = marked.parse(entry.text);
+        scrollToBottom();
+    }
+}
+
+function removeStreamingMessage(streamId) {
+    const entry = streamingMessages.get(streamId);
+    if (!entry) return;
+    
+    const element = document.getElementById(`msg-${entry.id}`);
+    if (element) element.remove();
+    displayedMessages.delete(`id_${entry.id}`);
+    const idx = messagesData.findIndex(m => m.id === entry.id);
+    if (idx !== -1) messagesData.splice(idx, 1);
+    streamingMessages.delete(streamId);
+}
+
 // 获取当前驾驶模式
 async function fetchDrivingMode() {
     try {
@@ -3,7 +3,7 @@ from datetime import datetime
 from app.models import db, Message
 # from app.controllers.socket_controller import broadcast_message # Removed
 
-def create_standard_message(event_id, message_from, round_id, message_type, content_data, additional_fields=None):
+def create_standard_message(event_id, message_from, round_id, message_type, content_data, additional_fields=None, commit=True):
     """创建标准格式的消息并存入数据库。
        Agent进程调用此函数后，应负责将返回的message对象内容发送到消息队列。
     
@@ -14,6 +14,7 @@ def create_standard_message(event_id, message_from, round_id, message_type, cont
         message_type: 消息类型 (llm_request, llm_response, execution_summary, event_summary, command_result, system_notification, user_message 等)
         content_data: 消息主体内容 (通常是一个字典)
         additional_fields: 额外字段 (可选, 会合并到 message_content 中)
+        commit: 是否立即提交；为False时只加入会话，由调用方与其他改动一起提交后再发送到消息队列
     
     Returns:
         创建并已存入数据库的 Message 对象
@@ -45,7 +46,8 @@ def create_standard_message(event_id, message_from, round_id, message_type, cont
         message_type=message_type
     )
     db.session.add(message)
-    db.session.commit()
+    if commit:
+        db.session.commit()
     
     # 广播消息的逻辑已移除，将由Agent通过消息队列处理
     # broadcast_message(message) # Removed
@@ -2,6 +2,7 @@ import pika
 import os
 import json
 import logging
+import threading
 import time
 import traceback
 from dotenv import load_dotenv
@@ -205,6 +206,30 @@ class RabbitMQPublisher:
         if (self.connection and self.connection.is_closed) or not self.connection : self.connection = None
 
 
+class ThreadSafePublisher:
+    """Serializes access to a RabbitMQPublisher so that worker threads can share it.
+
+    pika's BlockingConnection is not thread-safe; every call into the wrapped
+    publisher (including reconnects) happens under a single lock.
+    """
+
+    def __init__(self, publisher=None, **kwargs):
+        self._publisher = publisher or RabbitMQPublisher(**kwargs)
+        self._lock = threading.Lock()
+
+    def publish_message(self, *args, **kwargs):
+        with self._lock:
+            return self._publisher.publish_message(*args, **kwargs)
+
+    def ensure_connection(self):
+        with self._lock:
+            return self._publisher.ensure_connection()
+
+    def close(self):
+        with self._lock:
+            return self._publisher.close()
+
+
 # Example usage (primarily for testing this utility directly)
 if __name__ == '__main__':
     # Configure basic logging for testing
@@ -1,11 +1,197 @@
-import requests
+"""SOAR接口客户端
+
+- 进程内共享一个带连接池的 requests.Session（keep-alive），不再每次调用都重新建立连接
+- 连接错误、超时和 SOAR_RETRYABLE_STATUS 中的状态码按指数退避重试；提交剧本（POST）不是幂等的，只在连接未建立时重试
+- 熔断器：连续 SOAR_CIRCUIT_FAILURE_THRESHOLD 次请求失败后熔断 SOAR_CIRCUIT_RESET_SECONDS 秒，期间直接抛出
+  SOARUnavailableError 而不再等待超时；到期后放行一个探测请求，成功则恢复
+- 按接口记录调用次数、失败/重试次数和延迟，每 SOAR_METRICS_LOG_INTERVAL 秒输出一次到日志
+- 请求失败抛出 SOARError，调用方可以区分“SOAR不可用”与“剧本尚未完成”
+- 配置 SOAR_BATCH_STATUS_PATH 后可一次查询多个活动的状态（get_playbook_statuses）
+
+本地调试可使用 tools/mock_soar_server.py 启动一个模拟SOAR服务。
+"""
+import os
+import random
+import threading
 import time
 import logging
+from collections import deque
 from typing import Optional, Dict, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from app.config import config
 
 logger = logging.getLogger(__name__)
 
+SOAR_POOL_SIZE = int(os.getenv('SOAR_POOL_SIZE', 10))
+SOAR_CONNECT_TIMEOUT = float(os.getenv('SOAR_CONNECT_TIMEOUT', 5))
+SOAR_RETRY_MAX_DELAY = float(os.getenv('SOAR_RETRY_MAX_DELAY', 30))
+SOAR_RETRYABLE_STATUS = {
+    int(code) for code in os.getenv('SOAR_RETRYABLE_STATUS', '429,500,502,503,504').split(',') if code.strip()
+}
+SOAR_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('SOAR_CIRCUIT_FAILURE_THRESHOLD', 5))
+SOAR_CIRCUIT_RESET_SECONDS = float(os.getenv('SOAR_CIRCUIT_RESET_SECONDS', 30))
+SOAR_METRICS_LOG_INTERVAL = float(os.getenv('SOAR_METRICS_LOG_INTERVAL', 300))
+# 批量查询活动状态的接口路径，为空表示SOAR不支持，逐个查询
+SOAR_BATCH_STATUS_PATH = os.getenv('SOAR_BATCH_STATUS_PATH', '').strip()
+SOAR_BATCH_STATUS_SIZE = max(1, int(os.getenv('SOAR_BATCH_STATUS_SIZE', 50)))
+# 活动状态中携带执行结果的字段，存在时无需再单独获取结果
+SOAR_STATUS_RESULT_FIELD = os.getenv('SOAR_STATUS_RESULT_FIELD', 'executeResult').strip()
+
+
+class SOARError(Exception):
+    """SOAR接口请求失败"""
+
+
+class SOARUnavailableError(SOARError):
+    """熔断期间SOAR接口被判定为不可用，请求未发出"""
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """获取进程内共享的SOAR HTTP会话，连接池大小由 SOAR_POOL_SIZE 控制，应不小于并发调用SOAR的线程数"""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=SOAR_POOL_SIZE, pool_maxsize=SOAR_POOL_SIZE, pool_block=True)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({"Connection": "keep-alive"})
+                _http_session = session
+    return _http_session
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器（closed -> open -> half_open -> closed）"""
+
+    def __init__(self, failure_threshold=SOAR_CIRCUIT_FAILURE_THRESHOLD, reset_seconds=SOAR_CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行本次请求；熔断到期后只放行一个探测请求"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info("SOAR接口已恢复，关闭熔断")
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"SOAR接口连续失败 {self.consecutive_failures} 次，熔断 {self.reset_seconds:.0f} 秒")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def retry_after(self):
+        """熔断剩余秒数，未熔断时为0"""
+        with self._lock:
+            if self.state != 'open':
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+
+class SOARMetrics:
+    """按接口统计调用次数、失败/重试次数和延迟"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._last_log = time.monotonic()
+
+    def _entry(self, endpoint):
+        return self._stats.setdefault(endpoint, {
+            'calls': 0, 'failures': 0, 'retries': 0, 'rejected': 0,
+            'latencies': deque(maxlen=self.window)
+        })
+
+    def record(self, endpoint, latency, success, retries=0):
+        with self._lock:
+            stats = self._entry(endpoint)
+            stats['calls'] += 1
+            stats['retries'] += retries
+            if not success:
+                stats['failures'] += 1
+            if latency is not None:
+                stats['latencies'].append(latency)
+        self._maybe_log()
+
+    def record_rejected(self, endpoint):
+        with self._lock:
+            self._entry(endpoint)['rejected'] += 1
+
+    def snapshot(self):
+        """各接口的统计，延迟分位数基于最近 window 次请求（秒）"""
+        with self._lock:
+            result = {}
+            for endpoint, stats in self._stats.items():
+                latencies = sorted(stats['latencies'])
+                result[endpoint] = {
+                    'calls': stats['calls'],
+                    'failures': stats['failures'],
+                    'retries': stats['retries'],
+                    'rejected': stats['rejected'],
+                    'latency_avg': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                    'latency_p50': round(latencies[len(latencies) // 2], 3) if latencies else None,
+                    'latency_p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+                    if latencies else None,
+                    'latency_max': round(latencies[-1], 3) if latencies else None,
+                }
+            return result
+
+    def _maybe_log(self):
+        if SOAR_METRICS_LOG_INTERVAL <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_log < SOAR_METRICS_LOG_INTERVAL:
+                return
+            self._last_log = now
+        logger.info(f"SOAR接口统计: {self.snapshot()}")
+
+
+# 进程内共享：同一进程中的所有 SOARClient 实例共用熔断状态和统计
+soar_circuit_breaker = CircuitBreaker()
+soar_metrics = SOARMetrics()
+
+
+def _not_sent(error):
+    """连接未建立（请求一定没有发出），非幂等请求也可以安全重试"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if isinstance(error, requests.ConnectionError) and error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
 class SOARClient:
     def __init__(self):
         self.base_url = config.SOAR_API_URL
@@ -13,10 +199,62 @@ class SOARClient:
             'hg-token': config.SOAR_API_TOKEN,  # 修改为正确的token头
             'Content-Type': 'application/json'
         }
-        self.timeout = config.SOAR_API_TIMEOUT
+        self.timeout = (SOAR_CONNECT_TIMEOUT, config.SOAR_API_TIMEOUT)
         self.retry_count = config.SOAR_RETRY_COUNT
         self.retry_delay = config.SOAR_RETRY_DELAY
         self.verify_ssl = config.SOAR_VERIFY_SSL
+        self.circuit_breaker = soar_circuit_breaker
+        self.metrics = soar_metrics
+
+    def _backoff(self, attempt):
+        """第 attempt 次重试前的等待时间：以 SOAR_RETRY_DELAY 为基础指数退避，加全抖动"""
+        return random.uniform(0, min(SOAR_RETRY_MAX_DELAY, self.retry_delay * (2 ** attempt)))
+
+    def _request(self, endpoint: str, method: str, url: str, idempotent: bool = True, **kwargs) -> Any:
+        """
+        发送请求并返回响应JSON中的 result 字段
+        :param endpoint: 接口名，用于统计
+        :param idempotent: 是否可以在请求可能已被服务端处理后重试（POST提交剧本为False）
+        :raises SOARUnavailableError: 熔断中
+        :raises SOARError: 重试后仍失败，或遇到不可重试的错误
+        """
+        if not self.circuit_breaker.allow():
+            self.metrics.record_rejected(endpoint)
+            raise SOARUnavailableError(
+                f"SOAR接口熔断中，{self.circuit_breaker.retry_after():.0f} 秒后重试: {endpoint}"
+            )
+
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                response = get_http_session().request(
+                    method, url, headers=self.headers, timeout=self.timeout, verify=self.verify_ssl, **kwargs
+                )
+                if response.status_code in SOAR_RETRYABLE_STATUS:
+                    raise SOARError(f"{endpoint} 返回 {response.status_code}: {response.text[:200]}")
+                response.raise_for_status()
+                result = response.json().get('result')
+            except (requests.ConnectionError, requests.Timeout, SOARError) as e:
+                retryable = idempotent or _not_sent(e)
+                if retryable and attempt < self.retry_count:
+                    delay = self._backoff(attempt)
+                    logger.warning(f"SOAR请求失败，{delay:.1f}秒后进行第 {attempt + 1} 次重试: {e}")
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self.circuit_breaker.record_failure()
+                self.metrics.record(endpoint, time.monotonic() - started, False, attempt)
+                raise e if isinstance(e, SOARError) else SOARError(f"{endpoint} 请求失败: {e}") from e
+            except (requests.RequestException, ValueError) as e:
+                # 4xx 或响应无法解析：请求本身的问题，不重试也不计入熔断
+                self.circuit_breaker.record_success()
+                self.metrics.record(endpoint, time.monotonic() - started, False, attempt)
+                raise SOARError(f"{endpoint} 请求失败: {e}") from e
+
+            self.circuit_breaker.record_success()
+            self.metrics.record(endpoint, time.monotonic() - started, True, attempt)
+            return result
 
     def execute_playbook(self, playbook_id: int, params: Dict[str, Any]) -> Optional[str]:
         """
@@ -24,9 +262,10 @@ class SOARClient:
         :param playbook_id: 剧本ID
         :param params: 剧本参数
         :return: 活动ID
+        :raises SOARError: 请求失败
         """
         url = f"{self.base_url}/api/event/execution"
-        
+
         # 构造正确的请求体
         payload = {
             "eventId": 0,  # 固定值，特殊含义
@@ -40,76 +279,91 @@ class SOARClient:
         logger.debug(f"请求体: {payload}")
 
         try:
-            response = requests.post(
-                url,
-                json=payload,
-                headers=self.headers,
-                timeout=self.timeout,
-                verify=self.verify_ssl
-            )
-            response.raise_for_status()
-            result = response.json().get('result')
-            logger.info(f"剧本执行成功，活动ID: {result}")
-            return result
-        except Exception as e:
+            result = self._request('execute_playbook', 'POST', url, idempotent=False, json=payload)
+        except SOARError as e:
             logger.error(f"剧本执行失败: {str(e)}")
-            return None
+            raise
+        logger.info(f"剧本执行成功，活动ID: {result}")
+        return result
 
     def get_playbook_status(self, activity_id: str) -> Optional[Dict[str, Any]]:
         """
         获取剧本执行状态
         :param activity_id: 活动ID
         :return: 状态信息
+        :raises SOARError: 请求失败
         """
         url = f"{self.base_url}/odp/core/v1/api/activity/{activity_id}"
         try:
-            response = requests.get(
-                url,
-                headers=self.headers,
-                timeout=self.timeout,
-                verify=self.verify_ssl
-            )
-            response.raise_for_status()
-            return response.json().get('result')
-        except Exception as e:
+            return self._request('get_playbook_status', 'GET', url)
+        except SOARError as e:
             logger.error(f"获取剧本状态失败: {str(e)}")
-            return None
+            raise
 
     def get_playbook_result(self, activity_id: str) -> Optional[Dict[str, Any]]:
         """
         获取剧本执行结果
         :param activity_id: 活动ID
         :return: 执行结果
+        :raises SOARError: 请求失败
         """
         url = f"{self.base_url}/odp/core/v1/api/event/activity"
         params = {'activityId': activity_id}
         try:
-            response = requests.get(
-                url,
-                headers=self.headers,
-                params=params,
-                timeout=self.timeout,
-                verify=self.verify_ssl
-            )
-            response.raise_for_status()
-            return response.json().get('result')
-        except Exception as e:
+            return self._request('get_playbook_result', 'GET', url, params=params)
+        except SOARError as e:
             logger.error(f"获取剧本结果失败: {str(e)}")
+            raise
+
+    @property
+    def supports_batch_status(self) -> bool:
+        return bool(SOAR_BATCH_STATUS_PATH)
+
+    def get_playbook_statuses(self, activity_ids) -> Dict[str, Dict[str, Any]]:
+        """
+        批量获取剧本执行状态（需配置 SOAR_BATCH_STATUS_PATH）
+        :param activity_ids: 活动ID列表
+        :return: 活动ID -> 状态信息，响应中缺少的活动不在结果中
+        :raises SOARError: 请求失败
+        """
+        url = f"{self.base_url}/{SOAR_BATCH_STATUS_PATH.lstrip('/')}"
+        try:
+            result = self._request('get_playbook_statuses', 'POST', url,
+                                   json={"activityIds": [str(a) for a in activity_ids]})
+        except SOARError as e:
+            logger.error(f"批量获取剧本状态失败: {str(e)}")
+            raise
+        statuses = {}
+        for item in result or []:
+            activity_id = item.get('activityId') or item.get('id')
+            if activity_id is not None:
+                statuses[str(activity_id)] = item
+        return statuses
+
+    def extract_result(self, status: Optional[Dict[str, Any]]) -> Optional[Any]:
+        """状态信息中已携带的执行结果（SOAR_STATUS_RESULT_FIELD），没有时返回None"""
+        if not SOAR_STATUS_RESULT_FIELD or not status:
             return None
+        return status.get(SOAR_STATUS_RESULT_FIELD) or None
 
-    def wait_for_completion(self, activity_id: str, interval: int = 5) -> Optional[Dict[str, Any]]:
+    def wait_for_completion(self, activity_id: str, interval: int = 5, timeout: float = 600) -> Optional[Dict[str, Any]]:
         """
-        等待剧本执行完成
+        等待剧本执行完成（阻塞，Executor 使用异步的剧本活动调度，不调用此方法）
         :param activity_id: 活动ID
         :param interval: 轮询间隔
-        :return: 最终结果
+        :param timeout: 最长等待秒数
+        :return: 最终结果，超时返回None
+        :raises SOARError: 请求重试后仍失败
         """
-        for _ in range(self.retry_count):
+        deadline = time.monotonic() + timeout
+        while True:
             status = self.get_playbook_status(activity_id)
             if status and status.get('executeStatus') == 'SUCCESS':
-                result = self.get_playbook_result(activity_id)
+                result = self.extract_result(status) or self.get_playbook_result(activity_id)
                 # logger.info(f"剧本执行完成，结果: {result}")
                 return result
+            if time.monotonic() + interval > deadline:
+                break
             time.sleep(interval)
         logger.warning(f"剧本执行超时: {activity_id}")
-        return None 
\ No newline at end of file
+        return None
@@ -0,0 +1,193 @@
+"""Agent工作队列
+
+各Agent原先在空闲时固定 sleep(5) 后再轮询自己的表，每一跳最多增加5秒延迟，数据库也承受持续的轮询压力。
+现在每当有记录进入 pending 状态，写入方在提交事务后向对应角色的工作队列发布一条通知：
+
+- 事件（Event）-> _captain，任务（Task）-> _manager，动作（Action）-> _operator，命令（Command）-> _executor
+- 事件状态变更（EventTransition）-> _lifecycle，即Expert的事件生命周期线程
+- 队列为持久化的直连队列（deepsoc_work_<role>），消息只是“有新工作”的唤醒信号，数据库仍是唯一的事实来源
+- Agent空闲时通过 WorkQueueWaiter.wait() 阻塞等待通知（带预取上限），收到后立即查询数据库处理；
+  超过 WORK_RECONCILE_INTERVAL 秒没有通知时也会查询一次，作为遗漏消息的兜底对账
+- RabbitMQ不可用时退化为原先的固定间隔轮询（WORK_POLL_FALLBACK_INTERVAL）
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import pika
+from dotenv import load_dotenv
+
+from app.utils.mq_utils import RabbitMQPublisher, RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_USER, \
+    RABBITMQ_PASSWORD, RABBITMQ_VHOST
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WORK_QUEUE_ENABLED = os.getenv('WORK_QUEUE_ENABLED', 'True').lower() == 'true'
+WORK_QUEUE_PREFETCH = int(os.getenv('WORK_QUEUE_PREFETCH', '10'))
+WORK_RECONCILE_INTERVAL = float(os.getenv('WORK_RECONCILE_INTERVAL', '30'))
+WORK_POLL_FALLBACK_INTERVAL = float(os.getenv('WORK_POLL_FALLBACK_INTERVAL', '5'))
+
+WORK_EXCHANGE_NAME = 'deepsoc_work_exchange'
+WORK_EXCHANGE_TYPE = 'direct'
+
+# 各类记录进入 pending 后由哪个角色处理；_lifecycle 接收事件状态变更
+WORK_ROLES = ('_captain', '_manager', '_operator', '_executor', '_lifecycle')
+
+
+def work_queue_name(role):
+    return f"deepsoc_work{role}"
+
+
+def work_routing_key(role):
+    return f"work.{role.strip('_')}"
+
+
+# 没有传入 publisher 的调用方（Web进程中的接口等）共用一个连接；pika 连接不是线程安全的，发布时需持锁
+_shared_publisher = None
+_shared_lock = threading.Lock()
+
+
+def _publish_shared(message, routing_key):
+    global _shared_publisher
+    with _shared_lock:
+        try:
+            if _shared_publisher is None:
+                _shared_publisher = RabbitMQPublisher(max_retries=1, retry_delay=0)
+            _shared_publisher.publish_message(
+                message_body=message, routing_key=routing_key,
+                exchange_name=WORK_EXCHANGE_NAME, exchange_type=WORK_EXCHANGE_TYPE
+            )
+        except Exception:
+            _shared_publisher = None
+            raise
+
+
+def notify_work(role, publisher=None, **payload):
+    """通知某角色有新的待处理工作
+
+    必须在相关记录提交之后调用，否则消费方可能查询不到。发布失败只记录日志，由定期对账兜底。
+
+    Args:
+        role: 目标角色（见 WORK_ROLES）
+        publisher: 可选的 RabbitMQPublisher，Agent进程传入自己的实例
+        **payload: 附带的信息（event_id、记录ID等），仅用于日志排查
+    """
+    if not WORK_QUEUE_ENABLED:
+        return
+    message = dict(payload, role=role, published_at=time.time())
+    try:
+        if publisher is None:
+            _publish_shared(message, work_routing_key(role))
+        else:
+            publisher.publish_message(
+                message_body=message, routing_key=work_routing_key(role),
+                exchange_name=WORK_EXCHANGE_NAME, exchange_type=WORK_EXCHANGE_TYPE
+            )
+    except Exception as e:
+        logger.warning(f"发布 {role} 工作通知失败，将由定期对账处理: {e}")
+
+
+class WorkQueueWaiter:
+    """Agent侧的工作队列消费者，用于替代空闲时的固定间隔 sleep"""
+
+    def __init__(self, role, prefetch=WORK_QUEUE_PREFETCH,
+                 reconcile_interval=WORK_RECONCILE_INTERVAL,
+                 fallback_interval=WORK_POLL_FALLBACK_INTERVAL):
+        self.role = role
+        self.queue_name = work_queue_name(role)
+        self.prefetch = prefetch
+        self.reconcile_interval = reconcile_interval
+        self.fallback_interval = fallback_interval
+        self.parameters = pika.ConnectionParameters(
+            host=RABBITMQ_HOST, port=RABBITMQ_PORT, virtual_host=RABBITMQ_VHOST,
+            credentials=pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD),
+            heartbeat=600, blocked_connection_timeout=300, socket_timeout=10
+        )
+        self._connection = None
+        self._channel = None
+        self._deliveries = []
+        self._retry_at = 0.0
+
+    def _connect(self):
+        if self._connection and self._connection.is_open and self._channel and self._channel.is_open:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        try:
+            self._connection = pika.BlockingConnection(self.parameters)
+            self._channel = self._connection.channel()
+            self._channel.exchange_declare(exchange=WORK_EXCHANGE_NAME, exchange_type=WORK_EXCHANGE_TYPE, durable=True)
+            self._channel.queue_declare(queue=self.queue_name, durable=True)
+            self._channel.queue_bind(queue=self.queue_name, exchange=WORK_EXCHANGE_NAME,
+                                     routing_key=work_routing_key(self.role))
+            self._channel.basic_qos(prefetch_count=self.prefetch)
+            self._channel.basic_consume(queue=self.queue_name, on_message_callback=self._on_message)
+            self._deliveries = []
+            logger.info(f"{self.role} 已订阅工作队列 {self.queue_name}（prefetch={self.prefetch}）")
+            return True
+        except Exception as e:
+            logger.warning(f"{self.role} 连接工作队列失败，退化为每 {self.fallback_interval} 秒轮询: {e}")
+            self._reset()
+            # 避免每个空闲周期都重连
+            self._retry_at = time.monotonic() + self.reconcile_interval
+            return False
+
+    def _on_message(self, channel, method, properties, body):
+        self._deliveries.append((method.delivery_tag, body))
+
+    def _reset(self):
+        try:
+            if self._connection and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+        self._channel = None
+        self._deliveries = []
+
+    def wait(self, timeout=None):
+        """阻塞直到收到工作通知或到达对账间隔
+
+        收到第一条通知后会一并取走已到达的其余通知（同一批工作只需查询一次数据库），并全部确认。
+
+        Args:
+            timeout: 本次最长等待秒数，默认为对账间隔
+
+        Returns:
+            收到的通知列表；超时（应进行对账查询）时为空列表
+        """
+        if not WORK_QUEUE_ENABLED or not self._connect():
+            time.sleep(min(self.fallback_interval, timeout or self.fallback_interval))
+            return []
+
+        deadline = time.monotonic() + (timeout or self.reconcile_interval)
+        try:
+            while not self._deliveries:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._connection.process_data_events(time_limit=min(remaining, 1.0))
+            self._connection.process_data_events(time_limit=0)
+
+            deliveries, self._deliveries = self._deliveries, []
+            self._channel.basic_ack(delivery_tag=deliveries[-1][0], multiple=True)
+        except Exception as e:
+            logger.warning(f"{self.role} 工作队列连接异常，将重新连接: {e}")
+            self._reset()
+            return []
+
+        messages = []
+        for _, body in deliveries:
+            try:
+                messages.append(json.loads(body))
+            except (ValueError, TypeError):
+                logger.warning(f"{self.role} 忽略无法解析的工作通知: {body[:200]}")
+        logger.debug(f"{self.role} 收到 {len(messages)} 条工作通知")
+        return messages
+
+    def close(self):
+        self._reset()
@@ -16,6 +16,7 @@ from app.models import db
 from app.utils.logging_config import configure_logging
 from app.models.models import Prompt, User
 from app.prompts.default_prompts import DEFAULT_PROMPTS
+from app.prompts.generate_prompt import bump_prompt_version
 from app.utils.mq_consumer import RabbitMQConsumer # Added MQ Consumer
 from app import __version__, get_version, get_version_info
 import sys
@@ -99,6 +100,9 @@ app.register_blueprint(user_bp, url_prefix='/api/user')
 from app.controllers.engineer_chat_api import engineer_chat_bp
 app.register_blueprint(engineer_chat_bp, url_prefix='/api/engineer-chat')
 
+from app.controllers.llm_stats_controller import llm_stats_bp
+app.register_blueprint(llm_stats_bp, url_prefix='/api/llm')
+
 from app.controllers.socket_controller import register_socket_events
 register_socket_events(socketio)
 
@@ -321,6 +325,7 @@ def import_sql_file(sql_path: str = "initial_data.sql"):
 def create_default_prompts():
     """Load built-in prompt content into the database if not already present."""
     with app.app_context():
+        filled = False
         for name, content in DEFAULT_PROMPTS.items():
             prompt = Prompt.query.filter_by(name=name).first()
             if not prompt:
@@ -328,6 +333,10 @@ def create_default_prompts():
                 db.session.add(prompt)
             if not prompt.content:
                 prompt.content = content
+                filled = True
+        if filled:
+            # 已缓存编译后提示词的Agent需要重新加载
+            bump_prompt_version()
         db.session.commit()
         logger.info("默认提示词导入完成")
 
@@ -0,0 +1,30 @@
+"""Add role and cache fields to llm_records
+
+Revision ID: 5c1e8a9d2f41
+Revises: 71f72226a5f5
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5c1e8a9d2f41'
+down_revision = '71f72226a5f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('llm_records', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('role', sa.String(length=32), nullable=True))
+        batch_op.add_column(sa.Column('cache_status', sa.String(length=16), nullable=True))
+        batch_op.add_column(sa.Column('request_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_llm_records_request_hash', ['request_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('llm_records', schema=None) as batch_op:
+        batch_op.drop_index('ix_llm_records_request_hash')
+        batch_op.drop_column('request_hash')
+        batch_op.drop_column('cache_status')
+        batch_op.drop_column('role')
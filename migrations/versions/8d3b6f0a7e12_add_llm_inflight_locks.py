@@ -0,0 +1,32 @@
+"""Add llm_inflight_locks table
+
+Revision ID: 8d3b6f0a7e12
+Revises: 5c1e8a9d2f41
+Create Date: 2026-10-18 00:10:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8d3b6f0a7e12'
+down_revision = '5c1e8a9d2f41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('llm_inflight_locks',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('request_hash', sa.String(length=64), nullable=False),
+        sa.Column('owner', sa.String(length=128), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('response_content', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('request_hash')
+    )
+
+
+def downgrade():
+    op.drop_table('llm_inflight_locks')
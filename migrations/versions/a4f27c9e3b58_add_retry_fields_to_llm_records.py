@@ -0,0 +1,26 @@
+"""Add retry fields to llm_records
+
+Revision ID: a4f27c9e3b58
+Revises: 8d3b6f0a7e12
+Create Date: 2026-10-18 00:20:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a4f27c9e3b58'
+down_revision = '8d3b6f0a7e12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('llm_records', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('retry_count', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('retry_wait_seconds', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('llm_records', schema=None) as batch_op:
+        batch_op.drop_column('retry_wait_seconds')
+        batch_op.drop_column('retry_count')
@@ -0,0 +1,46 @@
+"""Add event_transitions table and events.status_changed_at
+
+Revision ID: a9d2e6c4f3b1
+Revises: f1a8c3d5b7e2
+Create Date: 2026-10-18 05:40:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a9d2e6c4f3b1'
+down_revision = 'f1a8c3d5b7e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status_changed_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE events SET status_changed_at = updated_at")
+
+    op.create_table(
+        'event_transitions',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('event_id', sa.String(length=64), nullable=False),
+        sa.Column('round_id', sa.Integer(), nullable=True),
+        sa.Column('from_status', sa.String(length=32), nullable=True),
+        sa.Column('to_status', sa.String(length=32), nullable=False),
+        sa.Column('dwell_seconds', sa.Float(), nullable=True),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('event_transitions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_event_transitions_event_id'), ['event_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_event_transitions_processed_at'), ['processed_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('event_transitions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_event_transitions_processed_at'))
+        batch_op.drop_index(batch_op.f('ix_event_transitions_event_id'))
+    op.drop_table('event_transitions')
+
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.drop_column('status_changed_at')
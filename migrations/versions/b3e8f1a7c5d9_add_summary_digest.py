@@ -0,0 +1,28 @@
+"""Add digest, execution_watermark and summary_mode to summaries
+
+Revision ID: b3e8f1a7c5d9
+Revises: a9d2e6c4f3b1
+Create Date: 2026-10-18 06:30:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b3e8f1a7c5d9'
+down_revision = 'a9d2e6c4f3b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('summaries', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('digest', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('execution_watermark', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('summary_mode', sa.String(length=16), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('summaries', schema=None) as batch_op:
+        batch_op.drop_column('summary_mode')
+        batch_op.drop_column('execution_watermark')
+        batch_op.drop_column('digest')
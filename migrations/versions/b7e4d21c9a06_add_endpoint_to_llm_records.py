@@ -0,0 +1,24 @@
+"""Add endpoint to llm_records
+
+Revision ID: b7e4d21c9a06
+Revises: a4f27c9e3b58
+Create Date: 2026-10-18 00:30:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4d21c9a06'
+down_revision = 'a4f27c9e3b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('llm_records', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('endpoint', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('llm_records', schema=None) as batch_op:
+        batch_op.drop_column('endpoint')
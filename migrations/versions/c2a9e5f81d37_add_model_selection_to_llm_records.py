@@ -0,0 +1,26 @@
+"""Add model selection fields to llm_records
+
+Revision ID: c2a9e5f81d37
+Revises: b7e4d21c9a06
+Create Date: 2026-10-18 00:40:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c2a9e5f81d37'
+down_revision = 'b7e4d21c9a06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('llm_records', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('estimated_prompt_tokens', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('model_selection', sa.String(length=32), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('llm_records', schema=None) as batch_op:
+        batch_op.drop_column('model_selection')
+        batch_op.drop_column('estimated_prompt_tokens')
@@ -0,0 +1,30 @@
+"""Add work lease columns to events, tasks, actions and commands
+
+Revision ID: d6b3a8e1f4c2
+Revises: c2a9e5f81d37
+Create Date: 2026-10-18 01:20:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd6b3a8e1f4c2'
+down_revision = 'c2a9e5f81d37'
+branch_labels = None
+depends_on = None
+
+TABLES = ('events', 'tasks', 'actions', 'commands')
+
+
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('claimed_by', sa.String(length=128), nullable=True))
+            batch_op.add_column(sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('lease_expires_at')
+            batch_op.drop_column('claimed_by')
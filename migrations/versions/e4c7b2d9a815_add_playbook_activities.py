@@ -0,0 +1,44 @@
+"""Add playbook_activities table
+
+Revision ID: e4c7b2d9a815
+Revises: d6b3a8e1f4c2
+Create Date: 2026-10-18 02:10:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e4c7b2d9a815'
+down_revision = 'd6b3a8e1f4c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'playbook_activities',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('activity_id', sa.String(length=64), nullable=False),
+        sa.Column('command_id', sa.String(length=64), nullable=False),
+        sa.Column('playbook_id', sa.String(length=64), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('soar_status', sa.String(length=32), nullable=True),
+        sa.Column('poll_count', sa.Integer(), nullable=True),
+        sa.Column('next_poll_at', sa.DateTime(), nullable=True),
+        sa.Column('deadline_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('playbook_activities', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_playbook_activities_activity_id'), ['activity_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_playbook_activities_command_id'), ['command_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_playbook_activities_next_poll_at'), ['next_poll_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('playbook_activities', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_playbook_activities_next_poll_at'))
+        batch_op.drop_index(batch_op.f('ix_playbook_activities_command_id'))
+        batch_op.drop_index(batch_op.f('ix_playbook_activities_activity_id'))
+    op.drop_table('playbook_activities')
@@ -0,0 +1,28 @@
+"""Index event_id on tasks, actions, commands and executions
+
+Revision ID: f1a8c3d5b7e2
+Revises: e4c7b2d9a815
+Create Date: 2026-10-18 03:20:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f1a8c3d5b7e2'
+down_revision = 'e4c7b2d9a815'
+branch_labels = None
+depends_on = None
+
+TABLES = ('tasks', 'actions', 'commands', 'executions')
+
+
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(batch_op.f(f'ix_{table}_event_id'), ['event_id'], unique=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_event_id'))
@@ -9,6 +9,7 @@ from dotenv import load_dotenv
 from flask import Flask
 from app.models.models import db, Prompt
 from app.prompts.default_prompts import DEFAULT_PROMPTS
+from app.prompts.generate_prompt import bump_prompt_version
 
 load_dotenv(override=True)
 
@@ -26,6 +27,7 @@ def load_prompt_to_db(name: str, content: str) -> None:
             prompt = Prompt(name=name)
             db.session.add(prompt)
         prompt.content = content
+        bump_prompt_version()
         db.session.commit()
 
 
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+模拟SOAR服务
+
+实现 SOARClient 用到的接口，用于在本地调试剧本提交、状态查询和批量查询，不依赖真实的SOAR环境：
+
+- POST /api/event/execution                    提交剧本，返回活动ID
+- GET  /odp/core/v1/api/activity/<activity_id>  查询活动状态
+- GET  /odp/core/v1/api/event/activity          获取执行结果（activityId 参数）
+- POST /odp/core/v1/api/activity/batch          批量查询活动状态（activityIds 列表）
+- GET  /stats                                   各接口收到的请求数
+
+每个活动的执行时长在 [--min-duration, --max-duration] 秒之间随机，按 --fail-rate 的比例执行失败，
+按 --error-rate 的比例直接返回 503 以模拟SOAR故障。
+
+用法:
+    python tools/mock_soar_server.py --port 18080 --inline-result
+    # .env 中设置
+    SOAR_API_URL=http://127.0.0.1:18080
+    SOAR_BATCH_STATUS_PATH=/odp/core/v1/api/activity/batch
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+STATUS_PREFIX = '/odp/core/v1/api/activity/'
+BATCH_PATH = '/odp/core/v1/api/activity/batch'
+RESULT_PATH = '/odp/core/v1/api/event/activity'
+EXECUTE_PATH = '/api/event/execution'
+
+
+class MockSOAR:
+    """活动状态存储"""
+
+    def __init__(self, min_duration=1.0, max_duration=10.0, fail_rate=0.0, error_rate=0.0, inline_result=False):
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.fail_rate = fail_rate
+        self.error_rate = error_rate
+        self.inline_result = inline_result
+        self.activities = {}
+        self.requests = Counter()
+        self._lock = threading.Lock()
+
+    def submit(self, payload):
+        activity_id = uuid.uuid4().hex
+        with self._lock:
+            self.activities[activity_id] = {
+                'playbook_id': payload.get('executorInstanceId'),
+                'params': {p.get('key'): p.get('value') for p in payload.get('params') or []},
+                'finish_at': time.time() + random.uniform(self.min_duration, self.max_duration),
+                'fails': random.random() < self.fail_rate,
+            }
+        return activity_id
+
+    def result(self, activity_id):
+        activity = self.activities.get(activity_id)
+        if not activity or time.time() < activity['finish_at'] or activity['fails']:
+            return None
+        return {'playbookId': activity['playbook_id'], 'params': activity['params'], 'output': 'mock result'}
+
+    def status(self, activity_id):
+        activity = self.activities.get(activity_id)
+        if not activity:
+            return None
+        if time.time() < activity['finish_at']:
+            execute_status = 'RUNNING'
+        else:
+            execute_status = 'FAILED' if activity['fails'] else 'SUCCESS'
+        status = {'activityId': activity_id, 'executeStatus': execute_status}
+        if self.inline_result and execute_status == 'SUCCESS':
+            status['executeResult'] = self.result(activity_id)
+        return status
+
+
+def make_handler(soar):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, code, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def _fault(self, name):
+            with soar._lock:
+                soar.requests[name] += 1
+            if random.random() < soar.error_rate:
+                self._reply(503, {'message': 'mock soar unavailable'})
+                return True
+            return False
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/stats':
+                self._reply(200, {'result': dict(soar.requests), 'activities': len(soar.activities)})
+            elif url.path == RESULT_PATH:
+                if not self._fault('get_playbook_result'):
+                    activity_id = (parse_qs(url.query).get('activityId') or [''])[0]
+                    self._reply(200, {'result': soar.result(activity_id)})
+            elif url.path.startswith(STATUS_PREFIX):
+                if not self._fault('get_playbook_status'):
+                    status = soar.status(url.path[len(STATUS_PREFIX):])
+                    self._reply(200 if status else 404, {'result': status})
+            else:
+                self._reply(404, {'message': 'not found'})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path == EXECUTE_PATH:
+                if not self._fault('execute_playbook'):
+                    self._reply(200, {'result': soar.submit(self._read_json())})
+            elif url.path == BATCH_PATH:
+                if not self._fault('get_playbook_statuses'):
+                    ids = self._read_json().get('activityIds') or []
+                    self._reply(200, {'result': [s for s in (soar.status(i) for i in ids) if s]})
+            else:
+                self._reply(404, {'message': 'not found'})
+
+    return Handler
+
+
+def start_server(soar, host='127.0.0.1', port=18080):
+    """在后台线程中启动模拟服务，返回 server（调用 server.shutdown() 停止）"""
+    server = ThreadingHTTPServer((host, port), make_handler(soar))
+    threading.Thread(target=server.serve_forever, name='MockSOAR', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟SOAR服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--min-duration', type=float, default=1.0, help='剧本最短执行时间（秒）')
+    parser.add_argument('--max-duration', type=float, default=10.0, help='剧本最长执行时间（秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='剧本执行失败的比例')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='接口返回503的比例')
+    parser.add_argument('--inline-result', action='store_true', help='活动状态中直接携带执行结果')
+    args = parser.parse_args()
+
+    soar = MockSOAR(args.min_duration, args.max_duration, args.fail_rate, args.error_rate, args.inline_result)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(soar))
+    print(f"模拟SOAR服务已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"请求统计: {dict(soar.requests)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,11 @@
 This script starts ``main.py`` along with the five agent roles as
 independent subprocesses. It also handles graceful shutdown when
 receiving ``SIGINT`` or ``SIGTERM``.
+
+The captain, manager, operator and executor roles claim their work with
+row leases, so several replicas of each can run side by side. Set
+``<ROLE>_REPLICAS`` (e.g. ``EXECUTOR_REPLICAS=3``) to choose how many
+processes to start per role. The expert always runs as a single process.
 """
 
 import os
@@ -19,15 +24,26 @@ from dotenv import load_dotenv
 ROOT_DIR = Path(__file__).resolve().parents[1]
 load_dotenv(ROOT_DIR / ".env")
 
+# Roles whose work is claimed through leases and can therefore be replicated
+SCALABLE_ROLES = ["_captain", "_manager", "_operator", "_executor"]
+
+
+def _replicas(role):
+    """Number of processes to start for ``role`` (``<ROLE>_REPLICAS``, default 1)."""
+    value = os.getenv(f"{role.strip('_').upper()}_REPLICAS", "1")
+    try:
+        return max(1, int(value))
+    except ValueError:
+        return 1
+
+
 # Define commands for the main service and each agent role
-AGENT_COMMANDS = [
-    [sys.executable, "main.py"],
-    [sys.executable, "main.py", "-role", "_captain"],
-    [sys.executable, "main.py", "-role", "_manager"],
-    [sys.executable, "main.py", "-role", "_operator"],
-    [sys.executable, "main.py", "-role", "_executor"],
-    [sys.executable, "main.py", "-role", "_expert"],
-]
+AGENT_COMMANDS = [[sys.executable, "main.py"]]
+for _role in SCALABLE_ROLES:
+    AGENT_COMMANDS.extend(
+        [sys.executable, "main.py", "-role", _role] for _ in range(_replicas(_role))
+    )
+AGENT_COMMANDS.append([sys.executable, "main.py", "-role", "_expert"])
 
 processes = []
 _running = True